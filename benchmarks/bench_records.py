@@ -0,0 +1,73 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+import timeit
+import tracemalloc
+import bson
+import pandas as pd
+from unit.metrics import LATENCY_METRICS, THROUGHPUT_METRICS
+from unit.records import MetricRecords
+
+FEATURES = ['io_depth', 'num_jobs', 'block_size_kb']
+
+
+def make_rows(rows):
+    """Builds metric rows shaped like the stress aggregation output."""
+    fields = ['write_pattern'] + FEATURES + list(THROUGHPUT_METRICS) + \
+        list(LATENCY_METRICS)
+    return [{field: float(row % 97 + index) if index else row % 2 * 100
+             for index, field in enumerate(fields)} for row in range(rows)]
+
+
+def bench(label, function, repeat):
+    seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+    print(f'{label:<40} {seconds * 1000:10.1f} ms')
+    return seconds
+
+
+def peak_memory(label, function):
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f'{label:<40} {peak / 2**20:10.1f} MB')
+    return result, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare row dicts with the array-backed MetricRecords.')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    fields = list(rows[0])
+    # 两种聚合结果: `$push: '$$ROOT'` 与 `columnar_group`
+    pushed = bson.encode({'_id': None, 'rows': rows})
+    columnar = bson.encode(dict(
+        {'_id': None}, **{field: [row[field] for row in rows]
+                          for field in fields}))
+    print(f'Rows: {args.rows}, fields: {len(fields)}, BSON: '
+          f'{len(pushed) / 2**20:.1f} MB rows, '
+          f'{len(columnar) / 2**20:.1f} MB columns')
+
+    _, before = peak_memory('row dicts (decode)',
+                            lambda: bson.decode(pushed)['rows'])
+    _, after = peak_memory('MetricRecords (decode)',
+                           lambda: MetricRecords.from_columns(
+                               bson.decode(columnar), fields))
+
+    decode_before = bench('decode + DataFrame(rows)',
+                          lambda: pd.DataFrame(bson.decode(pushed)['rows']),
+                          args.repeat)
+    decode_after = bench('decode + MetricRecords.to_dataframe',
+                         lambda: MetricRecords.from_columns(
+                             bson.decode(columnar), fields).to_dataframe(),
+                         args.repeat)
+
+    print(f'Peak memory: {before / after:.1f}x less, '
+          f'speedup: {decode_before / decode_after:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import timeit
+from bson import ObjectId
+from unit import serializer
+
+
+def make_report(tests, logs_per_test):
+    """Builds a pytest-json-report shaped like a stress suite run."""
+    return {
+        'created': 1718000000.0,
+        'duration': 3600.0,
+        'exitcode': 0,
+        'environment': {'Python': '3.10', 'Platform': 'Windows-10'},
+        'collectors': [{'nodeid': '', 'outcome': 'passed', 'result': []}],
+        'tests': [{
+            'nodeid': f'tests/test_system/test_io.py::TestAMD64MultiPathStress'
+                      f'::test_run_io_operation[{test % 2 * 100}-{test % 32}]',
+            'keywords': ['TestAMD64MultiPathStress',
+                         f'test_run_io_operation[{test % 2 * 100}-'
+                         f'{test % 32}]'],
+            'outcome': 'passed',
+            'call': {
+                'duration': 12.5,
+                'outcome': 'passed',
+                'log': [{'name': 'tests', 'levelname': 'INFO',
+                         'msg': f'stress_read_iops = {1000.0 + log:.2f}',
+                         'created': 1718000000.0 + log}
+                        for log in range(logs_per_test)]
+            }
+        } for test in range(tests)]
+    }
+
+
+def bench(label, function, repeat):
+    seconds = min(timeit.repeat(function, number=1, repeat=repeat))
+    print(f'{label:<40} {seconds * 1000:10.1f} ms')
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare stdlib json with the unit.serializer layer.')
+    parser.add_argument('--tests', type=int, default=500)
+    parser.add_argument('--logs-per-test', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    report = make_report(args.tests, args.logs_per_test)
+    documents = [{'_id': ObjectId(), 'created': datetime.datetime.now(),
+                  'report': report}]
+
+    with tempfile.TemporaryDirectory() as directory:
+        report_path = os.path.join(directory, '.report.json')
+        with open(report_path, 'w') as file:
+            json.dump(report, file)
+        size = os.path.getsize(report_path) / 2**20
+        print(f'Report: {size:.1f} MB, backend: {serializer.BACKEND}')
+
+        def stdlib_load():
+            with open(report_path, 'r') as file:
+                json.load(file)
+
+        def stdlib_dump():
+            with open(os.path.join(directory, 'a.json'), 'w') as file:
+                json.dump(documents, file, default=str)
+
+        load_before = bench('json.load', stdlib_load, args.repeat)
+        load_after = bench('serializer.load_file',
+                           lambda: serializer.load_file(report_path),
+                           args.repeat)
+        dump_before = bench('json.dump(default=str)', stdlib_dump,
+                            args.repeat)
+        dump_after = bench('serializer.dump_file',
+                           lambda: serializer.dump_file(
+                               documents, os.path.join(directory, 'b.json')),
+                           args.repeat)
+
+    print(f'Decode speedup: {load_before / load_after:.1f}x, '
+          f'encode speedup: {dump_before / dump_after:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def tree_predictions(forest, settings):
+    """
+    Predicts configurations with every tree of a random forest.
+
+    Args:
+        forest (RandomForestRegressor): A fitted forest.
+        settings (DataFrame): One row per configuration.
+
+    Returns:
+        ndarray: The predictions, one row per tree.
+    """
+    X = settings.to_numpy(dtype=np.float32)
+    return np.stack([tree.predict(X) for tree in forest.estimators_])
+
+
+class ActiveLearningScheduler(object):
+    """
+    Picks the I/O configurations worth measuring next for an `MLModel`.
+
+    The spread of the per-tree predictions of the random forest estimates
+    how unsure the model is about each configuration. Every round the
+    unmeasured configurations with the highest upper confidence bound,
+    mean + exploration * std, are run on the rig, ingested through
+    `write_log_and_report` and the forest is refitted on all measurements.
+    (`update_model` is not used: trees grown only on a small local batch
+    would dominate the spread far away from it.)
+    The loop stops once the predicted best setting has not changed for
+    `patience` rounds and no unmeasured configuration has an upper bound
+    meaningfully above its prediction, instead of sweeping the whole
+    search space.
+
+    Attributes:
+        model (MLModel): The model choosing and learning from the batches.
+        batch_size (int): The configurations measured per round.
+        exploration (float): The weight of the uncertainty in the bound.
+        patience (int): The unchanged rounds that count as converged.
+        tolerance (float): The relative margin by which an upper bound may
+        exceed the predicted best without counting as a possible gain.
+        max_rounds (int): The round limit.
+        measured (set): The feature value tuples already measured.
+        history (list): One summary dict per round.
+    """
+    def __init__(self, model, batch_size=4, exploration=1.96, patience=2,
+                 tolerance=0.01, max_rounds=20):
+        self.model = model
+        self.batch_size = batch_size
+        self.exploration = exploration
+        self.patience = patience
+        self.tolerance = tolerance
+        self.max_rounds = max_rounds
+        self.measured = set()
+        self.history = []
+        # 已有数据中的配置都视为已测量, 包括测试集和增量更新读入的行
+        for name in ('dataframe', 'X_train', 'X_test'):
+            settings = getattr(model, name, None)
+            if settings is not None:
+                self._mark_measured(settings)
+
+    def _mark_measured(self, settings):
+        self.measured.update(tuple(row) for row in
+                             settings[self.model.features].to_numpy().tolist())
+
+    def initial_design(self, size=None):
+        """
+        Spreads a first batch evenly over the search grid, for models
+        without any training data yet.
+
+        Tree spread is only informative between measured points, so the
+        default size grows with the square root of the grid.
+
+        Args:
+            size (int): The number of configurations (default: None uses
+            the larger of `batch_size` and the square root of the grid size).
+
+        Returns:
+            DataFrame: The configurations to measure.
+        """
+        grid = self.model.search_grid()
+        size = size or max(self.batch_size, int(np.ceil(np.sqrt(len(grid)))))
+        size = min(size, len(grid))
+        positions = np.unique(np.linspace(0, len(grid) - 1, size).round())
+        return grid.iloc[positions.astype(int)]
+
+    def score(self, settings):
+        """
+        Scores configurations by the mean and spread of the tree predictions.
+
+        Returns:
+            DataFrame: The 'mean', 'std' and 'ucb' of every configuration.
+        """
+        import pandas as pd
+
+        per_tree = tree_predictions(self.model.model, settings)
+        mean = per_tree.mean(axis=0)
+        std = per_tree.std(axis=0)
+        return pd.DataFrame({'mean': mean, 'std': std,
+                             'ucb': mean + self.exploration * std},
+                            index=settings.index)
+
+    def propose(self, batch_size=None):
+        """
+        Picks the most informative unmeasured configurations.
+
+        Configurations violating the constraints of the model spec are
+        skipped.
+
+        Args:
+            batch_size (int): The number of configurations (default: None
+            uses `batch_size`).
+
+        Returns:
+            DataFrame: The configurations, highest upper bound first; empty
+            once every feasible configuration has been measured.
+        """
+        grid = self.model.search_grid()
+        keys = [tuple(row) for row in grid.to_numpy().tolist()]
+        candidates = grid[[key not in self.measured for key in keys]]
+        if self.model.spec.get('constraints') and not candidates.empty:
+            feasible = self.model.feasible(
+                self.model.predict_objectives(candidates))
+            candidates = candidates[feasible.to_numpy()]
+        if candidates.empty:
+            return candidates
+
+        scores = self.score(candidates)
+        order = scores['ucb'].sort_values(ascending=False, kind='stable')
+        return candidates.loc[order.index[:batch_size or self.batch_size]]
+
+    def predicted_best(self, setting):
+        """Predicts the primary objective of a setting dict."""
+        if setting is None:
+            return -np.inf
+        values = [setting[name] for name in self.model.features]
+        return float(self.model.predict([values])[0])
+
+    def refit(self):
+        """
+        Retrains the model on every measurement.
+
+        Returns:
+            int: The number of metric rows trained on.
+        """
+        self.model.prepare_data()
+        self.model.train_model()
+        return len(self.model.dataframe)
+
+    def measure(self, batch, run_batch):
+        """
+        Runs a batch on the rig and ingests its results.
+
+        Args:
+            batch (DataFrame): The configurations to run.
+            run_batch (callable): Runs the I/O tests of a list of
+            configuration dicts and returns the (log_path, report_path) of
+            the results.
+        """
+        log_path, report_path = run_batch(batch.to_dict('records'))
+        self.model.mongodb.write_log_and_report(log_path, report_path)
+        self._mark_measured(batch)
+
+    def run(self, run_batch):
+        """
+        Measures batches until the predicted best setting converges.
+
+        Args:
+            run_batch (callable): See `measure`.
+
+        Returns:
+            dict: The 'best_setting', the number of 'rounds' and 'measured'
+            configurations and whether the search 'converged'.
+        """
+        if self.model.model is None:
+            self.measure(self.initial_design(), run_batch)
+            self.refit()
+
+        best = self.model.find_best_setting()
+        stable = 0
+        converged = False
+        for round_number in range(1, self.max_rounds + 1):
+            batch = self.propose()
+            if batch.empty:
+                converged = True
+                break
+            scores = self.score(batch)
+            bound = self.predicted_best(best)
+            if stable >= self.patience and \
+                    scores['ucb'].max() <= bound + self.tolerance * abs(bound):
+                converged = True
+                break
+            self.measure(batch, run_batch)
+            rows = self.refit()
+
+            setting = self.model.find_best_setting()
+            stable = stable + 1 if setting == best else 0
+            best = setting
+            self.history.append({'round': round_number,
+                                 'batch': batch.to_dict('records'),
+                                 'rows': rows,
+                                 'max_ucb': scores['ucb'].max(),
+                                 'best_setting': best})
+            logger.info(f'Round {round_number}: measured {len(batch)} '
+                        f'configurations ({len(self.measured)} in total), '
+                        f"max ucb {scores['ucb'].max():.1f}, best {best}")
+
+        return {'best_setting': best, 'rounds': len(self.history),
+                'measured': len(self.measured), 'converged': converged}
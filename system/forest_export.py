@@ -0,0 +1,293 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+import hashlib
+import json
+import logging
+import numpy as np
+
+# 只依赖 numpy, 代理程序与 Jenkins 流水线加载导出的模型时无需导入 sklearn
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'value')
+
+
+class CompiledForest(object):
+    """
+    A fitted random forest regressor flattened into node arrays.
+
+    The nodes of all trees are concatenated; `left` and `right` hold global
+    node indices and leaves point to themselves, so every tree is walked in
+    `depth` steps of the same array operations, all trees and rows at once.
+
+    Attributes:
+        feature (ndarray): The feature index tested by every node.
+        threshold (ndarray): The split threshold of every node; rows with
+        a feature value less than or equal go left.
+        left (ndarray): The left child of every node.
+        right (ndarray): The right child of every node.
+        value (ndarray): The prediction of every node, used at the leaves.
+        roots (ndarray): The root node of every tree.
+        depth (int): The depth of the deepest tree.
+    """
+    def __init__(self, feature, threshold, left, right, value, roots, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+
+    @classmethod
+    def from_estimator(cls, estimator):
+        """
+        Compiles a fitted `RandomForestRegressor`.
+
+        Raises:
+            ValueError: If the forest predicts more than one output.
+        """
+        if estimator.n_outputs_ != 1:
+            raise ValueError(f'Cannot export a forest with '
+                             f'{estimator.n_outputs_} outputs')
+        trees = [tree.tree_ for tree in estimator.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        features, lefts, rights = [], [], []
+        for tree, offset in zip(trees, offsets):
+            nodes = np.arange(tree.node_count) + offset
+            leaf = tree.children_left == -1
+            # 叶节点指向自身, 遍历到叶节点后停留不动
+            features.append(np.where(leaf, 0, tree.feature))
+            lefts.append(np.where(leaf, nodes, tree.children_left + offset))
+            rights.append(np.where(leaf, nodes, tree.children_right + offset))
+        return cls(np.concatenate(features).astype(np.int32),
+                   np.concatenate([tree.threshold for tree in trees]),
+                   np.concatenate(lefts).astype(np.int32),
+                   np.concatenate(rights).astype(np.int32),
+                   np.concatenate([tree.value[:, 0, 0] for tree in trees]),
+                   offsets[:-1].astype(np.int32),
+                   max(tree.max_depth for tree in trees))
+
+    @property
+    def nbytes(self):
+        """The bytes held by the node arrays."""
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def predict(self, X, chunk_size=4096):
+        """
+        Predicts every row of a feature matrix.
+
+        Args:
+            X (ndarray): One row per configuration, one column per feature.
+            chunk_size (int): The rows walked at once, bounding the
+            `trees x rows` index matrix.
+
+        Returns:
+            ndarray: The mean prediction of the trees for every row.
+        """
+        # sklearn 以 float32 比较特征值与阈值, 保持一致以得到相同的分支
+        X = np.asarray(X, dtype=np.float32)
+        predictions = np.empty(len(X))
+        for start in range(0, len(X), chunk_size):
+            chunk = X[start:start + chunk_size]
+            rows = np.arange(len(chunk))
+            nodes = np.repeat(self.roots[:, None], len(chunk), axis=1)
+            for _ in range(self.depth):
+                go_left = chunk[rows, self.feature[nodes]] <= \
+                    self.threshold[nodes]
+                nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+            predictions[start:start + len(chunk)] = \
+                self.value[nodes].mean(axis=0)
+        return predictions
+
+
+class ForestPredictor(object):
+    """
+    Serves the predictions of a trained `MLModel` without sklearn.
+
+    Holds the compiled forest of every trained objective together with the
+    feature order, search axes, objective goals and constraints of the
+    model, and is saved to a single `.npz` file.
+
+    Attributes:
+        features (list): The feature columns, in model order.
+        axes (list): The candidate values of every feature.
+        forests (dict): The `CompiledForest` of every objective by name.
+        goals (dict): 'max' or 'min' for every objective.
+        constraints (dict): Default bounds on predicted objectives.
+        primary (str): The objective maximized by `best_setting`.
+    """
+    def __init__(self, features, axes, forests, goals=None, constraints=None,
+                 primary='performance'):
+        self.features = list(features)
+        self.axes = [np.asarray(axis) for axis in axes]
+        self.forests = forests
+        self.goals = goals or {primary: 'max'}
+        self.constraints = constraints or {}
+        self.primary = primary
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Compiles the trained forests of an `MLModel`.
+
+        Raises:
+            RuntimeError: If the model is not trained.
+        """
+        if model.model is None:
+            raise RuntimeError('Model must be trained before it is exported.')
+        forests = {model.PRIMARY_OBJECTIVE:
+                   CompiledForest.from_estimator(model.model)}
+        for name, estimator in model.objective_models.items():
+            forests[name] = CompiledForest.from_estimator(estimator)
+        goals = {name: objective['goal']
+                 for name, objective in model.objectives().items()}
+        return cls(model.features,
+                   [model.search_axis(name) for name in model.features],
+                   forests, goals, model.spec.get('constraints', {}),
+                   model.PRIMARY_OBJECTIVE)
+
+    def header(self):
+        """The JSON-serializable description saved next to the arrays."""
+        return {'format_version': FORMAT_VERSION,
+                'features': self.features,
+                'objectives': list(self.forests),
+                'goals': self.goals,
+                'constraints': self.constraints,
+                'primary': self.primary}
+
+    def fingerprint(self):
+        """
+        Hashes the forests, features and search axes.
+
+        Returns:
+            str: The SHA-256 hex digest; equal for identical models.
+        """
+        digest = hashlib.sha256(json.dumps(self.header(),
+                                           sort_keys=True).encode())
+        for axis in self.axes:
+            digest.update(np.ascontiguousarray(axis, dtype=float).tobytes())
+        for name, forest in self.forests.items():
+            digest.update(name.encode())
+            for array in ARRAYS + ('roots',):
+                digest.update(np.ascontiguousarray(
+                    getattr(forest, array)).tobytes())
+        return digest.hexdigest()
+
+    def save(self, path):
+        """Writes the predictor to an uncompressed `.npz` file."""
+        arrays = {'header': np.array(json.dumps(self.header()))}
+        for index, axis in enumerate(self.axes):
+            arrays[f'axis.{index}'] = axis
+        for name, forest in self.forests.items():
+            for array in ARRAYS + ('roots',):
+                arrays[f'{name}.{array}'] = getattr(forest, array)
+            arrays[f'{name}.depth'] = np.array(forest.depth)
+        np.savez(path, **arrays)
+        logger.info(f'Exported {len(self.forests)} forests to {path}')
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a predictor written by `save`.
+
+        Raises:
+            ValueError: If the file has an unsupported format version.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            header = json.loads(data['header'].item())
+            if header['format_version'] != FORMAT_VERSION:
+                raise ValueError(f"Unsupported format version "
+                                 f"{header['format_version']} of {path}")
+            axes = [data[f'axis.{index}']
+                    for index in range(len(header['features']))]
+            forests = {}
+            for name in header['objectives']:
+                forests[name] = CompiledForest(
+                    *[data[f'{name}.{array}'] for array in ARRAYS],
+                    data[f'{name}.roots'], data[f'{name}.depth'].item())
+        return cls(header['features'], axes, forests, header['goals'],
+                   header['constraints'], header['primary'])
+
+    def predict(self, values, objective=None):
+        """
+        Predicts an objective for a sequence of configurations, like
+        `MLModel.predict`.
+
+        Args:
+            values (list): Feature values; scalars for single-feature models,
+            rows ordered like `features` otherwise.
+            objective (str): The objective (default: None is the primary).
+
+        Returns:
+            ndarray: The prediction for each configuration.
+        """
+        rows = np.asarray(values, dtype=float).reshape(-1, len(self.features))
+        return self.forests[objective or self.primary].predict(rows)
+
+    def search_grid(self):
+        """
+        Builds every combination of candidate feature values, in the order
+        of `MLModel.search_grid`.
+
+        Returns:
+            ndarray: One row per configuration, one column per feature.
+        """
+        mesh = np.meshgrid(*self.axes, indexing='ij')
+        return np.stack([axis.ravel() for axis in mesh], axis=1)
+
+    def best_setting(self, constraints=None):
+        """
+        Finds the feasible configuration of the search grid with the
+        highest predicted primary objective.
+
+        Args:
+            constraints (dict): `{name: {"min"/"max": bound}}` (default:
+            None uses the constraints of the model).
+
+        Returns:
+            dict or None: The value of every feature in the best
+            configuration, or None if no configuration is feasible.
+        """
+        if constraints is None:
+            constraints = self.constraints
+        grid = self.search_grid()
+        feasible = np.ones(len(grid), dtype=bool)
+        for name, bounds in constraints.items():
+            if name not in self.forests:
+                logger.warning(f'No model for constraint {name}, ignored')
+                continue
+            predictions = self.forests[name].predict(grid)
+            if bounds.get('max') is not None:
+                feasible &= predictions <= bounds['max']
+            if bounds.get('min') is not None:
+                feasible &= predictions >= bounds['min']
+        if not feasible.any():
+            logger.warning('No setting satisfies the constraints')
+            return None
+        score = np.where(feasible, self.forests[self.primary].predict(grid),
+                         -np.inf)
+        return dict(zip(self.features, grid[score.argmax()].tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Predict with a forest exported by ForestPredictor.save.')
+    parser.add_argument('path')
+    parser.add_argument('--values', type=float, nargs='+', default=None,
+                        help='Predict these values instead of searching '
+                             'the best setting')
+    parser.add_argument('--objective', default=None)
+    args = parser.parse_args()
+
+    predictor = ForestPredictor.load(args.path)
+    if args.values is None:
+        print(json.dumps(predictor.best_setting()))
+    else:
+        print(json.dumps(predictor.predict(args.values,
+                                           args.objective).tolist()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+import datetime
+import glob
+import json
+import logging
+import os
+import numpy as np
+from system.forest_export import ForestPredictor
+
+logger = logging.getLogger(__name__)
+
+TABLE_VERSION = 1
+TABLE_ROOT = 'lookup_tables'
+
+
+class LookupTable(object):
+    """
+    Predicted objectives of every configuration in a model's search space,
+    precomputed for one hardware profile.
+
+    The predictions are stored as a float32 `.npy` array with one axis per
+    objective and per feature, opened memory-mapped, so looking up a
+    configuration is a single index into the page cache. A JSON header
+    next to it records the table version, the fingerprint of the model it
+    was computed from, the feature axes and the best setting under the
+    model's constraints. Each fingerprint writes its own `.npy` file and
+    the header is replaced last, so readers never see a half-written
+    table. The table the replaced header pointed to is only removed by the
+    build after next, so a reader that has just read the old header can
+    still open it.
+
+    Attributes:
+        header (dict): The table description.
+        table (memmap): The predictions, shaped
+        `(objectives, *axis lengths)`.
+    """
+    def __init__(self, header, table):
+        self.header = header
+        self.table = table
+        self.features = header['features']
+        self._objectives = {name: index for index, name in
+                            enumerate(header['objectives'])}
+        # 特征取值到数组下标的映射, 查找时无需搜索
+        self._positions = [{value: index for index, value in enumerate(axis)}
+                           for axis in header['axes']]
+
+    @staticmethod
+    def paths(root, profile, name):
+        """
+        Names the header of a table.
+
+        Args:
+            root (str): The folder holding every profile.
+            profile (str): The hardware/RAID profile, e.g. the collection
+            name of its results.
+            name (str): The model spec name.
+
+        Returns:
+            str: The header path; tables sit next to it.
+        """
+        return os.path.join(root, profile, f'{name}.json')
+
+    @classmethod
+    def open(cls, root, profile, name):
+        """
+        Opens a table built by `build`.
+
+        Returns:
+            LookupTable or None: The table, or None if it was never built or
+            has an unsupported version.
+        """
+        header_path = cls.paths(root, profile, name)
+        try:
+            with open(header_path, 'r') as file:
+                header = json.load(file)
+        except FileNotFoundError:
+            return None
+        if header.get('table_version') != TABLE_VERSION:
+            logger.warning(f"Ignored table {header_path} of version "
+                           f"{header.get('table_version')}")
+            return None
+        table = np.load(os.path.join(os.path.dirname(header_path),
+                                     header['table']), mmap_mode='r')
+        return cls(header, table)
+
+    @classmethod
+    def build(cls, predictor, root, profile, name):
+        """
+        Predicts the whole search grid and writes the table.
+
+        Args:
+            predictor (ForestPredictor): The exported model.
+            root (str): See `paths`.
+            profile (str): See `paths`.
+            name (str): See `paths`.
+
+        Returns:
+            LookupTable: The new table, memory-mapped.
+        """
+        header_path = cls.paths(root, profile, name)
+        folder = os.path.dirname(header_path)
+        os.makedirs(folder, exist_ok=True)
+        fingerprint = predictor.fingerprint()
+        table_name = f'{name}-{fingerprint[:16]}.npy'
+
+        grid = predictor.search_grid()
+        shape = tuple(len(axis) for axis in predictor.axes)
+        table = np.stack([forest.predict(grid).reshape(shape)
+                          for forest in predictor.forests.values()])
+        table_path = os.path.join(folder, table_name)
+        with open(f'{table_path}.tmp', 'wb') as file:
+            np.save(file, table.astype(np.float32))
+        os.replace(f'{table_path}.tmp', table_path)
+        previous = cls._table_name(header_path)
+
+        header = {'table_version': TABLE_VERSION,
+                  'fingerprint': fingerprint,
+                  'profile': profile,
+                  'name': name,
+                  'table': table_name,
+                  'features': predictor.features,
+                  'axes': [axis.tolist() for axis in predictor.axes],
+                  'objectives': list(predictor.forests),
+                  'primary': predictor.primary,
+                  'best': predictor.best_setting(),
+                  'built': datetime.datetime.now(
+                      datetime.timezone.utc).isoformat()}
+        with open(f'{header_path}.tmp', 'w') as file:
+            json.dump(header, file, indent=2)
+        os.replace(f'{header_path}.tmp', header_path)
+        logger.info(f'Built lookup table {table_path}: {grid.shape[0]} '
+                    f'settings x {len(predictor.forests)} objectives')
+
+        # 保留旧头部指向的表, 刚读到旧头部的读取方仍可打开, 下次构建再删除
+        for stale in glob.glob(os.path.join(folder, f'{name}-*.npy')):
+            if os.path.basename(stale) in (table_name, previous):
+                continue
+            try:
+                os.remove(stale)
+            except OSError as e:
+                # Windows 下仍被映射的旧表无法删除, 留待下次构建
+                logger.warning(f'Cannot remove stale table {stale}: {e}')
+        return cls.open(root, profile, name)
+
+    @staticmethod
+    def _table_name(header_path):
+        """Returns the table a header points to, or None."""
+        try:
+            with open(header_path, 'r') as file:
+                return json.load(file).get('table')
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def ensure(cls, predictor, root, profile, name):
+        """
+        Opens a table, rebuilding it only if the model fingerprint changed.
+
+        Returns:
+            tuple: The `LookupTable` and whether it was rebuilt.
+        """
+        table = cls.open(root, profile, name)
+        if table is not None and \
+                table.header['fingerprint'] == predictor.fingerprint():
+            logger.info(f'Lookup table {profile}/{name} is up to date')
+            return table, False
+        return cls.build(predictor, root, profile, name), True
+
+    def index(self, setting):
+        """
+        Locates a configuration in the table.
+
+        Args:
+            setting (dict or list): The value of every feature, by name or
+            ordered like `features`; a scalar for single-feature models.
+
+        Returns:
+            tuple: The index along every feature axis.
+
+        Raises:
+            KeyError: If a value is outside the search space.
+        """
+        if isinstance(setting, dict):
+            setting = [setting[feature] for feature in self.features]
+        elif np.ndim(setting) == 0:
+            setting = [setting]
+        index = []
+        for feature, positions, value in zip(self.features, self._positions,
+                                             setting):
+            if value not in positions:
+                raise KeyError(f'{feature} = {value} is not in the '
+                               f'search space')
+            index.append(positions[value])
+        return tuple(index)
+
+    def predicted(self, setting, objective=None):
+        """
+        Looks up the predicted objective of a configuration.
+
+        Args:
+            setting (dict or list): See `index`.
+            objective (str): The objective (default: None is the primary).
+
+        Returns:
+            float: The prediction.
+        """
+        objective = self._objectives[objective or self.header['primary']]
+        return float(self.table[(objective,) + self.index(setting)])
+
+    def best_setting(self):
+        """The best setting under the model's constraints, or None."""
+        return self.header['best']
+
+    def best_value(self):
+        """The best value of the tuned (first) feature, or None."""
+        best = self.best_setting()
+        return best[self.features[0]] if best else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Build recommendation lookup tables of exported models '
+                    'for a hardware profile.')
+    parser.add_argument('models', nargs='+',
+                        help='Files written by MLModel.export, named after '
+                             'their spec, e.g. io_depth.npz')
+    parser.add_argument('--profile', required=True,
+                        help='The hardware/RAID profile, e.g. amd_desktop')
+    parser.add_argument('--root', default=TABLE_ROOT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    for path in args.models:
+        name = os.path.splitext(os.path.basename(path))[0]
+        table, _ = LookupTable.ensure(ForestPredictor.load(path), args.root,
+                                      args.profile, name)
+        logger.info(f'{args.profile}/{name}: best = {table.best_setting()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def quantile_bands(x, y, quantiles=QUANTILES, max_bins=200):
+    """
+    Downsamples a scatter of points to per-x quantile bands.
+
+    Points sharing an x value are summarized by the requested quantiles of
+    their y values. If there are more than `max_bins` distinct x values, x
+    is first binned into `max_bins` equal-width bins represented by their
+    mean x.
+
+    Args:
+        x (array-like): The x coordinates.
+        y (array-like): The y coordinates.
+        quantiles (tuple): The quantiles to keep per x (default: 10/50/90%).
+        max_bins (int): The maximum number of x positions kept.
+
+    Returns:
+        dict: Sorted 'x' positions, the point 'count' per position and one
+        array per quantile keyed like 'q50'.
+    """
+    frame = pd.DataFrame({'x': np.asarray(x, dtype=float).ravel(),
+                          'y': np.asarray(y, dtype=float).ravel()})
+    if frame['x'].nunique() > max_bins:
+        key = pd.cut(frame['x'], bins=max_bins)
+    else:
+        key = frame['x']
+    groups = frame.groupby(key, observed=True, sort=True)
+    bands = {'x': groups['x'].mean().to_numpy(),
+             'count': groups.size().to_numpy()}
+    per_quantile = groups['y'].quantile(list(quantiles)).unstack()
+    for quantile in quantiles:
+        bands[f'q{round(quantile * 100)}'] = per_quantile[quantile].to_numpy()
+    return bands
+
+
+def render_performance_plot(save_path, train_bands, test_bands, prediction,
+                            xlabel, ylabel):
+    """
+    Draws the training/testing quantile bands and the model prediction.
+
+    Runs in the renderer process; only the downsampled bands cross the
+    process boundary.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    try:
+        for bands, color, label in ((train_bands, 'blue', 'Training data'),
+                                    (test_bands, 'green', 'Testing data')):
+            ax.fill_between(bands['x'], bands['q10'], bands['q90'],
+                            color=color, alpha=0.2)
+            ax.plot(bands['x'], bands['q50'], color=color, marker='.',
+                    linestyle='', label=f'{label} (median, 10-90%)')
+        ax.plot(prediction['x'], prediction['y'], color='red',
+                label='Model prediction')
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_title(f'{xlabel} vs {ylabel}')
+        ax.legend()
+        fig.savefig(save_path)
+    finally:
+        plt.close(fig)
+    return save_path
+
+
+def render_heatmap(save_path, corr_matrix):
+    """Draws a correlation matrix heatmap in the renderer process."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig, ax = plt.subplots(figsize=(10, 8))
+    try:
+        sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f",
+                    ax=ax)
+        ax.set_title('Correlation Matrix Heatmap')
+        fig.savefig(save_path)
+    finally:
+        plt.close(fig)
+    return save_path
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=1)
+            atexit.register(shutdown)
+        return _executor
+
+
+def submit(render, *args):
+    """
+    Renders a figure in the background renderer process.
+
+    Args:
+        render (callable): A module-level render function of this module.
+        *args: The arguments of the render function.
+
+    Returns:
+        Future: Resolves to the saved path once the figure is written.
+    """
+    future = _get_executor().submit(render, *args)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+def shutdown(wait=True):
+    """Stops the renderer process, by default after pending figures."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f'Error rendering figure: {future.exception()}')
@@ -0,0 +1,409 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import queue
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyRecorder(object):
+    """
+    Keeps a sliding window of request latencies per endpoint.
+
+    Attributes:
+        window (int): The number of most recent samples kept per endpoint.
+    """
+    def __init__(self, window=10000):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds):
+        """
+        Records the latency of one request.
+
+        Args:
+            endpoint (str): The endpoint that served the request.
+            seconds (float): The time spent serving the request.
+        """
+        with self._lock:
+            samples = self._samples.setdefault(endpoint,
+                                               deque(maxlen=self.window))
+            samples.append(seconds)
+
+    def summary(self):
+        """
+        Summarizes the recorded latencies.
+
+        Returns:
+            dict: Per endpoint, the sample count and p50/p99 in milliseconds.
+        """
+        with self._lock:
+            snapshot = {name: list(samples)
+                        for name, samples in self._samples.items()}
+        summary = {}
+        for name, samples in snapshot.items():
+            if not samples:
+                continue
+            p50, p99 = np.percentile(samples, [50, 99]) * 1000
+            summary[name] = {'count': len(samples),
+                             'p50_ms': round(float(p50), 3),
+                             'p99_ms': round(float(p99), 3)}
+        return summary
+
+
+class MicroBatcher(object):
+    """
+    Coalesces concurrent prediction requests into single `predict` calls.
+
+    Requests are queued by the HTTP handler threads. A single worker thread
+    drains the queue, groups pending requests by model and runs one
+    vectorized prediction per model, then splits the result back to the
+    waiting requests. Every request is converted to feature rows before it
+    is queued, so a malformed request fails alone instead of failing the
+    batch it would have joined.
+
+    Attributes:
+        models (dict): The trained `MLModel` instances keyed by name.
+        max_batch_size (int): The maximum number of rows per `predict` call.
+        max_wait (float): The maximum time in seconds to wait for more
+        requests once the first one of a batch has arrived.
+    """
+    def __init__(self, models, max_batch_size=4096, max_wait=0.002):
+        self.models = models
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_requests = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, model_name, values):
+        """
+        Queues feature values for prediction.
+
+        Args:
+            model_name (str): The name of the model to predict with.
+            values (list): Feature values; scalars for single-feature models,
+            rows ordered like the model's `features` otherwise.
+
+        Returns:
+            Future: Resolves to the ndarray of predictions, or fails with a
+            ValueError if `values` are not rows of numeric features.
+
+        Raises:
+            KeyError: If no model is registered under `model_name`.
+        """
+        if model_name not in self.models:
+            raise KeyError(f'Unknown model: {model_name}')
+        future = Future()
+        features = len(getattr(self.models[model_name], 'features', [None]))
+        try:
+            rows = np.asarray(values, dtype=float)
+            if rows.size == 0 or rows.size % features:
+                raise ValueError(f'Expected rows of {features} feature '
+                                 f'values, got {rows.size} values')
+            rows = rows.reshape(-1, features)
+        except (TypeError, ValueError) as e:
+            # 只让这个请求失败, 不影响同一批次中的其他请求
+            future.set_exception(ValueError(f'Invalid values: {e}'))
+            return future
+        self._queue.put((model_name, rows, future))
+        return future
+
+    def close(self):
+        """Stops the worker thread once the queued requests are served."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        rows = len(first[1])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Serve what was collected, then let _run see the sentinel
+                self._queue.put(None)
+                break
+            batch.append(request)
+            rows += len(request[1])
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self.batches += 1
+            self.batched_requests += len(batch)
+
+            by_model = {}
+            for request in batch:
+                by_model.setdefault(request[0], []).append(request)
+            for model_name, requests in by_model.items():
+                self._predict(self.models[model_name], requests)
+
+    @staticmethod
+    def _predict(model, requests):
+        rows = np.concatenate([request[1] for request in requests])
+        try:
+            predictions = model.predict(rows)
+        except Exception as e:
+            for _, _, future in requests:
+                future.set_exception(e)
+            return
+        offsets = np.cumsum([len(request[1]) for request in requests])[:-1]
+        for (_, _, future), chunk in zip(requests,
+                                         np.split(predictions, offsets)):
+            future.set_result(chunk)
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the JSON prediction API.
+
+    Endpoints:
+        POST /predict: {"model": name, "values": [...]} returns the predicted
+        performance of every value.
+        POST /best: {"model": name, "queries": [[...], ...]} returns the best
+        value and its predicted performance for every candidate list. A null
+        or missing query searches the whole search grid of the model.
+        GET /stats: Latency percentiles and batching counters.
+        GET /health: Liveness probe.
+
+    Malformed requests are answered with 400, predictions not served
+    within the service timeout with 504 and any other failure with 500.
+    """
+    def do_GET(self):
+        if self.path == '/health':
+            self._reply(200, {'status': 'ok'})
+        elif self.path == '/stats':
+            self._reply(200, self.server.service.stats())
+        else:
+            self._reply(404, {'error': f'Unknown path: {self.path}'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/predict':
+                result = self.server.service.predict(body['model'],
+                                                     body['values'])
+            elif self.path == '/best':
+                result = self.server.service.best(body['model'],
+                                                  body.get('queries'))
+            else:
+                self._reply(404, {'error': f'Unknown path: {self.path}'})
+                return
+        except (KeyError, TypeError, ValueError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except FutureTimeoutError:
+            self._reply(504, {'error': 'Prediction timed out after '
+                                       f'{self.server.service.timeout}s'})
+            return
+        except Exception as e:
+            # 其余异常 (如模型预测失败) 也需回复, 否则连接会被直接断开
+            logger.exception(f'Error serving {self.path}')
+            self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self._reply(200, result)
+        self.server.service.latency.record(self.path,
+                                           time.perf_counter() - start)
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class PredictionService(object):
+    """
+    A long-lived HTTP service keeping trained models warm in memory.
+
+    Attributes:
+        models (dict): The trained `MLModel` instances keyed by name.
+        batcher (MicroBatcher): Coalesces concurrent predictions.
+        latency (LatencyRecorder): Per-endpoint request latencies.
+        timeout (float): Seconds a request waits for its prediction.
+        server (ThreadingHTTPServer): The HTTP server, once started.
+    """
+    def __init__(self, models, host='127.0.0.1', port=8080,
+                 max_batch_size=4096, max_wait=0.002, timeout=30.0):
+        self.models = models
+        self.timeout = timeout
+        self.batcher = MicroBatcher(models, max_batch_size, max_wait)
+        self.latency = LatencyRecorder()
+        self.server = ThreadingHTTPServer((host, port),
+                                          PredictionRequestHandler)
+        self.server.daemon_threads = True
+        self.server.service = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def predict(self, model_name, values):
+        """
+        Predicts performance for a list of feature values.
+
+        Returns:
+            dict: The predictions in request order.
+
+        Raises:
+            TimeoutError: If the prediction takes longer than `timeout`.
+        """
+        predictions = self.batcher.submit(model_name, values).result(
+            self.timeout)
+        return {'predictions': predictions.tolist()}
+
+    def best(self, model_name, queries):
+        """
+        Finds the best value of every candidate list in one batched call.
+
+        Args:
+            model_name (str): The name of the model to predict with.
+            queries (list): Candidate value lists; None searches the
+            whole search grid of the model.
+
+        Returns:
+            dict: The best value and predicted performance per query.
+        """
+        if queries is None:
+            queries = [None]
+        if None in queries:
+            candidates = self.candidates(model_name)
+            queries = [candidates if query is None else query
+                       for query in queries]
+        if not all(queries):
+            raise ValueError('Queries must not be empty')
+        futures = [self.batcher.submit(model_name, query)
+                   for query in queries]
+        best = []
+        for query, future in zip(queries, futures):
+            predictions = future.result(self.timeout)
+            index = int(predictions.argmax())
+            best.append({'value': query[index],
+                         'performance': float(predictions[index])})
+        return {'best': best}
+
+    def candidates(self, model_name):
+        """
+        Lists every configuration of a model's search grid.
+
+        Args:
+            model_name (str): The name of the model.
+
+        Returns:
+            list: Scalars for single-feature models, rows ordered like the
+            model's `features` otherwise.
+        """
+        model = self.models[model_name]
+        if not hasattr(model, 'search_grid'):
+            return list(range(1, model.range))
+        grid = np.asarray(model.search_grid())
+        if grid.shape[1] == 1:
+            return grid[:, 0].tolist()
+        return grid.tolist()
+
+    def stats(self):
+        """
+        Reports latency percentiles and batching efficiency.
+
+        Returns:
+            dict: Latency summary per endpoint and batching counters.
+        """
+        batches = self.batcher.batches
+        return {
+            'latency': self.latency.summary(),
+            'batches': batches,
+            'avg_requests_per_batch': (self.batcher.batched_requests / batches
+                                       if batches else 0.0)
+        }
+
+    def start(self):
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        logger.info(f'Prediction service listening on {self.address}')
+
+    def serve_forever(self):
+        """Serves requests on the calling thread until interrupted."""
+        logger.info(f'Prediction service listening on {self.address}')
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stops the HTTP server and the batching thread."""
+        if self._thread:
+            self.server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server.server_close()
+        self.batcher.close()
+        logger.info(f'Latency summary: {self.latency.summary()}')
+
+
+def main():
+    from system.ven_1b4b import MLRampTime, MLStressMetric
+    from unit.mongodb import MongoDB, load_read_routing
+
+    parser = argparse.ArgumentParser(
+        description='Serve best-setting recommendations over HTTP.')
+    parser.add_argument('--db-ip', default='192.168.0.128')
+    parser.add_argument('--db-port', type=int, default=27017)
+    parser.add_argument('--db-name', default='AutoRAID')
+    parser.add_argument('--collection', default='amd_desktop')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='Seconds a request waits for its prediction')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    mongodb = MongoDB(args.db_ip, args.db_port, args.db_name, args.collection,
+                      read_routing=load_read_routing())
+    models = {'ramp_times': MLRampTime(mongodb, range=180),
+              'io_depth': MLStressMetric(mongodb, range=32)}
+    for model in models.values():
+        model.prepare_data()
+        model.train_model()
+
+    PredictionService(models, args.host, args.port,
+                      timeout=args.timeout).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,194 +1,661 @@
-from abc import ABC, abstractmethod
+from collections import OrderedDict
+import datetime
+import importlib
+import itertools
+import json
 import logging
-import matplotlib.pyplot as plt
+import numpy as np
+from bson import ObjectId
+from unit.metrics import LATENCY_METRICS, THROUGHPUT_METRICS
 # from pymongo import MongoClient
-import pandas as pd
-import seaborn as sns
-from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error
 # from unit.mongodb import MongoDB as mdb
 
+# pandas, sklearn 与绘图模块导入耗时数秒, 只在用到它们的阶段才导入,
+# 使 pytest 收集和只做预测的命令行工具能快速启动
+
 logger = logging.getLogger(__name__)
 
 
-class MLModel(ABC):
+class _LazyModule(object):
+    """A module imported on the first access to one of its attributes."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+
+pd = _LazyModule('pandas')
+
+SPEC_PATH = 'config/model_specs.json'
+
+
+def load_model_specs(path=SPEC_PATH):
+    """
+    Loads the declarative model specs.
+
+    Args:
+        path (str): The JSON file holding the specs keyed by name.
+
+    Returns:
+        dict: The model specs keyed by name.
+    """
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+class MLModel(object):
+    """
+    A random forest tuning model driven by a declarative spec.
+
+    A spec names the aggregation pipeline producing the metric rows, the
+    feature columns, the target expression evaluated on those rows, the
+    search space of every feature, the estimator parameters and the plot
+    labels. New tuning dimensions only need an entry in
+    `config/model_specs.json`.
+
+    The target is the primary objective, 'performance', which is maximized.
+    Optional secondary `objectives` (e.g. tail latency) each get their own
+    forest, trained on the rows carrying that metric, and `constraints`
+    bound their predicted values when searching for the best setting. An
+    optional `query_options` entry overrides the execution options of the
+    pipeline, e.g. a longer `maxTimeMS` for a large training set.
+
+    Attributes:
+        mongodb (MongoDB): The database the metric rows are aggregated from.
+        spec (dict): The model spec.
+        features (list): The feature columns; the first one is tuned by
+        `find_best_value`.
+        range (int): The exclusive upper bound of the tuned feature.
+        model (RandomForestRegressor): The trained estimator of the primary
+        objective.
+        objective_models (dict): The trained estimators of the secondary
+        objectives keyed by name.
+        last_id (ObjectId): The watermark, the newest `_id` when the
+        training data was last read.
+        watermark_window (float): The seconds before the watermark that
+        `update_model` lists again for late commits.
+        consumed_ids (set): The `_id`s within that window already trained on.
+    """
+
+    SPEC = None
+    PRIMARY_OBJECTIVE = 'performance'
+    # 按 (mongodb, pipeline, limit, since_id, until_id) 缓存已聚合的数据
+    DATA_CACHE_SIZE = 8
+    _data_cache = OrderedDict()
+
+    def __init__(self, mongodb, range=None, spec=None, incremental_trees=20,
+                 max_trees=500, watermark_window=600):
+        spec = spec or self.SPEC
+        if isinstance(spec, str):
+            spec = load_model_specs()[spec]
+        self.spec = spec
+        self.features = list(spec['features'])
+        self.feature = self.features[0]
+        self.search_space = {name: (dict(bounds) if isinstance(bounds, dict)
+                                    else list(bounds))
+                             for name, bounds in spec['search_space'].items()}
+        if range is not None:
+            bounds = self.search_space[self.feature]
+            if isinstance(bounds, dict):
+                raise ValueError(
+                    f'range only overrides [low, high] bounds, but the '
+                    f'search space of {self.feature} lists its values: '
+                    f'{bounds}')
+            bounds[1] = range
+        self.range = max(self.search_axis(self.feature)) + 1
 
-    def __init__(self, mongodb, range):
         self.mongodb = mongodb
-        self.range = range + 1
         self.model = None
+        self.test_predictions = None
+        self.objective_models = {}
         self.dataframe = None
+        # 增量训练: 每次更新新增的树数量, 以及森林保留的最大树数量
+        self.incremental_trees = incremental_trees
+        self.max_trees = max_trees
+        # 随机森林参数, 可由 tune_hyperparameters 调整
+        self.estimator_params = dict(spec['estimator'])
+        self.cv_report = None
+        # 上次训练所用数据中最新文档的 _id
+        self.last_id = None
+        # ObjectId 由写入端生成, 时间戳较早的文档可能在水位线之后才提交,
+        # 因此重新扫描水位线之前一段时间内的文档, 并跳过已训练过的
+        self.watermark_window = watermark_window
+        self.consumed_ids = set()
+
+    def record_fields(self):
+        """
+        Lists the row fields aggregated for the model: the write pattern,
+        the features and every metric an objective may refer to.
+        """
+        return list(dict.fromkeys(['write_pattern'] + self.features +
+                                  list(THROUGHPUT_METRICS + LATENCY_METRICS)))
+
+    def load_dataframe(self, since_id=None, until_id=None, ids=None,
+                       session=None):
+        """
+        Aggregates the metric rows of the spec pipeline into a DataFrame.
+
+        The rows arrive as columnar `MetricRecords` rather than one dict per
+        row. Results for a closed `_id` range or listed `_id`s are cached and
+        shared by every model reading the same pipeline, so they must not be
+        modified in place.
+
+        Args:
+            since_id (ObjectId): Only rows of documents inserted after this
+            `_id` (default: None).
+            until_id (ObjectId): Only rows of documents up to and including
+            this `_id` (default: None).
+            ids (list): Also rows of the documents with these `_id`s, see
+            `MongoDB.named_pipeline` (default: None).
+            session (ClientSession): The `MongoDB.consistent_reads` session
+            the `until_id` watermark was read in (default: None).
+
+        Returns:
+            DataFrame or None: The metric rows, or None if there are none.
+        """
+        fields = self.record_fields()
+        key = (self.mongodb, self.spec['pipeline'], self.spec.get('limit'),
+               tuple(fields), since_id, until_id,
+               None if ids is None else tuple(ids))
+        cacheable = until_id is not None or ids is not None
+        if cacheable and key in self._data_cache:
+            self._data_cache.move_to_end(key)
+            return self._data_cache[key]
+
+        records = self.mongodb.aggregate_records(
+            self.spec['pipeline'], fields, limit=self.spec.get('limit'),
+            since_id=since_id, until_id=until_id, ids=ids, session=session,
+            **self.spec.get('query_options', {}))
+        if not records:
+            return None
+
+        dataframe = records.to_dataframe()
+        if cacheable:
+            self._data_cache[key] = dataframe
+            if len(self._data_cache) > self.DATA_CACHE_SIZE:
+                self._data_cache.popitem(last=False)
+        return dataframe
+
+    def objectives(self):
+        """
+        Lists every objective of the model, the primary one first.
+
+        Returns:
+            dict: The target expression and goal ('max' or 'min') per name.
+        """
+        objectives = {self.PRIMARY_OBJECTIVE: {'target': self.spec['target'],
+                                               'goal': 'max'}}
+        objectives.update(self.spec.get('objectives', {}))
+        return objectives
+
+    def evaluate_objective(self, dataframe, name):
+        """
+        Evaluates the target expression of an objective on metric rows.
+
+        Returns:
+            Series or None: The objective values, or None if the rows lack
+            a column the expression needs.
+        """
+        try:
+            return dataframe.eval(self.objectives()[name]['target']).rename(
+                name)
+        except pd.errors.UndefinedVariableError:
+            return None
+
+    def split_features_target(self, dataframe,
+                              objective=PRIMARY_OBJECTIVE):
+        """
+        Selects the feature columns and the rows carrying an objective.
+
+        Every log message yields its own row, so a secondary objective is
+        trained on the rows where its metric is present, and the primary
+        objective on the rows carrying none of the secondary metrics.
+
+        Returns:
+            tuple: The feature DataFrame and the objective Series, or
+            (None, None) if the rows lack the objective.
+        """
+        y = self.evaluate_objective(dataframe, objective)
+        if y is None:
+            return None, None
+        if objective == self.PRIMARY_OBJECTIVE:
+            mask = pd.Series(True, index=dataframe.index)
+            for name in self.objectives():
+                if name == objective:
+                    continue
+                secondary = self.evaluate_objective(dataframe, name)
+                if secondary is not None:
+                    mask &= secondary.isna()
+        else:
+            mask = y.notna()
+        return dataframe.loc[mask, self.features], y[mask]
 
-    @abstractmethod
     def prepare_data(self):
-        pass
-
-    @abstractmethod
-    def train_model(self):
-        pass
+        from sklearn.model_selection import train_test_split
 
-    @abstractmethod
-    def find_best_value(self):
-        pass
-
-class MLRampTime(MLModel):
-    
-    def prepare_data(self):
         # 提取数据并进行预处理
-        dict_raw_data = self.mongodb.aggregate_ramp_metrics(limit=10000)
+        # 水位线与聚合在同一因果一致会话中读取, 聚合不会落后于水位线
+        with self.mongodb.consistent_reads() as session:
+            last_id = self.mongodb.latest_id(session=session)
+            floor = self.watermark_floor(last_id)
+            window = None
+            if floor is not None:
+                # 窗口内按列出的 _id 读取, 以便之后的更新跳过它们;
+                # 列出失败时留给下一次更新读取
+                window = self.mongodb.document_ids(
+                    floor, last_id, session=session) or []
+            dataframe = self.load_dataframe(until_id=floor, ids=window,
+                                            session=session)
         logger.info(f'self.range = {self.range}')
-        logger.debug(f'type(raw_data) = {type(dict_raw_data)}')
-        # logger.debug(dict_raw_data['combined_data'])
-        
-        raw_data = dict_raw_data['combined_data']
-
-        dataframe = pd.DataFrame(raw_data)
         logger.debug(f'dataframe(type({type(dataframe)})) = {dataframe}')
-        
+        # 没有数据时保留之前的水位线和训练数据
+        if dataframe is None:
+            raise ValueError(f"The {self.spec['pipeline']} pipeline returned "
+                             f'no metric rows to train on.')
+        # 选择特征和目标变量
+        X, y = self.split_features_target(dataframe)
+        if X is None or X.empty:
+            raise ValueError(f"The {self.spec['pipeline']} pipeline returned "
+                             f'no rows of the {self.PRIMARY_OBJECTIVE} '
+                             f'objective to train on.')
+        self.last_id = last_id
+        self.consumed_ids = set(window or [])
+        self.dataframe = dataframe
+
         # 调用检查相关性的方法
         self.check_correlation(dataframe)
 
-        # 假设目标是最大化 read_iops 和 write_iops，因此将其加和作为优化目标
-        dataframe['performance'] = (dataframe['read_iops'] +
-                                    dataframe['write_iops'])
-
-        # 选择特征和目标变量
-        X = dataframe[['ramp_times']]
-        y = dataframe['performance']
-        
         # 划分训练集和测试集
         self.X_train, self.X_test, self.y_train, self.y_test = \
             train_test_split(X, y, test_size=0.2, random_state=42)
 
     def check_correlation(self, data):
+        from system import plotting
+
         # 計算相關係數矩陣
-        corr_matrix = data.corr()
+        numeric_df = data.select_dtypes(include=[float, int])
+        corr_matrix = numeric_df.corr()
         logger.info(f'Correlation matrix:\n{corr_matrix}')
 
-        # 繪製相關性熱圖
-        plt.figure(figsize=(10, 8))
-        sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f")
-        plt.title('Correlation Matrix Heatmap')
-        plt.savefig("logs\\heapmap_ramptime.png")
+        # 繪製相關性熱圖 (在背景进程中渲染)
+        return plotting.submit(plotting.render_heatmap,
+                               self.spec['heatmap_path'], corr_matrix)
 
     def train_model(self):
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.metrics import mean_squared_error
+
         # 初始化并训练模型
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
+        self.model = RandomForestRegressor(**self.estimator_params,
+                                           warm_start=True)
         self.model.fit(self.X_train, self.y_train)
 
-        # 评估模型
+        # 评估模型, 保留测试集预测值供绘图复用
         predictions = self.model.predict(self.X_test)
+        self.test_predictions = predictions
         mse = mean_squared_error(self.y_test, predictions)
         logger.info(f'mse = {mse}')
 
-    def find_best_value(self):
-        # 生成可能的 ramp_times 值范围
-        possible_ramp_times = pd.DataFrame({'ramp_times': range(1, self.range)})
+        # 为每个次要目标 (如尾延迟) 单独训练模型
+        self.objective_models = {}
+        for name in self.objectives():
+            if name == self.PRIMARY_OBJECTIVE or self.dataframe is None:
+                continue
+            X, y = self.split_features_target(self.dataframe, name)
+            if y is None or y.empty:
+                logger.info(f'No rows for objective {name}, skipped')
+                continue
+            self.objective_models[name] = RandomForestRegressor(
+                **self.estimator_params, warm_start=True).fit(X, y)
+
+    def tune_hyperparameters(self, param_grid=None, n_splits=5,
+                             max_workers=None):
+        """
+        Picks the estimator parameters by parallel k-fold cross-validation
+        on the training set; later `train_model` calls use them.
+
+        Args:
+            param_grid (dict): Candidate values per estimator parameter
+            (default: None uses the `param_grid` of the spec).
+            n_splits (int): The number of folds (default: 5).
+            max_workers (int): The size of the process pool (default: None
+            uses the CPU count).
+
+        Returns:
+            dict: The cross-validation report.
+        """
+        from system.model_selection import cross_validate
+
+        if param_grid is None:
+            param_grid = self.spec['param_grid']
+        # 固定参数作为单值候选, 与待搜索参数一起组成网格
+        grid = {name: [value] for name, value in self.estimator_params.items()}
+        grid.update(param_grid)
+        self.cv_report = cross_validate(self.X_train, self.y_train, grid,
+                                        n_splits=n_splits,
+                                        max_workers=max_workers)
+        self.estimator_params = dict(self.cv_report['best_params'])
+        return self.cv_report
+
+    def search_axis(self, name):
+        """
+        Lists the candidate values of one feature.
+
+        A search space entry is either an inclusive `[low, high]` integer
+        range or `{"values": [...]}`.
+        """
+        bounds = self.search_space[name]
+        if isinstance(bounds, dict):
+            return list(bounds['values'])
+        return list(range(bounds[0], bounds[1] + 1))
+
+    def search_grid(self):
+        """
+        Builds every combination of candidate feature values.
+
+        Returns:
+            DataFrame: One row per configuration, one column per feature.
+        """
+        axes = [self.search_axis(name) for name in self.features]
+        return pd.DataFrame(list(itertools.product(*axes)),
+                            columns=self.features)
+
+    def predict_objectives(self, settings):
+        """
+        Predicts every trained objective for a set of configurations.
+
+        Args:
+            settings (DataFrame): One row per configuration.
+
+        Returns:
+            DataFrame: One column per trained objective.
+        """
+        predictions = {self.PRIMARY_OBJECTIVE: self.model.predict(settings)}
+        for name, model in self.objective_models.items():
+            predictions[name] = model.predict(settings)
+        return pd.DataFrame(predictions, index=settings.index)
+
+    def feasible(self, predictions, constraints=None):
+        """
+        Checks predicted objectives against `{name: {"min"/"max": bound}}`
+        constraints, defaulting to the constraints of the spec.
+
+        Returns:
+            Series: True for every configuration satisfying all constraints.
+        """
+        if constraints is None:
+            constraints = self.spec.get('constraints', {})
+        mask = pd.Series(True, index=predictions.index)
+        for name, bounds in constraints.items():
+            if name not in predictions:
+                logger.warning(f'No model for constraint {name}, ignored')
+                continue
+            if bounds.get('max') is not None:
+                mask &= predictions[name] <= bounds['max']
+            if bounds.get('min') is not None:
+                mask &= predictions[name] >= bounds['min']
+        return mask
+
+    def weighted_score(self, predictions, weights):
+        """
+        Scalarizes the objectives as a weighted sum of min-max normalized
+        predictions, with minimized objectives inverted.
+
+        Returns:
+            Series: The score of every configuration; higher is better.
+        """
+        objectives = self.objectives()
+        score = pd.Series(0.0, index=predictions.index)
+        for name, weight in weights.items():
+            values = predictions[name]
+            spread = values.max() - values.min()
+            normalized = ((values - values.min()) / spread if spread
+                          else values * 0.0)
+            if objectives[name]['goal'] == 'min':
+                normalized = 1.0 - normalized
+            score += weight * normalized
+        return score
+
+    def find_best_setting(self, weights=None, constraints=None):
+        """
+        Finds the feasible configuration with the best predicted outcome.
+
+        Args:
+            weights (dict): Objective weights for a weighted optimization
+            (default: None maximizes the primary objective).
+            constraints (dict): Bounds on predicted objectives (default: None
+            uses the constraints of the spec).
+
+        Returns:
+            dict or None: The value of every feature in the best
+            configuration, or None if no configuration is feasible.
+        """
+        # 生成搜索空间内所有可能的取值组合
+        possible_settings = self.search_grid()
 
         # predict performance
-        performance_predictions = self.model.predict(possible_ramp_times)
-
-        # Find best ramp_times
-        best_index = performance_predictions.argmax()
-        best_ramp_time = possible_ramp_times.iloc[best_index]['ramp_times']
-        logger.info(f'best_ramp_time = {best_ramp_time}')
-        return best_ramp_time
-
-    def plot_results(self, save_path_with_timestamp):
-        # 绘制 X 对 y 的曲线图
-        plt.figure(figsize=(10, 6))
-        plt.scatter(self.X_train, self.y_train, color='blue',
-                    label='Training data')
-        plt.scatter(self.X_test, self.y_test, color='green',
-                    label='Testing data')
-        plt.plot(self.X_test, self.model.predict(self.X_test), color='red',
-                 label='Model prediction')
-        plt.xlabel('Ramp Times')
-        plt.ylabel('Performance')
-        plt.title('Ramp Times vs Performance')
-        plt.legend()
-        # plt.show()
-        plt.savefig(save_path_with_timestamp)
+        predictions = self.predict_objectives(possible_settings)
+        feasible = self.feasible(predictions, constraints)
+        if not feasible.any():
+            logger.warning('No setting satisfies the constraints')
+            return None
+
+        # Find best setting
+        if weights:
+            score = self.weighted_score(predictions, weights)
+        else:
+            score = predictions[self.PRIMARY_OBJECTIVE]
+        best_index = score.where(feasible, -np.inf).to_numpy().argmax()
+        return possible_settings.iloc[best_index].to_dict()
+
+    def find_best_value(self, weights=None, constraints=None):
+        best_setting = self.find_best_setting(weights, constraints)
+        best_value = best_setting[self.feature] if best_setting else None
+        logger.info(f'best_{self.feature} = {best_value}')
+        return best_value
+
+    def pareto_front(self, constraints=None):
+        """
+        Finds the feasible configurations no other configuration beats on
+        every objective.
+
+        Returns:
+            DataFrame: The Pareto-optimal settings with their predicted
+            objectives, best primary objective first.
+        """
+        possible_settings = self.search_grid()
+        predictions = self.predict_objectives(possible_settings)
+        feasible = self.feasible(predictions, constraints).to_numpy()
+        settings = possible_settings[feasible]
+        predictions = predictions[feasible]
+
+        # 将所有目标统一为越大越好, 再两两比较支配关系
+        objectives = self.objectives()
+        signs = np.array([1.0 if objectives[name]['goal'] == 'max' else -1.0
+                          for name in predictions.columns])
+        oriented = predictions.to_numpy() * signs
+        no_worse = (oriented[:, None, :] >= oriented[None, :, :]).all(axis=2)
+        better = (oriented[:, None, :] > oriented[None, :, :]).any(axis=2)
+        dominated = (no_worse & better).any(axis=0)
+
+        front = pd.concat([settings, predictions], axis=1)[~dominated]
+        return front.sort_values(self.PRIMARY_OBJECTIVE, ascending=False)
+
+    def predict(self, values):
+        """
+        Predicts performance for a sequence of configurations in one call.
+
+        Args:
+            values (list): Feature values; scalars for single-feature models,
+            rows ordered like `features` otherwise.
+
+        Returns:
+            ndarray: The predicted performance for each configuration.
+        """
+        rows = np.asarray(values).reshape(-1, len(self.features))
+        return self.model.predict(pd.DataFrame(rows, columns=self.features))
+
+    def export(self, path):
+        """
+        Saves the trained forests as NumPy arrays, loadable by
+        `ForestPredictor.load` without sklearn.
+
+        Returns:
+            ForestPredictor: The exported predictor.
+        """
+        from system.forest_export import ForestPredictor
+
+        predictor = ForestPredictor.from_model(self)
+        predictor.save(path)
+        return predictor
+
+    def grow_forest(self, model, X, y):
+        """Adds `incremental_trees` trees fitted on X, y to a forest."""
+        # warm_start 下只有新增的树会在新数据上拟合
+        model.n_estimators += self.incremental_trees
+        model.fit(X, y)
+
+        # 丢弃最旧的树, 使森林规模保持有界
+        if len(model.estimators_) > self.max_trees:
+            model.estimators_ = model.estimators_[-self.max_trees:]
+            model.n_estimators = self.max_trees
+
+    def watermark_floor(self, last_id):
+        """
+        Computes the exclusive lower bound of the documents listed again
+        after a watermark.
+
+        ObjectIds are generated by the writing clients, so a document can be
+        committed after a watermark was read while carrying an older
+        timestamp. Reading only past the watermark would skip it forever.
+
+        Returns:
+            ObjectId or None: The `_id` `watermark_window` seconds before the
+            watermark, or None without a watermark.
+        """
+        if last_id is None:
+            return None
+        return ObjectId.from_datetime(
+            last_id.generation_time -
+            datetime.timedelta(seconds=self.watermark_window))
+
+    def _advance_watermark(self, latest_id, ids):
+        """Moves the watermark and forgets consumed ids below its window."""
+        self.last_id = latest_id
+        floor = self.watermark_floor(latest_id)
+        self.consumed_ids = {_id for _id in self.consumed_ids.union(ids)
+                             if _id > floor}
+
+    def update_model(self):
+        """
+        Grows the forest with trees fitted only on rows inserted since the
+        last fit, so update cost depends on new data rather than history.
+
+        The documents from `watermark_window` seconds before the watermark
+        on are listed again and those not in `consumed_ids` are read by
+        `_id`, so late commits are trained on once and never twice.
+
+        Returns:
+            int: The number of new rows consumed.
+        """
+        from sklearn.ensemble import RandomForestRegressor
+
+        if self.model is None:
+            raise RuntimeError('Model must be trained before it is updated.')
+
+        with self.mongodb.consistent_reads() as session:
+            latest_id = self.mongodb.latest_id(session=session)
+            ids = None
+            if latest_id is not None:
+                ids = self.mongodb.document_ids(
+                    self.watermark_floor(self.last_id), latest_id,
+                    session=session)
+            new_ids = [_id for _id in ids or []
+                       if _id not in self.consumed_ids]
+            if not new_ids:
+                logger.info('No new documents since last fit')
+                return 0
+            dataframe = self.load_dataframe(ids=new_ids, session=session)
+        if dataframe is None:
+            self._advance_watermark(latest_id, new_ids)
+            logger.info('No new metric rows since last fit')
+            return 0
+
+        X_new, y_new = self.split_features_target(dataframe)
+        if X_new is None or X_new.empty:
+            # 新数据只含次要目标的行时不更新, 待有主要目标的行时一并读取
+            logger.info('No new rows of the primary objective since last '
+                        'fit')
+            return 0
+        self._advance_watermark(latest_id, new_ids)
+        self.grow_forest(self.model, X_new, y_new)
+        self.test_predictions = None
+
+        for name in self.objectives():
+            if name == self.PRIMARY_OBJECTIVE:
+                continue
+            X, y = self.split_features_target(dataframe, name)
+            if y is None or y.empty:
+                continue
+            if name in self.objective_models:
+                self.grow_forest(self.objective_models[name], X, y)
+            else:
+                self.objective_models[name] = RandomForestRegressor(
+                    **self.estimator_params, warm_start=True).fit(X, y)
+
+        self.X_train = pd.concat([self.X_train, X_new])
+        self.y_train = pd.concat([self.y_train, y_new])
+        logger.info(f'Updated model with {len(dataframe)} new rows, '
+                    f'n_estimators = {self.model.n_estimators}')
+        return len(dataframe)
 
+    def plot_results(self, save_path):
+        """
+        Plots the data and the model prediction against the tuned feature.
 
-class MLStressMetric(MLModel):
-    
-    def prepare_data(self):
-        # 提取数据并进行预处理
-        dict_raw_data = self.mongodb.aggregate_stress_metrics(limit=10000)
-        logger.info(f'self.range = {self.range}')
-        logger.debug(f'type(raw_data) = {type(dict_raw_data)}')
-        # logger.debug(dict_raw_data['combined_data'])
-        
-        raw_data = dict_raw_data['combined_data']
+        The points are reduced to per-x quantile bands, the prediction curve
+        reuses the test set predictions of `train_model` sorted by x, and
+        the figure is drawn in the background renderer process.
 
-        dataframe = pd.DataFrame(raw_data)
-        logger.debug(f'dataframe(type({type(dataframe)})) = {dataframe}')
-        
-        # 调用检查相关性的方法
-        self.check_correlation(dataframe)
+        Args:
+            save_path (str): The image file to write.
 
-        # 假设目标是最大化 read_iops 和 write_iops，因此将其加和作为优化目标
-        dataframe['performance'] = (dataframe['read_iops'] +
-                                    dataframe['write_iops'])
+        Returns:
+            Future: Resolves to `save_path` once the figure is written.
+        """
+        from system import plotting
 
-        # 选择特征和目标变量
-        X = dataframe[['io_depth']]
-        y = dataframe['performance']
-        
-        # 划分训练集和测试集
-        self.X_train, self.X_test, self.y_train, self.y_test = \
-            train_test_split(X, y, test_size=0.2, random_state=42)
+        if self.test_predictions is None:
+            self.test_predictions = self.model.predict(self.X_test)
 
-    def check_correlation(self, data):
-        # 計算相關係數矩陣
-        # corr_matrix = data.corr()
-        # logger.info(f'Correlation matrix:\n{corr_matrix}')
-        numeric_df = data.select_dtypes(include=[float, int])
-        corr_matrix = numeric_df.corr()
+        # 将散点压缩为每个 x 的分位数带
+        train_bands = plotting.quantile_bands(self.X_train[self.feature],
+                                              self.y_train)
+        test_bands = plotting.quantile_bands(self.X_test[self.feature],
+                                             self.y_test)
 
-        # 繪製相關性熱圖
-        plt.figure(figsize=(10, 8))
-        sns.heatmap(corr_matrix, annot=True, cmap='coolwarm', fmt=".2f")
-        plt.title('Correlation Matrix Heatmap')
-        plt.savefig("logs\\heapmap_stress.png")
+        # 按 x 排序的预测曲线, 同一 x 的预测取平均
+        prediction = pd.Series(self.test_predictions,
+                               index=self.X_test[self.feature].to_numpy())
+        prediction = prediction.groupby(level=0).mean()
 
-    def train_model(self):
-        # 初始化并训练模型
-        self.model = RandomForestRegressor(n_estimators=100, random_state=42)
-        self.model.fit(self.X_train, self.y_train)
+        return plotting.submit(plotting.render_performance_plot, save_path,
+                               train_bands, test_bands,
+                               {'x': prediction.index.to_numpy(),
+                                'y': prediction.to_numpy()},
+                               self.spec['xlabel'], self.spec['ylabel'])
 
-        # 评估模型
-        predictions = self.model.predict(self.X_test)
-        mse = mean_squared_error(self.y_test, predictions)
-        logger.info(f'mse = {mse}')
 
-    def find_best_value(self):
-        # 生成可能的 io_depth 值范围
-        possible_io_depth = pd.DataFrame({'io_depth': range(1, self.range)})
+class MLRampTime(MLModel):
 
-        # predict performance
-        performance_predictions = self.model.predict(possible_io_depth)
+    SPEC = 'ramp_times'
 
-        # Find best ramp_times
-        best_index = performance_predictions.argmax()
-        best_io_depth = possible_io_depth.iloc[best_index]['io_depth']
-        logger.info(f'best_io_depth = {best_io_depth}')
-        return best_io_depth
 
-    def plot_results(self, save_path):
-        # 绘制 X 对 y 的曲线图
-        plt.figure(figsize=(10, 6))
-        plt.scatter(self.X_train, self.y_train, color='blue',
-                    label='Training data')
-        plt.scatter(self.X_test, self.y_test, color='green',
-                    label='Testing data')
-        plt.plot(self.X_test, self.model.predict(self.X_test), color='red',
-                 label='Model prediction')
-        plt.xlabel('I/O Depth')
-        plt.ylabel('Performance')
-        plt.title('I/O Depth vs Performance')
-        plt.legend()
-        # plt.show()
-        plt.savefig(save_path)
+class MLStressMetric(MLModel):
+
+    SPEC = 'io_depth'
@@ -1,9 +1,11 @@
 '''Copyright (c) 2024 Jaron Cheng'''
 import pytest
 import logging
-import os
 import paramiko
+from unit.live_upload import LiveUploader, collection_for
 from unit.mongodb import MongoDB
+from unit.report_shaper import ReportShaper
+from unit.result_collector import ResultCollector, is_worker, uses_xdist
 
 MDB_ATTR = [{
     "Log Path": 'logs/test.log',
@@ -61,11 +63,46 @@ logger = logging.getLogger(__name__)
 #     print('\n\033[32m================ Teardown UART ===============\033[0m')
 #     drone.close_uart()
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--live-upload",
+        action="store_true",
+        default=False,
+        help="Stream each test result to MongoDB as it finishes"
+    )
+
+
+def results_mongodb(collection_name):
+    return MongoDB('192.168.0.128', 27017, 'MLAutoRAID', collection_name,
+                   report_shaper=ReportShaper.from_config(),
+                   maintain_summaries=True, maintain_sketches=True)
+
+
+def pytest_configure(config):
+    if config.getoption("--live-upload"):
+        # xdist 下由各工作进程上传, 控制进程转发的报告不再重复写入
+        if is_worker(config) or not uses_xdist(config):
+            config.pluginmanager.register(LiveUploader(results_mongodb),
+                                          'live_upload')
+    elif uses_xdist(config):
+        config.pluginmanager.register(
+            ResultCollector(results_mongodb, worker=is_worker(config)),
+            'result_collector')
+
+
 def pytest_sessionfinish(session, exitstatus):
-    for item in session.items:
-        test_folder = os.path.basename(os.path.dirname(item.fspath))
-        collection_name = test_folder.replace('test_', '')
-        mongo = MongoDB('192.168.0.128', 27017, 'MLAutoRAID', collection_name)
+    # 实时上传时结果已逐条写入, 会话结束只需排空队列;
+    # xdist 下由控制进程的 ResultCollector 统一写入, 不读取共享的报告和日志
+    if session.config.getoption("--live-upload") or \
+            uses_xdist(session.config):
+        return
+    # 每个集合只写入一次, 而不是每个测试用例写入一次
+    collection_names = sorted({collection_for(item.fspath)
+                               for item in session.items})
+    for collection_name in collection_names:
+        mongo = MongoDB('192.168.0.128', 27017, 'MLAutoRAID', collection_name,
+                        report_shaper=ReportShaper.from_config(),
+                        maintain_summaries=True, maintain_sketches=True)
         for attr in MDB_ATTR:
             log_path = attr["Log Path"]
             report_path = attr["Report Path"]
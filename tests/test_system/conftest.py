@@ -1,12 +1,16 @@
 # Content of conftest.py
 '''Copyright (c) 2024 Jaron Cheng'''
 
+from datetime import datetime, timezone
+from unittest.mock import MagicMock, patch
+from bson import ObjectId
 import pytest
 # from system.ven_1b4b import MLModelFactory
-# from unittest.mock import MagicMock
+from system.ven_1b4b import MLModel
 from system.ven_1b4b import MLRampTime
 from system.ven_1b4b import MLStressMetric
-from unit.mongodb import MongoDB
+from unit.mongodb import MongoDB, load_read_routing
+from unit.records import MetricRecords
 
 @pytest.fixture(scope='module', autouse=True)
 def mdb():
@@ -19,7 +23,9 @@ def mdb():
     print(f'db_port = {db_port}')
     print(f'db_name = {db_name}')
     print(f'collection_name = {collection_name}')
-    return MongoDB(db_ip, db_port, db_name, collection_name)
+    # 训练读取走分析节点, 不占用测试机写入的主节点
+    return MongoDB(db_ip, db_port, db_name, collection_name,
+                   read_routing=load_read_routing())
 
 @pytest.fixture(scope='module', autouse=True)
 def windows_ramp_model(mdb):
@@ -29,4 +35,31 @@ def windows_ramp_model(mdb):
 @pytest.fixture(scope='module', autouse=True)
 def windows_stress_model(mdb):
     print('\n\033[32m================ Setup ML Stress Model =========\033[0m')
-    return MLStressMetric(mdb, range=32)
\ No newline at end of file
+    return MLStressMetric(mdb, range=32)
+
+
+@pytest.fixture
+def mocked_model():
+    """
+    Builds models reading fake metric rows from a mocked MongoDB.
+
+    Returns:
+        callable: Takes the rows, the `MLModel` class (default: MLModel),
+        whether to train it (default: True) and the constructor keyword
+        arguments, and returns the prepared model.
+    """
+    def build(rows, model_class=MLModel, train=True, **kwargs):
+        mongodb = MagicMock()
+        watermark = ObjectId.from_datetime(datetime(2024, 6, 1,
+                                                    tzinfo=timezone.utc))
+        mongodb.latest_id.return_value = watermark
+        mongodb.document_ids.return_value = [watermark]
+        mongodb.aggregate_records.return_value = \
+            MetricRecords.from_rows(rows)
+        model = model_class(mongodb, **kwargs)
+        with patch.object(model_class, 'check_correlation'):
+            model.prepare_data()
+        if train:
+            model.train_model()
+        return model
+    return build
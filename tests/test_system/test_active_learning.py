@@ -0,0 +1,151 @@
+# Contents of test_active_learning.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+from unittest.mock import MagicMock, patch
+from bson import ObjectId
+import numpy as np
+import pytest
+from system.active_learning import ActiveLearningScheduler
+from system.ven_1b4b import MLStressMetric
+from unit.records import MetricRecords
+
+logger = logging.getLogger(__name__)
+
+OPTIMUM = 20
+# 宽平台上的窄峰: 随机采样需要碰巧落在峰附近才能定位最优值
+NARROW_OPTIMUM = 300
+
+
+def peaked(io_depth):
+    return 1000.0 - (io_depth - OPTIMUM) ** 2
+
+
+def narrow_peak(io_depth):
+    return 1000.0 + 400.0 * np.exp(-((io_depth - NARROW_OPTIMUM) / 20) ** 2) \
+        - 0.2 * io_depth
+
+
+class FakeRig:
+    """Measures a synthetic io_depth curve and stores runs as numbered ids."""
+
+    def __init__(self, samples=4, curve=peaked):
+        self.samples = samples
+        self.curve = curve
+        self.rng = np.random.default_rng(3)
+        self.runs = []
+        self.ids = []
+        self.pending = None
+        self.mongodb = MagicMock()
+        self.mongodb.latest_id.side_effect = \
+            lambda session=None: self.ids[-1] if self.ids else None
+        self.mongodb.document_ids.side_effect = self.document_ids
+        self.mongodb.write_log_and_report.side_effect = self.ingest
+        self.mongodb.aggregate_records.side_effect = self.aggregate
+
+    def run_batch(self, settings):
+        self.pending = [
+            {'io_depth': setting['io_depth'], 'write_pattern': 0,
+             'read_iops': self.curve(setting['io_depth'])
+             + self.rng.normal(0, 5), 'write_iops': 0.0}
+            for setting in settings for _ in range(self.samples)]
+        return 'test.log', '.report.json'
+
+    def ingest(self, log_path, report_path):
+        self.runs.append(self.pending)
+        self.ids.append(ObjectId())
+
+    def document_ids(self, since_id=None, until_id=None, session=None):
+        return [_id for _id in self.ids
+                if (since_id is None or _id > since_id) and
+                (until_id is None or _id <= until_id)]
+
+    def aggregate(self, name, fields, limit=None, since_id=None,
+                  until_id=None, ids=None, session=None):
+        selected = set(ids or [])
+        if ids is None or since_id is not None or until_id is not None:
+            selected |= set(self.document_ids(since_id, until_id))
+        rows = [row for _id, runs in zip(self.ids, self.runs)
+                if _id in selected for row in runs]
+        return MetricRecords.from_rows(rows, fields) if rows else None
+
+
+@pytest.fixture
+def rig():
+    with patch.object(MLStressMetric, 'check_correlation'):
+        yield FakeRig()
+
+
+class TestActiveLearningScheduler:
+
+    def test_propose_skips_measured(self, rig):
+        model = MLStressMetric(rig.mongodb, range=32)
+        scheduler = ActiveLearningScheduler(model, batch_size=4)
+        scheduler.measure(scheduler.initial_design(), rig.run_batch)
+        model.prepare_data()
+        model.train_model()
+
+        batch = scheduler.propose()
+        scores = scheduler.score(batch)
+
+        # 32 个配置的初始设计取 ceil(sqrt(32)) = 6 个均匀分布的点
+        assert set(scheduler.measured) == \
+            {(1,), (7,), (13,), (20,), (26,), (32,)}
+        assert not set(batch['io_depth']) & {1, 7, 13, 20, 26, 32}
+        assert list(scores['ucb']) == sorted(scores['ucb'], reverse=True)
+
+    def test_existing_data_counts_as_measured(self, rig):
+        # 每个配置只测一次, 测试集中的配置不会同时出现在训练集中
+        rig.samples = 1
+        model = MLStressMetric(rig.mongodb, range=32)
+        ActiveLearningScheduler(model, batch_size=4).measure(
+            model.search_grid().iloc[:10], rig.run_batch)
+        model.prepare_data()
+        model.train_model()
+
+        scheduler = ActiveLearningScheduler(model, batch_size=32)
+        batch = scheduler.propose()
+
+        # Verify settings held out in the test split are not proposed again
+        tested = set(model.X_test['io_depth'])
+        assert tested - set(model.X_train['io_depth'])
+        assert not set(batch['io_depth']) & set(range(1, 11))
+        assert len(batch) == 22
+
+    def test_run_converges_with_few_measurements(self, rig):
+        model = MLStressMetric(rig.mongodb, range=128)
+        scheduler = ActiveLearningScheduler(model, batch_size=4, patience=2)
+
+        result = scheduler.run(rig.run_batch)
+
+        logger.info(f'result = {result}')
+        assert result['converged']
+        assert result['measured'] <= 128 // 2
+        assert abs(result['best_setting']['io_depth'] - OPTIMUM) <= 2
+        assert rig.mongodb.write_log_and_report.call_count == \
+            result['rounds'] + 1
+
+    def test_beats_random_sampling(self, rig):
+        rig.curve = narrow_peak
+        model = MLStressMetric(rig.mongodb, range=1024)
+        scheduler = ActiveLearningScheduler(model, batch_size=4, patience=2)
+
+        result = scheduler.run(rig.run_batch)
+
+        assert abs(result['best_setting']['io_depth'] - NARROW_OPTIMUM) <= 2
+        # 随机采样基线: 相同的测量预算, 不同的随机种子
+        errors = []
+        for seed in range(10):
+            baseline = FakeRig(curve=narrow_peak)
+            random_model = MLStressMetric(baseline.mongodb, range=1024)
+            batch = random_model.search_grid().sample(result['measured'],
+                                                      random_state=seed)
+            baseline.run_batch(batch.to_dict('records'))
+            baseline.ingest('test.log', '.report.json')
+            random_model.prepare_data()
+            random_model.train_model()
+            best = random_model.find_best_setting()
+            errors.append(abs(best['io_depth'] - NARROW_OPTIMUM))
+        logger.info(f"active learning measured {result['measured']} "
+                    f'settings, random sampling errors = {errors}')
+        assert sum(error <= 2 for error in errors) <= len(errors) // 2
+        assert np.median(errors) > 2
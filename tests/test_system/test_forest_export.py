@@ -0,0 +1,97 @@
+# Contents of test_forest_export.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import os
+import subprocess
+import sys
+from unittest.mock import MagicMock
+import numpy as np
+import pytest
+from system.forest_export import CompiledForest, ForestPredictor
+from system.ven_1b4b import MLModel
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+class TestForestExport:
+
+    SPEC = {
+        'pipeline': 'stress',
+        'limit': 100,
+        'features': ['io_depth', 'write_pattern'],
+        'target': 'read_iops + write_iops',
+        'objectives': {'read_lat_p99': {'target': 'read_lat_p99',
+                                        'goal': 'min'}},
+        'constraints': {'read_lat_p99': {'max': 450.0}},
+        'search_space': {'io_depth': [1, 8],
+                         'write_pattern': {'values': [0, 100]}},
+        'estimator': {'n_estimators': 10, 'random_state': 42},
+        'xlabel': 'I/O Depth',
+        'ylabel': 'Performance',
+        'heatmap_path': 'heatmap.png'
+    }
+    ROWS = ([{'io_depth': depth, 'write_pattern': pattern,
+              'read_iops': 10.0 * depth, 'write_iops': float(pattern),
+              'read_lat_p99': None}
+             for depth in range(1, 9) for pattern in (0, 100)
+             for _ in range(3)] +
+            [{'io_depth': depth, 'write_pattern': pattern, 'read_iops': 0.0,
+              'write_iops': 0.0, 'read_lat_p99': 100.0 * depth}
+             for depth in range(1, 9) for pattern in (0, 100)])
+
+    @pytest.fixture
+    def model(self, mocked_model):
+        return mocked_model(self.ROWS, spec=self.SPEC)
+
+    def test_matches_sklearn(self):
+        from sklearn.ensemble import RandomForestRegressor
+
+        rng = np.random.default_rng(0)
+        X = rng.uniform(0, 64, size=(500, 3))
+        y = X[:, 0] * np.sin(X[:, 1]) + rng.normal(size=500)
+        estimator = RandomForestRegressor(n_estimators=20,
+                                          random_state=0).fit(X, y)
+
+        forest = CompiledForest.from_estimator(estimator)
+        grid = rng.uniform(0, 64, size=(5000, 3))
+
+        # Small chunks make sure rows are split and reassembled in order
+        np.testing.assert_allclose(forest.predict(grid, chunk_size=777),
+                                   estimator.predict(grid))
+
+    def test_exported_model_round_trip(self, model, tmp_path):
+        path = tmp_path / 'io_depth.npz'
+        model.export(path)
+
+        predictor = ForestPredictor.load(path)
+
+        np.testing.assert_allclose(predictor.predict([[3, 0], [6, 100]]),
+                                   model.predict([[3, 0], [6, 100]]))
+        assert len(predictor.search_grid()) == len(model.search_grid())
+        assert predictor.best_setting() == model.find_best_setting()
+        assert predictor.best_setting({}) == model.find_best_setting(
+            constraints={})
+        assert predictor.best_setting(
+            {'read_lat_p99': {'max': 10.0}}) is None
+
+    def test_load_without_sklearn(self, model, tmp_path):
+        path = tmp_path / 'io_depth.npz'
+        model.export(path)
+
+        result = subprocess.run([sys.executable, '-c', (
+            'import sys; from system.forest_export import ForestPredictor; '
+            f'print(ForestPredictor.load({str(path)!r}).best_setting()); '
+            "print([m for m in ('sklearn', 'pandas') if m in sys.modules])")],
+            cwd=ROOT, capture_output=True, text=True, check=True)
+
+        best, heavy = result.stdout.splitlines()
+        assert best == str(model.find_best_setting())
+        assert heavy == '[]'
+
+    def test_untrained_model(self, tmp_path):
+        model = MLModel(MagicMock(), spec=self.SPEC)
+        with pytest.raises(RuntimeError):
+            model.export(tmp_path / 'io_depth.npz')
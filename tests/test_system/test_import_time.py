@@ -0,0 +1,55 @@
+# Contents of test_import_time.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import os
+import re
+import subprocess
+import sys
+import pytest
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+# 导入预算 (微秒); 未延迟导入 sklearn/pandas 时约需 2 秒
+IMPORT_BUDGET_US = 1000000
+# 这些模块导入耗时数秒, 只应在训练、评估或绘图时导入
+HEAVY_MODULES = ('pandas', 'sklearn', 'matplotlib', 'seaborn',
+                 'system.plotting', 'system.model_selection')
+
+
+def run_python(*args):
+    return subprocess.run([sys.executable, *args], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+
+
+class TestImportTime:
+
+    @pytest.mark.parametrize('module', ['system.ven_1b4b',
+                                        'system.forest_export',
+                                        'system.lookup_table'])
+    def test_heavy_modules_are_lazy(self, module):
+        result = run_python('-c', (
+            f'import sys, {module}; '
+            f'print([m for m in {HEAVY_MODULES!r} if m in sys.modules])'))
+        assert result.stdout.strip() == '[]'
+
+    def test_pandas_imported_on_first_use(self):
+        result = run_python('-c', (
+            'import sys; from system.ven_1b4b import pd; '
+            "print('pandas' in sys.modules, pd.DataFrame.__name__, "
+            "'pandas' in sys.modules)"))
+        assert result.stdout.split() == ['False', 'DataFrame', 'True']
+
+    @pytest.mark.parametrize('module', ['system.ven_1b4b'])
+    def test_import_time_budget(self, module):
+        result = run_python('-X', 'importtime', '-c', f'import {module}')
+
+        # 顶层条目的累计耗时之和即整个导入过程 (含解释器启动) 的耗时
+        cumulative = [int(match.group(1)) for match in re.finditer(
+            r'^import time:\s+\d+ \|\s+(\d+) \| \S', result.stderr,
+            re.MULTILINE)]
+        total = sum(cumulative)
+        logger.info(f'import {module}: {total} us')
+        assert total < IMPORT_BUDGET_US
@@ -0,0 +1,97 @@
+# Contents of test_lookup_table.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import json
+import logging
+import os
+import numpy as np
+import pytest
+from system.forest_export import CompiledForest, ForestPredictor
+from system.lookup_table import LookupTable
+
+logger = logging.getLogger(__name__)
+
+
+def stump(threshold, low, high, feature=0):
+    """A one-tree forest predicting `low` up to `threshold`, else `high`."""
+    return CompiledForest(np.array([feature, 0, 0], dtype=np.int32),
+                          np.array([threshold, 0.0, 0.0]),
+                          np.array([1, 1, 2], dtype=np.int32),
+                          np.array([2, 1, 2], dtype=np.int32),
+                          np.array([0.0, low, high]),
+                          np.array([0], dtype=np.int32), 1)
+
+
+@pytest.fixture
+def predictor():
+    # 性能随 io_depth 提升, 尾延迟在 io_depth > 4 时超出约束
+    return ForestPredictor(
+        ['io_depth', 'write_pattern'], [range(1, 9), [0, 100]],
+        {'performance': stump(6.5, 100.0, 200.0),
+         'read_lat_p99': stump(4.5, 300.0, 900.0)},
+        {'performance': 'max', 'read_lat_p99': 'min'},
+        {'read_lat_p99': {'max': 450.0}})
+
+
+class TestLookupTable:
+
+    def test_build_and_lookup(self, predictor, tmp_path):
+        table, built = LookupTable.ensure(predictor, tmp_path, 'amd_desktop',
+                                          'io_depth')
+
+        assert built
+        assert isinstance(table.table, np.memmap)
+        assert table.table.shape == (2, 8, 2)
+        assert table.predicted({'io_depth': 7, 'write_pattern': 100}) == 200.0
+        assert table.predicted([2, 0], 'read_lat_p99') == 300.0
+        assert table.best_setting() == predictor.best_setting() == \
+            {'io_depth': 1, 'write_pattern': 0}
+        assert table.best_value() == 1
+        with pytest.raises(KeyError):
+            table.predicted([9, 0])
+
+    def test_rebuilt_only_on_new_fingerprint(self, predictor, tmp_path):
+        first, _ = LookupTable.ensure(predictor, tmp_path, 'amd_desktop',
+                                      'io_depth')
+
+        same, built = LookupTable.ensure(predictor, tmp_path, 'amd_desktop',
+                                         'io_depth')
+        assert not built
+        assert same.header['table'] == first.header['table']
+
+        predictor.forests['performance'] = stump(2.5, 100.0, 300.0)
+        changed, built = LookupTable.ensure(predictor, tmp_path,
+                                            'amd_desktop', 'io_depth')
+        assert built
+        assert changed.header['fingerprint'] != first.header['fingerprint']
+        assert changed.predicted([3, 0]) == 300.0
+        # The table of the old fingerprint stays for readers of the old
+        # header until the next build
+        assert first.predicted([3, 0]) == 100.0
+        assert sorted(os.listdir(tmp_path / 'amd_desktop')) == \
+            sorted(['io_depth.json', first.header['table'],
+                    changed.header['table']])
+
+        predictor.forests['performance'] = stump(3.5, 100.0, 400.0)
+        latest, _ = LookupTable.ensure(predictor, tmp_path, 'amd_desktop',
+                                       'io_depth')
+        assert sorted(os.listdir(tmp_path / 'amd_desktop')) == \
+            sorted(['io_depth.json', changed.header['table'],
+                    latest.header['table']])
+
+    def test_profiles_are_separate(self, predictor, tmp_path):
+        LookupTable.build(predictor, tmp_path, 'amd_desktop', 'io_depth')
+
+        assert LookupTable.open(tmp_path, 'intel_raid5', 'io_depth') is None
+
+    def test_unknown_version_is_ignored(self, predictor, tmp_path):
+        LookupTable.build(predictor, tmp_path, 'amd_desktop', 'io_depth')
+        path = LookupTable.paths(tmp_path, 'amd_desktop', 'io_depth')
+        with open(path, 'r') as file:
+            header = json.load(file)
+        header['table_version'] = 0
+        with open(path, 'w') as file:
+            json.dump(header, file)
+
+        _, built = LookupTable.ensure(predictor, tmp_path, 'amd_desktop',
+                                      'io_depth')
+        assert built
@@ -0,0 +1,78 @@
+# Contents of test_model_selection.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import numpy as np
+import pytest
+from system import model_selection
+from system.model_selection import cross_validate
+from system.ven_1b4b import MLStressMetric
+
+logger = logging.getLogger(__name__)
+
+PARAM_GRID = {'n_estimators': [5, 10], 'max_depth': [1, None],
+              'random_state': [42]}
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    X = rng.integers(1, 33, size=(200, 1)).astype(float)
+    y = 100.0 * np.sqrt(X[:, 0]) + rng.normal(0, 1, size=200)
+    return X, y
+
+
+@pytest.fixture(scope='module')
+def report(data):
+    X, y = data
+    return cross_validate(X, y, PARAM_GRID, n_splits=3, max_workers=2)
+
+
+class TestCrossValidate:
+
+    def test_report_structure(self, report):
+        assert report['n_samples'] == 200
+        assert report['n_candidates'] == 4
+        assert len(report['results']) == 4
+        for result in report['results']:
+            assert [fold['fold'] for fold in result['folds']] == [0, 1, 2]
+            assert all(fold['fit_time'] > 0 for fold in result['folds'])
+
+    def test_results_ranked_by_mse(self, report):
+        mses = [result['mean_mse'] for result in report['results']]
+        assert mses == sorted(mses)
+        assert report['best_params'] == report['results'][0]['params']
+        # A single split cannot fit a square root curve
+        assert report['best_params']['max_depth'] is None
+
+    def test_workers_map_arrays_read_only(self, data, tmp_path):
+        X, y = data
+        paths = {}
+        for name, array in (('X', X), ('y', y)):
+            paths[name] = str(tmp_path / f'{name}.npy')
+            np.save(paths[name], array)
+
+        model_selection._attach_arrays(paths)
+        try:
+            assert isinstance(model_selection._shared_arrays['X'], np.memmap)
+            result = model_selection._fit_fold({'n_estimators': 3}, 0, 3, 42)
+            assert result['mse'] >= 0
+        finally:
+            model_selection._shared_arrays.clear()
+
+
+class TestTuneHyperparameters:
+
+    def test_best_params_used_for_training(self, mocked_model):
+        rows = [{'io_depth': depth, 'read_iops': 10.0 * depth,
+                 'write_iops': 0.0} for depth in range(1, 33)
+                for _ in range(4)]
+        model = mocked_model(rows, MLStressMetric, train=False, range=32)
+
+        report = model.tune_hyperparameters(
+            {'n_estimators': [5], 'max_depth': [1, 8]}, n_splits=2,
+            max_workers=2)
+        model.train_model()
+
+        assert report['best_params']['max_depth'] == 8
+        assert report['best_params']['random_state'] == 42
+        assert model.model.max_depth == 8
@@ -0,0 +1,59 @@
+# Contents of test_plotting.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+from unittest.mock import patch
+import numpy as np
+from system import plotting
+from system.ven_1b4b import MLStressMetric
+
+logger = logging.getLogger(__name__)
+
+
+class TestQuantileBands:
+
+    def test_bands_per_x(self):
+        x = [2, 1, 2, 1, 2]
+        y = [10.0, 1.0, 30.0, 3.0, 20.0]
+
+        bands = plotting.quantile_bands(x, y)
+
+        assert bands['x'].tolist() == [1.0, 2.0]
+        assert bands['count'].tolist() == [2, 3]
+        assert bands['q50'].tolist() == [2.0, 20.0]
+        assert (bands['q10'] <= bands['q90']).all()
+
+    def test_many_x_values_are_binned(self):
+        x = np.arange(10000)
+        bands = plotting.quantile_bands(x, x * 2.0, max_bins=50)
+
+        assert len(bands['x']) == 50
+        assert bands['count'].sum() == 10000
+        assert np.all(np.diff(bands['x']) > 0)
+
+
+class TestBackgroundRendering:
+
+    def test_render_performance_plot(self, tmp_path):
+        bands = plotting.quantile_bands([1, 1, 2, 2], [1.0, 2.0, 3.0, 4.0])
+        save_path = str(tmp_path / 'plot.png')
+
+        future = plotting.submit(plotting.render_performance_plot, save_path,
+                                 bands, bands, {'x': [1, 2], 'y': [1.5, 3.5]},
+                                 'I/O Depth', 'Performance')
+
+        assert future.result(timeout=60) == save_path
+        assert (tmp_path / 'plot.png').stat().st_size > 0
+
+    def test_plot_results_reuses_predictions(self, mocked_model, tmp_path):
+        rows = [{'io_depth': depth, 'read_iops': 10.0 * depth,
+                 'write_iops': 0.0} for depth in range(1, 33)
+                for _ in range(4)]
+        model = mocked_model(rows, MLStressMetric, range=32)
+        save_path = str(tmp_path / 'io_depth.png')
+
+        with patch.object(model.model, 'predict',
+                          side_effect=AssertionError('predicted again')):
+            future = model.plot_results(save_path)
+
+        assert future.result(timeout=60) == save_path
+        assert (tmp_path / 'io_depth.png').exists()
@@ -0,0 +1,170 @@
+# Contents of test_prediction_service.py
+'''Copyright (c) 2024 Jaron Cheng'''
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import threading
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+import numpy as np
+import pytest
+from system.prediction_service import MicroBatcher, PredictionService
+
+logger = logging.getLogger(__name__)
+
+
+class FakeModel:
+    """Predicts a parabola peaking at 8 and counts predict calls."""
+
+    range = 33
+    features = ['io_depth']
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def predict(self, values):
+        self.release.wait(timeout=5)
+        self.calls += 1
+        values = np.asarray(values, dtype=float).reshape(-1)
+        return -(values - 8) ** 2
+
+
+class FakeGridModel:
+    """Predicts a two-feature surface peaking at io_depth 8, pattern 30."""
+
+    features = ['io_depth', 'write_pattern']
+
+    def search_grid(self):
+        return np.array([[depth, pattern] for depth in (4, 8, 16)
+                         for pattern in (0, 30, 100)])
+
+    def predict(self, values):
+        rows = np.asarray(values, dtype=float).reshape(-1, 2)
+        return -(rows[:, 0] - 8) ** 2 - (rows[:, 1] - 30) ** 2
+
+
+class BrokenModel(FakeModel):
+
+    def predict(self, values):
+        raise RuntimeError('forest not loaded')
+
+
+class TestMicroBatcher:
+
+    def test_concurrent_requests_share_one_predict(self):
+        model = FakeModel()
+        batcher = MicroBatcher({'io_depth': model}, max_wait=0.5)
+        futures = [batcher.submit('io_depth', [depth, depth + 1])
+                   for depth in range(10)]
+        model.release.set()
+
+        results = [future.result(timeout=5) for future in futures]
+        batcher.close()
+
+        assert model.calls == 1
+        assert batcher.batched_requests == 10
+        assert results[3].tolist() == [-25.0, -16.0]
+
+    def test_malformed_request_fails_alone(self):
+        model = FakeModel()
+        batcher = MicroBatcher({'io_depth': model}, max_wait=0.5)
+        valid = batcher.submit('io_depth', [7, 8])
+        malformed = batcher.submit('io_depth', [7, 'deep'])
+        empty = batcher.submit('io_depth', [])
+        model.release.set()
+
+        assert valid.result(timeout=5).tolist() == [-1.0, 0.0]
+        with pytest.raises(ValueError):
+            malformed.result(timeout=5)
+        with pytest.raises(ValueError):
+            empty.result(timeout=5)
+        batcher.close()
+        assert batcher.batched_requests == 1
+
+    def test_unknown_model(self):
+        batcher = MicroBatcher({})
+        with pytest.raises(KeyError):
+            batcher.submit('block_size', [1])
+        batcher.close()
+
+
+class TestPredictionService:
+
+    @pytest.fixture
+    def service(self):
+        model = FakeModel()
+        model.release.set()
+        service = PredictionService({'io_depth': model}, port=0)
+        service.start()
+        yield service
+        service.shutdown()
+
+    def post(self, service, path, payload):
+        host, port = service.address
+        request = Request(f'http://{host}:{port}{path}',
+                          data=json.dumps(payload).encode(),
+                          headers={'Content-Type': 'application/json'})
+        with urlopen(request, timeout=5) as response:
+            return json.loads(response.read())
+
+    def test_predict(self, service):
+        result = self.post(service, '/predict',
+                           {'model': 'io_depth', 'values': [7, 8, 9]})
+        assert result == {'predictions': [-1.0, 0.0, -1.0]}
+
+    def test_malformed_values(self, service):
+        with pytest.raises(HTTPError) as error:
+            self.post(service, '/predict',
+                      {'model': 'io_depth', 'values': [7, 'deep']})
+        assert error.value.code == 400
+
+    def test_stuck_worker_times_out(self):
+        model = FakeModel()
+        service = PredictionService({'io_depth': model}, port=0,
+                                    timeout=0.1)
+        service.start()
+        try:
+            with pytest.raises(HTTPError) as error:
+                self.post(service, '/predict',
+                          {'model': 'io_depth', 'values': [7]})
+            assert error.value.code == 504
+        finally:
+            model.release.set()
+            service.shutdown()
+
+    def test_best_for_many_configs(self, service):
+        queries = [[1, 2, 4], [4, 8, 16], None]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(
+                lambda _: self.post(service, '/best',
+                                    {'model': 'io_depth', 'queries': queries}),
+                range(8)))
+
+        for result in results:
+            assert [best['value'] for best in result['best']] == [4, 8, 8]
+        stats = service.stats()
+        assert stats['latency']['/best']['count'] == 8
+        assert stats['latency']['/best']['p99_ms'] >= \
+            stats['latency']['/best']['p50_ms']
+
+    def test_best_searches_multi_feature_grid(self):
+        service = PredictionService({'system': FakeGridModel()}, port=0)
+        service.start()
+        try:
+            result = self.post(service, '/best', {'model': 'system'})
+        finally:
+            service.shutdown()
+        assert result == {'best': [{'value': [8, 30], 'performance': 0.0}]}
+
+    def test_prediction_error_is_answered(self):
+        service = PredictionService({'io_depth': BrokenModel()}, port=0)
+        service.start()
+        try:
+            with pytest.raises(HTTPError) as error:
+                self.post(service, '/predict',
+                          {'model': 'io_depth', 'values': [7]})
+        finally:
+            service.shutdown()
+        assert error.value.code == 500
+        assert 'forest not loaded' in json.loads(error.value.read())['error']
@@ -1,8 +1,12 @@
 # Contents of test_ven_1b4b.py
 '''Copyright (c) 2024 Jaron Cheng'''
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+from unittest.mock import MagicMock
+from bson import ObjectId
 import pytest
+from system.ven_1b4b import MLStressMetric
+from unit.records import MetricRecords
 
 logger = logging.getLogger(__name__)
 
@@ -78,3 +82,217 @@ class TestMLStressMetric:
         assert best_io_depth in range(1, windows_stress_model.range),\
                 "Best ramp time should be within the expected range."
 
+
+
+class TestIncrementalUpdate:
+
+    ROWS = [{'io_depth': depth, 'write_pattern': 0, 'read_iops': 100.0 * depth,
+             'write_iops': 0.0, 'read_bw': 0.0, 'write_bw': 0.0}
+            for depth in range(1, 33)]
+
+    @pytest.fixture
+    def stress_model(self, mocked_model):
+        return mocked_model(self.ROWS, MLStressMetric, range=32,
+                            incremental_trees=5, max_trees=110)
+
+    @staticmethod
+    def later(_id, seconds):
+        return ObjectId.from_datetime(_id.generation_time +
+                                      timedelta(seconds=seconds))
+
+    def test_update_model_consumes_new_rows(self, stress_model):
+        mongodb = stress_model.mongodb
+        watermark = stress_model.last_id
+        latest = self.later(watermark, 10)
+        mongodb.latest_id.return_value = latest
+        mongodb.document_ids.return_value = [watermark, latest]
+        mongodb.aggregate_records.return_value = \
+            MetricRecords.from_rows(self.ROWS[:4])
+
+        assert stress_model.update_model() == 4
+        # Verify the watermark and the rows are read in one session, and
+        # only the documents not trained on yet
+        session = mongodb.consistent_reads.return_value.__enter__.return_value
+        mongodb.latest_id.assert_called_with(session=session)
+        mongodb.document_ids.assert_called_with(
+            stress_model.watermark_floor(watermark), latest, session=session)
+        mongodb.aggregate_records.assert_called_with(
+            'stress', stress_model.record_fields(), limit=10000,
+            since_id=None, until_id=None, ids=[latest], session=session)
+        assert stress_model.model.n_estimators == 105
+        assert stress_model.last_id == latest
+        assert stress_model.consumed_ids == {watermark, latest}
+
+    def test_update_model_reads_late_commits_once(self, stress_model):
+        mongodb = stress_model.mongodb
+        watermark = stress_model.last_id
+        # 时间戳早于水位线的文档在上次读取之后才提交
+        late = self.later(watermark, -60)
+        mongodb.document_ids.return_value = [late, watermark]
+        mongodb.aggregate_records.return_value = \
+            MetricRecords.from_rows(self.ROWS[:4])
+
+        assert stress_model.update_model() == 4
+        assert mongodb.aggregate_records.call_args[1]['ids'] == [late]
+        assert stress_model.update_model() == 0
+        assert stress_model.model.n_estimators == 105
+
+    def test_update_model_forgets_ids_below_window(self, stress_model):
+        mongodb = stress_model.mongodb
+        watermark = stress_model.last_id
+        latest = self.later(watermark, stress_model.watermark_window + 1)
+        mongodb.latest_id.return_value = latest
+        mongodb.document_ids.return_value = [watermark, latest]
+
+        stress_model.update_model()
+
+        assert stress_model.consumed_ids == {latest}
+
+    def test_update_model_without_new_documents(self, stress_model):
+        assert stress_model.update_model() == 0
+        assert stress_model.model.n_estimators == 100
+        stress_model.mongodb.aggregate_records.assert_called_once()
+
+    def test_update_model_without_primary_rows(self, stress_model):
+        mongodb = stress_model.mongodb
+        watermark = stress_model.last_id
+        latest = self.later(watermark, 10)
+        mongodb.latest_id.return_value = latest
+        mongodb.document_ids.return_value = [watermark, latest]
+        # The new rows only carry the tail latency objective
+        mongodb.aggregate_records.return_value = MetricRecords.from_rows(
+            [{'io_depth': 4, 'write_pattern': 0, 'read_iops': 0.0,
+              'write_iops': 0.0, 'read_bw': 0.0, 'write_bw': 0.0,
+              'read_lat_p99': 500.0}])
+
+        assert stress_model.update_model() == 0
+        assert stress_model.model.n_estimators == 100
+        assert stress_model.last_id == watermark
+        assert stress_model.consumed_ids == {watermark}
+
+    def test_update_model_caps_forest_size(self, stress_model):
+        mongodb = stress_model.mongodb
+        for seconds in range(1, 4):
+            latest = self.later(stress_model.last_id, seconds)
+            mongodb.latest_id.return_value = latest
+            mongodb.document_ids.return_value = [latest]
+            stress_model.update_model()
+
+        assert len(stress_model.model.estimators_) == 110
+        assert stress_model.model.n_estimators == 110
+
+
+class TestSpecDrivenModel:
+
+    SPEC = {
+        'pipeline': 'stress',
+        'limit': 100,
+        'features': ['io_depth', 'write_pattern'],
+        'target': 'read_iops + 2 * write_iops',
+        'search_space': {'io_depth': [1, 8],
+                         'write_pattern': {'values': [0, 100]}},
+        'estimator': {'n_estimators': 10, 'random_state': 42},
+        'xlabel': 'I/O Depth',
+        'ylabel': 'Performance',
+        'heatmap_path': 'heatmap.png'
+    }
+    ROWS = [{'io_depth': depth, 'write_pattern': pattern,
+             'read_iops': 10.0 * depth, 'write_iops': float(pattern),
+             'read_bw': 0.0, 'write_bw': 0.0}
+            for depth in range(1, 9) for pattern in (0, 100)
+            for _ in range(3)]
+
+    @pytest.fixture
+    def model(self, mocked_model):
+        return mocked_model(self.ROWS, range=6, spec=self.SPEC)
+
+    def test_spec_drives_features_and_target(self, model):
+        assert list(model.X_train.columns) == ['io_depth', 'write_pattern']
+        assert model.y_train.name == 'performance'
+        # Verify the window before the watermark is read by listed _id
+        model.mongodb.aggregate_records.assert_called_once_with(
+            'stress', model.record_fields(), limit=100, since_id=None,
+            until_id=model.watermark_floor(model.last_id),
+            ids=[model.last_id],
+            session=model.mongodb.consistent_reads.return_value
+            .__enter__.return_value)
+
+    def test_search_grid_covers_search_space(self, model):
+        grid = model.search_grid()
+        assert len(grid) == 6 * 2
+        assert grid['io_depth'].max() == 6
+
+    def test_find_best_setting(self, model):
+        best = model.find_best_setting()
+        assert best == {'io_depth': 6, 'write_pattern': 100}
+        assert model.find_best_value() == 6
+
+    def test_range_overrides_only_bounds(self):
+        spec = dict(self.SPEC, features=['write_pattern', 'io_depth'])
+        with pytest.raises(ValueError, match='write_pattern'):
+            MLStressMetric(MagicMock(), range=50, spec=spec)
+        assert MLStressMetric(MagicMock(), spec=spec).range == 101
+
+    def test_prepare_data_without_rows(self, model):
+        last_id = model.last_id
+        model.mongodb.aggregate_records.return_value = None
+        # 清除已缓存的区间, 重新聚合
+        model._data_cache.clear()
+
+        with pytest.raises(ValueError, match='no metric rows'):
+            model.prepare_data()
+        # Verify the watermark and training data are kept
+        assert model.last_id == last_id
+        assert model.dataframe is not None
+
+    def test_closed_range_is_cached(self, model):
+        floor = model.watermark_floor(model.last_id)
+        first = model.load_dataframe(until_id=floor, ids=[model.last_id])
+        second = model.load_dataframe(until_id=floor, ids=[model.last_id])
+        assert first is second is model.dataframe
+        assert model.mongodb.aggregate_records.call_count == 1
+
+
+class TestMultiObjective:
+
+    SPEC = dict(TestSpecDrivenModel.SPEC,
+                features=['io_depth'],
+                target='read_iops + write_iops',
+                objectives={'read_lat_p99': {'target': 'read_lat_p99',
+                                             'goal': 'min'}},
+                constraints={'read_lat_p99': {'max': 450.0}},
+                search_space={'io_depth': [1, 8]})
+    # IOPS and tail latency both grow with the I/O depth
+    ROWS = ([{'io_depth': depth, 'read_iops': 10.0 * depth, 'write_iops': 0.0,
+              'read_lat_p99': None} for depth in range(1, 9)
+             for _ in range(3)] +
+            [{'io_depth': depth, 'read_iops': 0.0, 'write_iops': 0.0,
+              'read_lat_p99': 100.0 * depth} for depth in range(1, 9)
+             for _ in range(3)])
+
+    @pytest.fixture
+    def model(self, mocked_model):
+        return mocked_model(self.ROWS, spec=self.SPEC)
+
+    def test_objective_rows_are_separated(self, model):
+        assert len(model.X_train) + len(model.X_test) == 24
+        assert set(model.objective_models) == {'read_lat_p99'}
+
+    def test_constraints_bound_best_value(self, model):
+        assert model.find_best_value() == 4
+        assert model.find_best_value(constraints={}) == 8
+        assert model.find_best_value(
+            constraints={'read_lat_p99': {'max': 10.0}}) is None
+
+    def test_weighted_optimization(self, model):
+        best = model.find_best_setting(
+            weights={'performance': 0.0, 'read_lat_p99': 1.0},
+            constraints={})
+        assert best == {'io_depth': 1}
+
+    def test_pareto_front(self, model):
+        front = model.pareto_front(constraints={})
+        # Every depth trades IOPS for latency, so none is dominated
+        assert sorted(front['io_depth']) == list(range(1, 9))
+        assert list(front.columns) == ['io_depth', 'performance',
+                                       'read_lat_p99']
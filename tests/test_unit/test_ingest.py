@@ -0,0 +1,129 @@
+# Contents of test_ingest.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import json
+import logging
+from unittest.mock import MagicMock
+import pytest
+from unit.ingest import BulkIngestor, Checkpoint, find_report_pairs
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def report_tree(tmp_path):
+    """Three agents: report beside log, report with logs/ dir, no log."""
+    layouts = {'agent1': 'test.log', 'agent2': 'logs/test.log',
+               'agent3': None}
+    for agent, log_name in layouts.items():
+        agent_dir = tmp_path / agent
+        (agent_dir / 'logs').mkdir(parents=True)
+        (agent_dir / '.report.json').write_text(
+            json.dumps({'agent': agent, 'tests': []}))
+        if log_name:
+            (agent_dir / log_name).write_text(f'{agent} log')
+    (tmp_path / 'agent1' / 'build7.report.json').write_text('{"build": 7}')
+    return tmp_path
+
+
+@pytest.fixture
+def mongodb():
+    mongodb = MagicMock()
+    mongodb.insert_documents.return_value = []
+    return mongodb
+
+
+def inserted_documents(mongodb):
+    return [document for call in mongodb.insert_documents.call_args_list
+            for document in call[0][0]]
+
+
+class TestBulkIngestor:
+
+    def test_find_report_pairs(self, report_tree):
+        pairs = [(log.replace(str(report_tree), ''),
+                  report.replace(str(report_tree), ''))
+                 for log, report in find_report_pairs(str(report_tree))]
+        assert pairs == [
+            ('/agent1/test.log', '/agent1/.report.json'),
+            ('/agent1/test.log', '/agent1/build7.report.json'),
+            ('/agent2/logs/test.log', '/agent2/.report.json')
+        ]
+
+    def test_ingest_batches_documents(self, report_tree, mongodb):
+        ingestor = BulkIngestor(mongodb, workers=2, writers=1, batch_size=2)
+
+        stats = ingestor.ingest(str(report_tree))
+
+        assert stats['found'] == 3
+        assert stats['inserted'] == 3
+        assert stats['bytes'] > 0
+        assert [len(call[0][0]) for call in
+                mongodb.insert_documents.call_args_list] == [2, 1]
+        reports = sorted(json.dumps(document['report'])
+                         for document in inserted_documents(mongodb))
+        assert reports == sorted([json.dumps({'agent': 'agent1',
+                                              'tests': []}),
+                                  json.dumps({'agent': 'agent2',
+                                              'tests': []}),
+                                  json.dumps({'build': 7})])
+
+    def test_resume_from_checkpoint(self, report_tree, mongodb, tmp_path):
+        checkpoint = str(tmp_path / 'checkpoint.json')
+        mongodb.insert_documents.side_effect = \
+            lambda documents, **kwargs: [1] if len(documents) > 1 else []
+        BulkIngestor(mongodb, workers=2, writers=1, batch_size=3,
+                     checkpoint_path=checkpoint).ingest(str(report_tree))
+        assert len(open(checkpoint).read().splitlines()) == 2
+
+        # Only the pair that failed is written again
+        mongodb.reset_mock()
+        mongodb.insert_documents.side_effect = None
+        stats = BulkIngestor(mongodb, workers=2, checkpoint_path=checkpoint) \
+            .ingest(str(report_tree))
+
+        assert stats['skipped'] == 2
+        assert stats['inserted'] == 1
+        assert len(inserted_documents(mongodb)) == 1
+
+    def test_resume_after_crash_reuses_ids(self, report_tree, mongodb,
+                                           tmp_path):
+        checkpoint = str(tmp_path / 'checkpoint.json')
+        # 模拟写入成功后、记录检查点前崩溃: 首次导入未留下检查点
+        BulkIngestor(mongodb, workers=1).ingest(str(report_tree))
+        first = sorted(document['_id']
+                       for document in inserted_documents(mongodb))
+
+        mongodb.reset_mock()
+        mongodb.insert_documents.return_value = []
+        BulkIngestor(mongodb, workers=1, checkpoint_path=checkpoint) \
+            .ingest(str(report_tree))
+
+        # Verify the batch is retried under the same ids and duplicate keys
+        # count as inserted
+        assert sorted(document['_id']
+                      for document in inserted_documents(mongodb)) == first
+        assert len(set(first)) == 3
+        assert mongodb.insert_documents.call_args[1] == \
+            {'ignore_duplicates': True}
+
+    def test_log_with_invalid_utf8(self, report_tree, mongodb):
+        (report_tree / 'agent2' / 'logs' / 'test.log').write_bytes(
+            b'agent2 \xff\xfe log')
+
+        stats = BulkIngestor(mongodb, workers=1).ingest(str(report_tree))
+
+        # Verify undecodable bytes are replaced instead of failing the pair
+        assert stats['inserted'] == 3
+        assert 'agent2 \ufffd\ufffd log' in \
+            [document['log'] for document in inserted_documents(mongodb)]
+
+    def test_checkpoint_appends_and_reads_legacy_list(self, tmp_path):
+        path = tmp_path / 'checkpoint.json'
+        path.write_text(json.dumps(['a', 'b']))
+
+        checkpoint = Checkpoint(str(path))
+        checkpoint.add(['b', 'c'])
+
+        # Verify the legacy list is converted and only new keys appended
+        assert path.read_text().splitlines() == ['"a"', '"b"', '"c"']
+        assert 'c' in Checkpoint(str(path))
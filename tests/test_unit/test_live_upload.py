@@ -0,0 +1,102 @@
+# Contents of test_live_upload.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+import pytest
+from unit.live_upload import LiveUploader, collection_for
+from unit.metrics import parse_io_operation
+from unit.sketch import sketch_report
+
+logger = logging.getLogger(__name__)
+
+NODEID = ('tests/test_system/test_stress.py::TestAMD64MultiPathStress::'
+          'test_run_io_operation[100-32]')
+
+
+def phase_report(when, outcome='passed', nodeid=NODEID):
+    return SimpleNamespace(
+        nodeid=nodeid, when=when, outcome=outcome, duration=0.5,
+        fspath=nodeid.split('::')[0],
+        keywords={'test_run_io_operation[100-32]': 1,
+                  'TestAMD64MultiPathStress': 1, 'test_stress.py': 1})
+
+
+def run_test(uploader, message, nodeid=NODEID):
+    for when in ('setup', 'call', 'teardown'):
+        if when == 'call':
+            uploader._logs[nodeid] = [{'msg': message}]
+        uploader.pytest_runtest_logreport(phase_report(when, nodeid=nodeid))
+
+
+@pytest.fixture
+def mongodb():
+    mongodb = MagicMock()
+    mongodb.insert_documents.return_value = []
+    return mongodb
+
+
+class TestLiveUploader:
+
+    def test_collection_for(self):
+        assert collection_for('tests/test_system/test_stress.py') == 'system'
+
+    def test_document_matches_report_shape(self, mongodb):
+        uploader = LiveUploader(lambda name: mongodb)
+        uploader.pytest_collectreport(SimpleNamespace(
+            nodeid='tests/test_system/test_stress.py', outcome='passed'))
+
+        uploader.start()
+        run_test(uploader, 'stress_read_iops = 1000.0')
+        stats = uploader.drain()
+
+        # Verify the streamed document reads like a one-test json report
+        document, = mongodb.insert_documents.call_args[0][0]
+        test, = document['report']['tests']
+        assert test['outcome'] == 'passed'
+        assert parse_io_operation(test['keywords']) == \
+            ('stress', {'write_pattern': 100, 'io_depth': 32})
+        assert document['report']['collectors'][0]['outcome'] == 'passed'
+        assert list(sketch_report(document['report'])) == [
+            ('stress', (('write_pattern', 100), ('io_depth', 32)),
+             'read_iops')]
+        assert stats == {'queued': 1, 'inserted': 1, 'failed': 0}
+
+    def test_batches_and_backpressure(self, mongodb):
+        released = threading.Event()
+        batches = []
+
+        def insert_documents(documents):
+            batches.append(len(documents))
+            released.wait(5)
+            return []
+
+        mongodb.insert_documents.side_effect = insert_documents
+        uploader = LiveUploader(lambda name: mongodb, batch_size=2,
+                                queue_size=2)
+        uploader.start()
+        for index in range(4):
+            run_test(uploader, 'stress_read_iops = 1.0', f'{NODEID}-{index}')
+
+        # Verify the writer is blocked on the first batch with a full queue
+        producer = threading.Thread(target=run_test, args=(
+            uploader, 'stress_read_iops = 1.0', f'{NODEID}-4'))
+        producer.start()
+        producer.join(0.2)
+        assert producer.is_alive()
+
+        released.set()
+        producer.join(5)
+        uploader.drain()
+        assert batches == [2, 2, 1]
+
+    def test_teardown_error(self, mongodb):
+        uploader = LiveUploader(lambda name: mongodb)
+        uploader.pytest_runtest_logreport(phase_report('setup'))
+        uploader.pytest_runtest_logreport(phase_report('call'))
+        uploader.pytest_runtest_logreport(phase_report('teardown', 'failed'))
+
+        # Drain the queued document without a writer thread
+        _, document = uploader._documents.get_nowait()
+        assert document['report']['tests'][0]['outcome'] == 'error'
@@ -0,0 +1,78 @@
+# Contents of test_metrics.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import re
+import pytest
+from unit.metrics import (MetricExtractor, PLACEHOLDER, expand_placeholders,
+                          extract_metrics, metric_expression, metric_regex,
+                          parse_io_operation)
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = [
+    ("stress_read_iops = 1234.56", {"stress_read_iops": 1234.56}),
+    ("ramp_write_bw=87.5", {"ramp_write_bw": 87.5}),
+    ("sequential_read_iops = 42", {"sequential_read_iops": 42.0}),
+    ("stress_read_lat_p99 = 850.25", {"stress_read_lat_p99": 850.25}),
+    ("random_read_iops = 1.0, random_write_iops = 2.0",
+     {"random_read_iops": 1.0, "random_write_iops": 2.0}),
+    ("write_pattern = 100", {}),
+    ("random_read_lat_p99 = 1.0", {}),
+]
+
+
+class TestMetricExtractor:
+
+    @pytest.mark.parametrize("message, expected", MESSAGES)
+    def test_extract(self, message, expected):
+        assert extract_metrics(message) == expected
+
+    def test_extract_by_prefix(self):
+        message = "stress_read_iops = 1.5 ramp_read_iops = 2.5"
+        assert extract_metrics(message, 'stress') == {"read_iops": 1.5}
+
+    def test_extract_many(self):
+        extractor = MetricExtractor()
+        metrics = extractor.extract_many(["stress_read_iops = 1.0",
+                                          None,
+                                          "stress_read_bw = 2.0"], 'stress')
+        assert metrics == {"read_iops": 1.0, "read_bw": 2.0}
+
+    def test_custom_pattern_table(self):
+        extractor = MetricExtractor({'queue': ('depth',)})
+        assert extractor.extract("queue_depth = 8 stress_read_iops = 1.0") \
+            == {"queue_depth": 8.0}
+
+
+class TestPipelineGeneration:
+
+    def test_server_regex_matches_client(self):
+        # The generated $regexFindAll pattern must agree with the extractor
+        message = "stress_write_lat_p50 = 12.5"
+        match = re.search(metric_regex('stress'), message)
+        assert match.groups() == ('write_lat_p50', '12.5')
+
+    def test_metric_expression_scans_once(self):
+        expression = metric_expression('ramp', '$msg')
+        scan = expression["$arrayToObject"]["$map"]["input"]["$regexFindAll"]
+        assert scan == {"input": "$msg", "regex": metric_regex('ramp')}
+
+    def test_expand_placeholders(self):
+        pipeline = [{"$project": {"metrics": {PLACEHOLDER: {
+            "prefix": "stress", "input": "$msg"}}}}, {"$limit": 1}]
+
+        expanded = expand_placeholders(pipeline)
+
+        assert expanded[0]["$project"]["metrics"] == \
+            metric_expression('stress', '$msg')
+        assert expanded[1] == {"$limit": 1}
+
+    @pytest.mark.parametrize("keywords, expected", [
+        (['TestRandomReadWrite', 'test_run_io_operation[50-16]'],
+         ('random', {'write_pattern': 50, 'io_depth': 16})),
+        (['test_run_io_operation[0-128k]', 'TestSequentialReadWrite'],
+         ('sequential', {'write_pattern': 0, 'block_size': '128k'})),
+        (['TestRampTimeReadWrite', 'test_run_io_operation[100-128k]'], None),
+        (['TestUnknown', 'test_run_io_operation[50-16]'], None)])
+    def test_parse_io_operation(self, keywords, expected):
+        assert parse_io_operation(keywords) == expected
@@ -0,0 +1,189 @@
+# Contents of test_migration.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import threading
+from unittest.mock import MagicMock, patch
+from bson import ObjectId
+import pytest
+from unit.migration import (CURRENT_SCHEMA_VERSION, SCHEMA_FIELD, Migration,
+                            Migrator, ShapeReports, TagVersion)
+from unit.mongodb import MongoDB
+from unit.report_shaper import ReportShaper
+
+logger = logging.getLogger(__name__)
+
+IDS = [ObjectId() for _ in range(7)]
+
+
+class FakeCollection:
+    """Keeps documents in memory and answers the migrator's queries."""
+
+    def __init__(self, documents):
+        self.documents = {document['_id']: document for document in documents}
+        self.lock = threading.Lock()
+        self.name = 'system'
+
+    def matches(self, document, query):
+        id_range = query.get('_id', {})
+        if '$gt' in id_range and not document['_id'] > id_range['$gt']:
+            return False
+        if '$lte' in id_range and not document['_id'] <= id_range['$lte']:
+            return False
+        version = query[SCHEMA_FIELD]['$not']['$gte']
+        return document.get(SCHEMA_FIELD, 0) < version
+
+    def find(self, query):
+        with self.lock:
+            found = [dict(document) for _id, document in
+                     sorted(self.documents.items())
+                     if self.matches(document, query)]
+        cursor = MagicMock()
+        cursor.sort.return_value.limit.side_effect = \
+            lambda limit: found[:limit]
+        return cursor
+
+    def bulk_write(self, requests, ordered):
+        modified = 0
+        with self.lock:
+            for request in requests:
+                stored = self.documents[request._filter['_id']]
+                if stored.get(SCHEMA_FIELD) == request._filter[SCHEMA_FIELD]:
+                    self.documents[stored['_id']] = request._doc
+                    modified += 1
+        return MagicMock(modified_count=modified)
+
+
+def document(_id, version=None):
+    document = {'_id': _id, 'log': 'stress_read_iops = 1.0',
+                'report': {'summary': {'passed': 1}, 'tests': [{
+                    'nodeid': 'test_a', 'setup': {'duration': 1.0}}]}}
+    if version is not None:
+        document[SCHEMA_FIELD] = version
+    return document
+
+
+@pytest.fixture
+def shaper():
+    return ReportShaper(['summary', 'tests.nodeid'])
+
+
+@pytest.fixture
+def mongodb():
+    mongodb = MagicMock()
+    mongodb.collection = FakeCollection(
+        [document(_id) for _id in IDS[:5]] + [document(IDS[5], 1),
+                                              document(IDS[6], 2)])
+    mongodb.db.__getitem__.return_value.find_one.return_value = None
+    mongodb.partition_bounds.return_value = [(None, IDS[2]), (IDS[2], None)]
+    return mongodb
+
+
+class TestMigrator:
+
+    def test_upgrade_chain(self, mongodb, shaper):
+        migrator = Migrator(mongodb, [ShapeReports(shaper), TagVersion()])
+        archive = []
+
+        upgraded = migrator.upgrade(document(IDS[0]), archive)
+
+        # Verify both steps ran in version order and the full report is kept
+        assert upgraded[SCHEMA_FIELD] == 2
+        assert upgraded['report'] == {'summary': {'passed': 1},
+                                      'tests': [{'nodeid': 'test_a'}]}
+        assert upgraded['log'] == {'archived': 'collection', 'bytes': 22}
+        assert archive == [{'_id': IDS[0],
+                            'report': document(IDS[0])['report'],
+                            'log': 'stress_read_iops = 1.0'}]
+
+    def test_run_migrates_shards(self, mongodb, shaper):
+        migrator = Migrator(mongodb, [TagVersion(), ShapeReports(shaper)],
+                            batch_size=2)
+
+        stats = migrator.run()
+
+        # Verify every document below version 2 is upgraded exactly once
+        assert stats['migrated'] == 6
+        assert stats['failed'] == stats['skipped'] == 0
+        assert all(stored[SCHEMA_FIELD] == 2 for stored in
+                   mongodb.collection.documents.values())
+        archived = [_id for call in
+                    mongodb.archive_collection().insert_many.call_args_list
+                    for _id in (item['_id'] for item in call[0][0])]
+        assert sorted(archived) == IDS[:6]
+        state = mongodb.db[None]
+        assert state.update_one.call_args[0][1] == \
+            {'$set': {'completed': True}}
+        assert migrator.run()['migrated'] == 0
+
+    def test_resume_after_last_id(self, mongodb, shaper):
+        state = mongodb.db[None]
+        state.find_one.return_value = {'bounds': [[None, None]],
+                                       'last_ids': {'0': IDS[3]}}
+        migrator = Migrator(mongodb, [TagVersion(), ShapeReports(shaper)])
+
+        stats = migrator.run()
+
+        # Verify the stored bounds are reused and migrated ids are skipped
+        mongodb.partition_bounds.assert_not_called()
+        assert stats['migrated'] == 2
+        assert SCHEMA_FIELD not in mongodb.collection.documents[IDS[3]]
+
+    def test_concurrent_change_is_skipped(self, mongodb, shaper):
+        collection = mongodb.collection
+        bulk_write = collection.bulk_write
+
+        def changed_by_writer(requests, ordered):
+            # 模拟迁移读取后其他写入者修改了文档
+            collection.documents[IDS[0]][SCHEMA_FIELD] = 1
+            return bulk_write(requests, ordered)
+
+        collection.bulk_write = changed_by_writer
+        migrator = Migrator(mongodb, [TagVersion(), ShapeReports(shaper)],
+                            shards=1)
+        mongodb.partition_bounds.return_value = [(None, None)]
+
+        stats = migrator.run()
+
+        assert stats['skipped'] == 1
+        assert stats['migrated'] == 5
+
+    def test_unknown_target(self, mongodb, shaper):
+        with pytest.raises(ValueError):
+            Migrator(mongodb, [TagVersion()], target=3)
+
+    def test_migration_without_upgrade(self):
+        class Incomplete(Migration):
+            version = 3
+            name = 'incomplete'
+
+        # Verify a step missing upgrade fails before any shard runs
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    @patch('unit.mongodb.MongoClient')
+    def test_fresh_document_is_skipped(self, mock_client, mongodb, shaper):
+        writer = MongoDB('localhost', 27017, 'test_db', 'system',
+                         report_shaper=shaper)
+        fresh, _ = writer.shape_document(document(None))
+        fresh['_id'] = ObjectId()
+        mongodb.collection.documents = {fresh['_id']: fresh}
+        mongodb.partition_bounds.return_value = [(None, None)]
+
+        stats = Migrator(mongodb, [TagVersion(), ShapeReports(shaper)]).run()
+
+        # Verify documents written by MongoDB need no migration
+        assert fresh[SCHEMA_FIELD] == CURRENT_SCHEMA_VERSION
+        assert stats['migrated'] == stats['skipped'] == 0
+        mongodb.archive_collection().insert_many.assert_not_called()
+
+    @patch('unit.mongodb.MongoClient')
+    def test_unshaped_document_is_still_shaped(self, mock_client, shaper):
+        writer = MongoDB('localhost', 27017, 'test_db', 'system')
+
+        written, archived = writer.shape_document(document(IDS[0]))
+
+        # Verify a full report written without a shaper stays migratable
+        assert archived is None
+        assert written[SCHEMA_FIELD] == TagVersion.version
+        assert Migrator(MagicMock(), [TagVersion(), ShapeReports(shaper)]) \
+            .upgrade(written, [])['report']['tests'] == [{'nodeid': 'test_a'}]
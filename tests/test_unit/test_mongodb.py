@@ -1,11 +1,15 @@
 # Contents of test_win10_mongodb.py
 '''Copyright (c) 2024 Jaron Cheng'''
 import logging
-from unit.mongodb import MongoDB
+import threading
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, errors
+from unit.mongodb import (AggregationLimitError, MongoDB,
+                          analytics_read_preference, summary_statistics)
 from unittest.mock import patch
 import json
 import pytest
-from unittest.mock import patch, mock_open
+from unittest.mock import MagicMock, patch, mock_open
 
 logger = logging.getLogger(__name__)
 
@@ -64,18 +68,22 @@ class TestMongoDB:
 
         with patch("builtins.open",
                    mock_open(read_data=mock_log_data)) as mock_log_file, \
-             patch("json.load", return_value=mock_report_data):
+             patch("unit.serializer.load_file",
+                   return_value=mock_report_data) as mock_load_file:
             
             mongo_db_instance.write_log_and_report(log_path, report_path)
             
             # Verify the file open calls
-            mock_log_file.assert_any_call(log_path, 'r')
-            mock_log_file.assert_any_call(report_path, 'r')
+            mock_log_file.assert_any_call(log_path, 'r', encoding='utf-8',
+                                           errors='replace')
+            mock_load_file.assert_called_once_with(report_path)
 
             # Verify the document insertion into MongoDB
             expected_document = {
                 'log': mock_log_data,
-                'report': mock_report_data
+                'report': mock_report_data,
+                # 未配置报告整形时标记为待整形的版本
+                'schema_version': 1
             }
             mock_collection.insert_one.assert_called_once_with(expected_document)
     
@@ -91,14 +99,14 @@ class TestMongoDB:
             mongo_db_instance.read_result(result_path)
             
             # Verify the file write call
-            mock_file.assert_called_once_with(result_path, 'w')
+            mock_file.assert_called_once_with(result_path, 'wb')
             
             # Retrieve the actual write calls
             handle = mock_file()
             written_data = handle.write.call_args_list
             
             # Convert written data back to JSON for comparison
-            written_json = json.loads("".join(call[0][0] for call in written_data))
+            written_json = json.loads(b"".join(call[0][0] for call in written_data))
             
             assert written_json == mock_documents
 
@@ -159,3 +167,445 @@ class TestMongoDB:
         if result:
             logger.debug(f'metrics = {json.dumps(result, indent=4)}')
 
+
+    def test_latest_id(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        mock_collection.find_one.reset_mock()
+        mock_collection.find_one.return_value = {"_id": 42}
+
+        result = mongo_db_instance.latest_id()
+
+        # Verify the newest _id is looked up by a descending sort
+        mock_collection.find_one.assert_called_once_with(
+            {}, {'_id': 1}, sort=[('_id', DESCENDING)], session=None)
+        assert result == 42
+
+    def test_aggregate_stress_metrics_since_id(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        mongo_db_instance.query_options = {}
+        mock_collection.aggregate.reset_mock()
+        mock_collection.aggregate.return_value = [{"combined_data": []}]
+
+        mongo_db_instance.aggregate_stress_metrics(limit=10, since_id=1,
+                                                   until_id=9)
+
+        # Verify only the requested _id range is aggregated
+        pipeline = mock_collection.aggregate.call_args[0][0]
+        assert pipeline[0] == {'$match': {'_id': {'$gt': 1, '$lte': 9}}}
+        assert {'$limit': 10} in pipeline
+
+    def test_named_pipeline_adds_listed_ids(self, mongo_db):
+        mongo_db_instance, _ = mongo_db
+
+        listed = mongo_db_instance.named_pipeline('stress', ids=[3, 5])
+        both = mongo_db_instance.named_pipeline('stress', until_id=2,
+                                                ids=[3])
+
+        # Verify listed ids alone restrict the pipeline and extend a range
+        assert listed[0] == {'$match': {'_id': {'$in': [3, 5]}}}
+        assert both[0] == {'$match': {'$or': [{'_id': {'$lte': 2}},
+                                              {'_id': {'$in': [3]}}]}}
+
+    def test_document_ids(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        mock_collection.find.return_value = MagicMock()
+        mock_collection.find.return_value.sort.return_value = \
+            [{'_id': 4}, {'_id': 6}]
+
+        ids = mongo_db_instance.document_ids(3, 6)
+
+        # Verify only the _id field of the range is read, in _id order
+        assert mock_collection.find.call_args[0] == \
+            ({'_id': {'$gt': 3, '$lte': 6}}, {'_id': 1})
+        mock_collection.find.return_value.sort.assert_called_with(
+            '_id', ASCENDING)
+        assert ids == [4, 6]
+
+    def test_load_pipeline_is_cached_and_copied(self, mongo_db):
+        mongo_db_instance, _ = mongo_db
+
+        first = mongo_db_instance.load_pipeline('stress')
+        first.clear()
+        with patch("builtins.open") as mock_file:
+            second = mongo_db_instance.load_pipeline('stress')
+
+        # Verify the cached pipeline is reused and not mutated by callers
+        mock_file.assert_not_called()
+        assert {'$limit': 10000} in second
+
+    @pytest.mark.parametrize("name", ["stress", "ramp_times"])
+    def test_load_pipeline_expands_metrics(self, mongo_db, name):
+        mongo_db_instance, _ = mongo_db
+
+        pipeline = json.dumps(mongo_db_instance.load_pipeline(name))
+
+        # Verify one $regexFindAll scan replaces the per-metric $regexFind
+        assert "$extractMetrics" not in pipeline
+        assert pipeline.count("$regexFindAll") == 1
+        assert "read_iops_string" not in pipeline
+
+    def test_insert_documents_reports_failures(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        documents = [{"n": 1}, {"n": 2}, {"n": 3}]
+        mock_collection.insert_many.side_effect = errors.BulkWriteError(
+            {"writeErrors": [{"index": 1}]})
+
+        failed = mongo_db_instance.insert_documents(documents)
+
+        # Verify an unordered batch write and the failed index
+        mock_collection.insert_many.assert_called_once_with(documents,
+                                                            ordered=False)
+        assert failed == [1]
+        mock_collection.insert_many.side_effect = None
+
+    @patch('unit.mongodb.MongoClient')
+    def test_insert_documents_ignores_duplicates(self, mock_client):
+        collection = mock_client.return_value['test_db']['test_collection']
+        collection.insert_many.side_effect = errors.BulkWriteError(
+            {'writeErrors': [{'index': 0, 'code': 11000},
+                             {'index': 2, 'code': 121}]})
+        mongo_db_instance = MongoDB('localhost', 27017, 'test_db',
+                                    'test_collection', query_options={},
+                                    maintain_summaries=True)
+
+        failed = mongo_db_instance.insert_documents(
+            [{'_id': 1}, {'_id': 2}, {'_id': 3}], ignore_duplicates=True)
+
+        # Verify an already stored _id counts as inserted but is not folded
+        # into the summaries again
+        assert failed == [2]
+        assert collection.aggregate.call_args[0][0][0] == \
+            {'$match': {'_id': {'$in': [2]}}}
+
+    def test_query_options_precedence(self, mongo_db):
+        mongo_db_instance, _ = mongo_db
+        mongo_db_instance.query_options = {
+            'default': {'allowDiskUse': True, 'maxTimeMS': 1000},
+            'stress': {'maxTimeMS': 5000, 'batchSize': 100}}
+
+        options = mongo_db_instance.query_options_for('stress',
+                                                      batchSize=None)
+
+        # Verify per-pipeline options override the defaults and None unsets
+        assert options == {'allowDiskUse': True, 'maxTimeMS': 5000}
+        with pytest.raises(ValueError):
+            mongo_db_instance.query_options_for('stress', hint='_id_')
+
+    def test_aggregate_passes_options_and_read_preference(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        mongo_db_instance.query_options = {'default': {'maxTimeMS': 1000}}
+        secondary = mock_collection.with_options.return_value
+        secondary.aggregate.return_value = [{"combined_data": []}]
+
+        mongo_db_instance.aggregate_stress_metrics(
+            limit=10, read_preference='secondaryPreferred')
+
+        # Verify the options reach the server and reads go to secondaries
+        assert mock_collection.with_options.call_args[1][
+            'read_preference'].mongos_mode == 'secondaryPreferred'
+        assert secondary.aggregate.call_args[1] == {'comment': 'stress',
+                                                    'session': None,
+                                                    'maxTimeMS': 1000}
+
+    @pytest.mark.parametrize("error, limit", [
+        (errors.ExecutionTimeout("operation exceeded time limit", 50),
+         'time'),
+        (errors.OperationFailure("Exceeded memory limit for $group", 292),
+         'memory')])
+    def test_aggregate_limit_error(self, mongo_db, error, limit):
+        mongo_db_instance, mock_collection = mongo_db
+        mongo_db_instance.query_options = {}
+        mock_collection.aggregate.side_effect = error
+
+        # Verify a limit failure names the pipeline instead of returning None
+        with pytest.raises(AggregationLimitError) as excinfo:
+            mongo_db_instance.aggregate_ramp_metrics(limit=10)
+        mock_collection.aggregate.side_effect = None
+        assert excinfo.value.pipeline == 'ramp_times'
+        assert excinfo.value.limit == limit
+        assert excinfo.value.elapsed >= 0
+
+    def test_aggregate_partitioned(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        mongo_db_instance.query_options = {'stress': {'partitions': 3,
+                                                      'maxTimeMS': 5000}}
+        mock_collection.aggregate.reset_mock()
+        partials = {
+            'stress[0]': [{'_id': None, 'combined_data': [1, 2]}],
+            'stress[1]': [],
+            'stress[2]': [{'_id': None, 'combined_data': [3, 4]}]}
+
+        def aggregate(pipeline, comment, **options):
+            if comment == 'partitions':
+                return [{'_id': {'min': 1}, 'last': 4},
+                        {'_id': {'min': 5}, 'last': 6},
+                        {'_id': {'min': 7}, 'last': 9}]
+            return partials[comment]
+
+        mock_collection.aggregate.side_effect = aggregate
+        result = mongo_db_instance.aggregate_stress_metrics(
+            limit=3, since_id=0, until_id=9)
+        mock_collection.aggregate.side_effect = None
+
+        # Verify each partition narrows the requested _id range
+        ranges = {call[1]['comment']: call[0][0][0]['$match']['_id']
+                  for call in mock_collection.aggregate.call_args_list}
+        assert ranges['partitions'] == {'$gt': 0, '$lte': 9}
+        assert ranges['stress[0]'] == {'$gt': 0, '$lte': 4}
+        assert ranges['stress[1]'] == {'$gt': 4, '$lte': 6}
+        assert ranges['stress[2]'] == {'$gt': 6, '$lte': 9}
+        # Verify the bounds query runs with the same execution options
+        assert all(call[1]['maxTimeMS'] == 5000
+                   for call in mock_collection.aggregate.call_args_list)
+        # Verify every partition keeps its first rows in _id order
+        for call in mock_collection.aggregate.call_args_list[1:]:
+            stages = [next(iter(stage)) for stage in call[0][0]]
+            assert stages.index('$sort') == stages.index('$limit') - 1
+            assert call[0][0][stages.index('$sort')] == {'$sort': {'_id': 1}}
+        # Verify the pushed rows are concatenated in _id order and limited
+        assert result == {'_id': None, 'combined_data': [1, 2, 3]}
+
+    def test_aggregate_records_is_columnar(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        mongo_db_instance.query_options = {}
+        mock_collection.aggregate.reset_mock()
+        mock_collection.aggregate.return_value = [{
+            '_id': None, 'io_depth': [8, 16], 'read_iops': [1.0, None]}]
+
+        records = mongo_db_instance.aggregate_records(
+            'stress', ['io_depth', 'read_iops'], limit=10)
+
+        # Verify the rows come back as one array per field
+        group = mock_collection.aggregate.call_args[0][0][-1]['$group']
+        assert sorted(group) == ['_id', 'io_depth', 'read_iops']
+        assert list(records['io_depth']) == [8, 16]
+        assert np.isnan(records['read_iops'][1])
+
+    @patch('unit.mongodb.read_log_and_report')
+    @patch('unit.mongodb.MongoClient')
+    def test_read_routing_splits_reads_and_writes(self, mock_client,
+                                                  mock_read):
+        primary = mock_client.return_value['test_db']['test_collection']
+        analytics = primary.with_options.return_value
+        analytics.aggregate.return_value = [{"combined_data": []}]
+        analytics.find_one.return_value = {'_id': 7}
+        mock_read.return_value = {'log': 'log', 'report': {}}
+        mongo_db_instance = MongoDB(
+            'localhost', 27017, 'test_db', 'test_collection',
+            query_options={}, read_routing={
+                'read_preference': 'secondaryPreferred',
+                'max_staleness_seconds': 120,
+                'tag_sets': [{'workload': 'analytics'}, {}]})
+
+        mongo_db_instance.write_log_and_report('test.log', '.report.json')
+        mongo_db_instance.aggregate_stress_metrics(
+            limit=10, since_id=None, until_id=mongo_db_instance.latest_id())
+
+        # Verify writes stay on the primary and reads use the bounded secondary
+        read_preference = primary.with_options.call_args[1]['read_preference']
+        assert read_preference.mongos_mode == 'secondaryPreferred'
+        assert read_preference.max_staleness == 120
+        assert read_preference.tag_sets == [{'workload': 'analytics'}, {}]
+        primary.insert_one.assert_called_once()
+        primary.aggregate.assert_not_called()
+        pipeline = analytics.aggregate.call_args[0][0]
+        assert pipeline[0] == {'$match': {'_id': {'$lte': 7}}}
+
+    @pytest.mark.parametrize("routing", [
+        {'read_preference': 'primary'}, {'max_staleness_seconds': 120}])
+    def test_read_routing_rejects_primary(self, routing):
+        # Verify a wrong or missing mode names the valid ones
+        with pytest.raises(ValueError, match='secondaryPreferred'):
+            analytics_read_preference(routing)
+
+    @patch('unit.mongodb.MongoClient')
+    def test_consistent_reads_share_the_watermark_session(self,
+                                                          mock_client):
+        analytics = mock_client.return_value['test_db'][
+            'test_collection'].with_options.return_value
+        analytics.find_one.return_value = {'_id': 9}
+        analytics.aggregate.side_effect = lambda pipeline, comment, **_: \
+            [{'_id': {'min': 1}, 'last': 4}] if comment == 'partitions' \
+            else [{'_id': None, 'combined_data': [1]}]
+        mongo_db_instance = MongoDB(
+            'localhost', 27017, 'test_db', 'test_collection',
+            query_options={'stress': {'partitions': 2}},
+            read_routing={'read_preference': 'secondary'})
+        session = mock_client.return_value.start_session.return_value
+
+        with mongo_db_instance.consistent_reads() as reads:
+            mongo_db_instance.aggregate_stress_metrics(
+                limit=10, until_id=mongo_db_instance.latest_id(reads),
+                session=reads)
+
+        # Verify the watermark and the partition bounds use the session and
+        # every partition thread a follower advanced to its cluster time
+        mock_client.return_value.start_session.assert_called_with(
+            causal_consistency=True)
+        assert analytics.find_one.call_args[1]['session'] is \
+            session.__enter__.return_value
+        sessions = {call[1]['comment']: call[1]['session']
+                    for call in analytics.aggregate.call_args_list}
+        assert sessions['partitions'] is session.__enter__.return_value
+        assert sessions['stress[0]'] is session.__enter__.return_value
+        session.advance_cluster_time.assert_called_with(
+            session.__enter__.return_value.cluster_time)
+        session.advance_operation_time.assert_called_with(
+            session.__enter__.return_value.operation_time)
+
+    def test_summary_statistics(self):
+        document = {'_id': {'kind': 'random', 'write_pattern': 0,
+                            'io_depth': 8},
+                    'read_iops_count': 2, 'read_iops_sum': 300.0,
+                    'read_iops_sumsq': 50000.0, 'read_iops_min': 100.0,
+                    'read_iops_max': 200.0, 'write_iops_count': 0}
+
+        result = summary_statistics(document)
+
+        # Verify the derived stats match avg/stdDevPop of the samples
+        assert result['_id'] == {'write_pattern': 0, 'io_depth': 8}
+        assert result['avg_read_iops'] == 150.0
+        assert result['std_dev_read_iops'] == pytest.approx(50.0)
+        assert result['max_read_iops'] == 200.0
+        assert result['avg_write_iops'] is None
+
+    def test_get_random_summary_point_lookup(self, mongo_db):
+        mongo_db_instance, _ = mongo_db
+        mock_summary = mongo_db_instance.summary_collection()
+        mock_summary.find_one.return_value = {
+            '_id': {'kind': 'random', 'write_pattern': 0, 'io_depth': 8},
+            'read_iops_count': 1, 'read_iops_sum': 10.0,
+            'read_iops_sumsq': 100.0}
+
+        result = mongo_db_instance.get_random_summary(0, 8)
+
+        # Verify a single lookup on the configuration _id
+        mock_summary.find_one.assert_called_with(
+            {'_id': {'kind': 'random', 'write_pattern': 0, 'io_depth': 8}})
+        assert result['avg_read_iops'] == 10.0
+
+    @patch('unit.mongodb.read_log_and_report')
+    @patch('unit.mongodb.MongoClient')
+    def test_write_refreshes_summaries(self, mock_client, mock_read):
+        collection = mock_client.return_value['test_db']['test_collection']
+        collection.insert_one.return_value.inserted_id = 7
+        mock_read.return_value = {'log': 'log', 'report': {}}
+        mongo_db_instance = MongoDB('localhost', 27017, 'test_db',
+                                    'test_collection', query_options={},
+                                    maintain_summaries=True)
+
+        mongo_db_instance.write_log_and_report('test.log', '.report.json')
+
+        # Verify the new document is merged into both summaries additively
+        pipelines = [call[0][0] for call in
+                     collection.aggregate.call_args_list]
+        assert len(pipelines) == 2
+        for pipeline in pipelines:
+            assert pipeline[0] == {'$match': {'_id': 7}}
+            merge = pipeline[-1]['$merge']
+            assert merge['whenMatched'][0]['$set']['read_iops_sum'] == {
+                '$add': ['$read_iops_sum', '$$new.read_iops_sum']}
+        assert pipelines[1][-2]['$group']['_id']['block_size'] == \
+            '$block_size'
+
+    @patch('unit.mongodb.MongoClient')
+    def test_insert_documents_refreshes_summaries(self, mock_client):
+        collection = mock_client.return_value['test_db']['test_collection']
+        collection.insert_many.side_effect = errors.BulkWriteError(
+            {'writeErrors': [{'index': 1}]})
+        mongo_db_instance = MongoDB('localhost', 27017, 'test_db',
+                                    'test_collection', query_options={},
+                                    maintain_summaries=True)
+
+        mongo_db_instance.insert_documents([{'_id': 1}, {'_id': 2},
+                                            {'_id': 3}])
+
+        # Verify only the inserted documents are merged into the summaries
+        pipelines = [call[0][0] for call in
+                     collection.aggregate.call_args_list]
+        assert len(pipelines) == 2
+        for pipeline in pipelines:
+            assert pipeline[0] == {'$match': {'_id': {'$in': [1, 3]}}}
+            assert '$merge' in pipeline[-1]
+
+    def test_rebuild_summaries(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        mock_collection.aggregate.reset_mock()
+        mock_collection.aggregate.side_effect = None
+
+        assert mongo_db_instance.refresh_summaries()
+
+        # Verify one aggregation atomically replaces both summaries
+        pipeline = mock_collection.aggregate.call_args[0][0]
+        assert '$unionWith' in pipeline[-2]
+        assert '$out' in pipeline[-1]
+
+
+class TestFanOut:
+
+    @pytest.fixture
+    def mongo_db(self):
+        with patch('unit.mongodb.MongoClient') as mock_client:
+            db = mock_client.return_value['MLAutoRAID']
+            db.list_collection_names.return_value = [
+                'amd_desktop', 'amd_server', 'system', 'system_archive']
+            collections = {}
+            db.get_collection.side_effect = lambda name, **kwargs: \
+                collections.setdefault(name, MagicMock(name=name))
+            yield MongoDB('localhost', 27017, 'MLAutoRAID', 'system',
+                          query_options={}), collections
+
+    def test_resolve_collections(self, mongo_db):
+        mongo_db_instance, _ = mongo_db
+        assert mongo_db_instance.resolve_collections(
+            ['amd_*', 'system', 'amd_desktop']) == \
+            ['amd_desktop', 'amd_server', 'system']
+
+    def test_fan_out_runs_concurrently(self, mongo_db):
+        mongo_db_instance, collections = mongo_db
+        barrier = threading.Barrier(2, timeout=5)
+
+        def aggregate(name):
+            def run(pipeline, **kwargs):
+                # 两个集合的查询必须同时进行才能通过屏障
+                barrier.wait()
+                return [{'_id': None, 'combined_data': [name]}]
+            return run
+
+        for name in ('amd_desktop', 'amd_server'):
+            mongo_db_instance._analytics_handle(name).aggregate.side_effect \
+                = aggregate(name)
+
+        results = dict(mongo_db_instance.fan_out('stress', 'amd_*'))
+
+        assert results == {
+            'amd_desktop': {'_id': None, 'combined_data': ['amd_desktop']},
+            'amd_server': {'_id': None, 'combined_data': ['amd_server']}}
+
+    def test_aggregate_across_merges_partials(self, mongo_db):
+        mongo_db_instance, collections = mongo_db
+        partials = {'amd_desktop': [{'_id': None, 'combined_data': [1, 2]}],
+                    'amd_server': [{'_id': None, 'combined_data': [3]}]}
+        for name, documents in partials.items():
+            mongo_db_instance._analytics_handle(name).aggregate.return_value \
+                = documents
+
+        result = mongo_db_instance.aggregate_across(
+            'stress', ['amd_server', 'amd_desktop'], limit=2)
+
+        # Verify rows follow the collection order and the limit applies
+        assert result == {'_id': None, 'combined_data': [3, 1]}
+
+    def test_union_groups_once(self, mongo_db):
+        mongo_db_instance, collections = mongo_db
+        base = mongo_db_instance._analytics_handle('amd_desktop')
+        base.aggregate.return_value = [{'_id': None, 'combined_data': []}]
+
+        list(mongo_db_instance.fan_out('stress', 'amd_*', union=True))
+
+        # Verify the rows of the other collection are unioned before $group
+        pipeline = base.aggregate.call_args[0][0]
+        union = pipeline[-2]['$unionWith']
+        assert union['coll'] == 'amd_server'
+        assert '$group' not in json.dumps(union['pipeline'])
+        assert '$group' in pipeline[-1]
@@ -0,0 +1,146 @@
+# Contents of test_partition.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import numpy as np
+import pytest
+from unit.partition import (is_partitionable, merge_groups, partial_group,
+                            pipeline_limit)
+
+logger = logging.getLogger(__name__)
+
+GROUP = {
+    '_id': '$io_depth',
+    'count': {'$sum': 1},
+    'avg_read_iops': {'$avg': '$read_iops'},
+    'std_dev_read_iops': {'$stdDevPop': '$read_iops'},
+    'min_read_iops': {'$min': '$read_iops'},
+    'max_read_iops': {'$max': '$read_iops'},
+    'rows': {'$push': '$read_iops'}
+}
+
+
+def run_partial(group, rows):
+    """Evaluates a partial `$group` over (io_depth, read_iops) rows."""
+    results = {}
+    for io_depth, value in rows:
+        result = results.setdefault(io_depth, {'_id': io_depth})
+        for field, accumulator in group.items():
+            if field == '_id':
+                continue
+            (operator, _), = accumulator.items()
+            if field == 'count' or field.endswith('__count'):
+                result[field] = result.get(field, 0) + 1
+            elif field.endswith('__sumsq'):
+                result[field] = result.get(field, 0) + value * value
+            elif field.endswith('__sum'):
+                result[field] = result.get(field, 0) + value
+            elif operator == '$min':
+                result[field] = min(result.get(field, value), value)
+            elif operator == '$max':
+                result[field] = max(result.get(field, value), value)
+            elif operator == '$push':
+                result[field] = result.get(field, []) + [value]
+    return list(results.values())
+
+
+def run_rows(pipeline, documents):
+    """
+    Evaluates `$match` (equality), `$sort` (one ascending field), `$limit`
+    and a `$push` `$group`.
+    """
+    for stage in pipeline:
+        (operator, spec), = stage.items()
+        if operator == '$sort':
+            (field, _), = spec.items()
+            documents = sorted(documents, key=lambda document: document[field])
+        elif operator == '$match':
+            documents = [document for document in documents
+                         if all(document.get(field) == value
+                                for field, value in spec.items())]
+        elif operator == '$limit':
+            documents = documents[:spec]
+        elif operator == '$group':
+            return [{'_id': None, 'rows': [document['n']
+                                           for document in documents]}]
+    return documents
+
+
+class TestPartition:
+
+    def test_partial_group(self):
+        partial = partial_group(GROUP)
+
+        # Verify avg/stdDevPop are split into additive count/sum/sumsq
+        assert 'avg_read_iops' not in partial
+        assert partial['std_dev_read_iops__sumsq'] == {'$sum': {'$multiply': [
+            '$read_iops', '$read_iops']}}
+        assert partial['min_read_iops'] == GROUP['min_read_iops']
+        assert partial['rows'] == GROUP['rows']
+
+    def test_merge_equals_whole(self):
+        rng = np.random.default_rng(5)
+        rows = [(int(io_depth), float(value)) for io_depth, value in
+                zip(rng.integers(1, 4, 300), rng.normal(1000, 50, 300))]
+        partial = partial_group(GROUP)
+
+        merged = merge_groups(GROUP, [run_partial(partial, rows[:100]),
+                                      run_partial(partial, rows[100:250]),
+                                      run_partial(partial, rows[250:])])
+
+        for result in merged:
+            values = [value for io_depth, value in rows
+                      if io_depth == result['_id']]
+            assert result['count'] == len(values)
+            assert result['avg_read_iops'] == pytest.approx(np.mean(values))
+            assert result['std_dev_read_iops'] == \
+                pytest.approx(np.std(values))
+            assert result['min_read_iops'] == min(values)
+            assert result['max_read_iops'] == max(values)
+            assert result['rows'] == values
+        assert sorted(result['_id'] for result in merged) == [1, 2, 3]
+
+    @pytest.mark.parametrize("pipeline, expected", [
+        ([{'$match': {}}, {'$sort': {'_id': 1}}, {'$limit': 5}, {'$group': {
+            '_id': None, 'rows': {'$push': '$$ROOT'}}}], True),
+        ([{'$match': {}}, {'$limit': 5}, {'$group': {
+            '_id': None, 'rows': {'$push': '$$ROOT'}}}], False),
+        ([{'$sort': {'_id': 1}}, {'$limit': 5}, {'$group': GROUP}], False),
+        ([{'$sort': {'_id': 1}}, {'$limit': 5}, {'$match': {}}, {'$group': {
+            '_id': None, 'rows': {'$push': '$$ROOT'}}}], False),
+        ([{'$sort': {'_id': 1}}, {'$limit': 5}, {'$project': {'n': 1}},
+          {'$group': {'_id': None, 'rows': {'$push': '$$ROOT'}}}], True),
+        ([{'$sort': {'_id': 1}}, {'$group': GROUP}], True),
+        ([{'$sort': {'n': 1}}, {'$group': GROUP}], False),
+        ([{'$group': {'_id': None, 'n': {'$median': {}}}}], False),
+        ([{'$group': GROUP}, {'$project': {'count': 1}}], False)])
+    def test_is_partitionable(self, pipeline, expected):
+        assert is_partitionable(pipeline) == expected
+
+    def test_pipeline_limit(self):
+        assert pipeline_limit([{'$limit': 9}, {'$limit': 3}]) == 3
+        assert pipeline_limit([{'$match': {}}]) is None
+
+    @pytest.mark.parametrize("pipeline", [
+        [{'$match': {'passed': True}}, {'$sort': {'_id': 1}}, {'$limit': 6},
+         {'$group': {'_id': None, 'rows': {'$push': '$n'}}}],
+        [{'$match': {'passed': True}}, {'$limit': 6},
+         {'$group': {'_id': None, 'rows': {'$push': '$n'}}}],
+        [{'$sort': {'_id': 1}}, {'$limit': 6}, {'$match': {'passed': True}},
+         {'$group': {'_id': None, 'rows': {'$push': '$n'}}}]])
+    def test_partitioned_limit_equals_serial(self, pipeline):
+        # 自然顺序与 _id 顺序不同, 分区按 _id 范围划分
+        order = np.random.default_rng(7).permutation(30)
+        documents = [{'_id': int(n), 'n': int(n), 'passed': n % 3 != 0}
+                     for n in order]
+        partial = pipeline[:-1] + [{'$group': partial_group(
+            pipeline[-1]['$group'])}]
+
+        serial = run_rows(pipeline, documents)
+        partitioned = merge_groups(
+            pipeline[-1]['$group'],
+            [run_rows(partial, [document for document in documents
+                                if start <= document['_id'] < start + 10])
+             for start in (0, 10, 20)], pipeline_limit(pipeline))
+
+        # Verify partitioning is only chosen when it returns the same rows
+        assert is_partitionable(pipeline) == (partitioned == serial)
@@ -0,0 +1,61 @@
+# Contents of test_records.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import numpy as np
+import pandas as pd
+from unit.records import MetricRecords, columnar_group
+
+logger = logging.getLogger(__name__)
+
+ROWS = [{'write_pattern': 100, 'io_depth': 8, 'read_iops': 1000.0,
+         'read_lat_p99': None},
+        {'write_pattern': 0, 'io_depth': 16, 'read_iops': 1200.5,
+         'read_lat_p99': 850.0},
+        {'write_pattern': 0, 'io_depth': 16, 'read_iops': 1100}]
+
+
+class TestMetricRecords:
+
+    def test_columnar_group(self):
+        group = columnar_group(['io_depth', 'read_iops'])['$group']
+        assert group['_id'] is None
+        assert group['read_iops'] == {'$push': {'$ifNull': ['$read_iops',
+                                                            None]}}
+
+    def test_dtypes(self):
+        records = MetricRecords.from_rows(ROWS + [{'write_iops': None}])
+
+        # Verify native columns, NaN for missing and no all-null columns
+        dtypes = dict(records.array.dtype.fields)
+        assert records.fields == ['write_pattern', 'io_depth', 'read_iops',
+                                  'read_lat_p99']
+        assert dtypes['read_iops'][0] == np.float64
+        assert dtypes['io_depth'][0] == np.float64
+        assert np.isnan(records['read_lat_p99'][0])
+        assert records.nbytes == 4 * 4 * 8
+
+    def test_matches_row_dataframe(self):
+        records = MetricRecords.from_columns(
+            {'_id': None, 'io_depth': [8, 16, 16],
+             'read_iops': [1000.0, 1200.5, 1100],
+             'read_lat_p99': [None, 850.0, None]})
+
+        dataframe = records.to_dataframe()
+
+        pd.testing.assert_frame_equal(dataframe, pd.DataFrame(
+            [{key: value for key, value in row.items()
+              if key != 'write_pattern'} for row in ROWS]))
+        assert records.to_rows()[1] == {'io_depth': 16, 'read_iops': 1200.5,
+                                        'read_lat_p99': 850.0}
+
+    def test_concat(self):
+        records = MetricRecords.concat([MetricRecords.from_rows(ROWS[:2]),
+                                        MetricRecords.from_rows(ROWS[1:2])])
+        assert len(records) == 3
+        assert list(records['io_depth']) == [8, 16, 16]
+
+    def test_strings_and_empty(self):
+        records = MetricRecords.from_rows([{'block_size': '128k'},
+                                           {'block_size': '4k'}])
+        assert list(records['block_size']) == ['128k', '4k']
+        assert len(MetricRecords.from_rows([])) == 0
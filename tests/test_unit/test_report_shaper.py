@@ -0,0 +1,164 @@
+# Contents of test_report_shaper.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+from unittest.mock import MagicMock, patch
+import pytest
+from pymongo import errors
+from unit.mongodb import MongoDB
+from unit.report_shaper import ReportShaper
+
+logger = logging.getLogger(__name__)
+
+KEEP = ['created', 'collectors.outcome', 'tests.nodeid', 'tests.keywords',
+        'tests.call.log.msg']
+
+
+@pytest.fixture
+def report():
+    return {
+        'created': 1718000000.0,
+        'environment': {'Python': '3.10', 'Platform': 'Windows-10'},
+        'collectors': [{'nodeid': '', 'outcome': 'passed', 'result': []}],
+        'tests': [{
+            'nodeid': 'test_io.py::test_run_io_operation[100-32]',
+            'keywords': ['test_run_io_operation[100-32]'],
+            'lineno': 42,
+            'setup': {'duration': 0.1, 'outcome': 'passed'},
+            'call': {'duration': 12.5,
+                     'log': [{'name': 'tests', 'levelname': 'INFO',
+                              'msg': f'stress_read_iops = {1000 + i}',
+                              'created': 1718000000.0 + i}
+                             for i in range(3)]}
+        }]
+    }
+
+
+class TestReportShaper:
+
+    def test_slim_keeps_paths_through_lists(self, report):
+        slim = ReportShaper(KEEP).slim(report)
+        assert slim == {
+            'created': 1718000000.0,
+            'collectors': [{'outcome': 'passed'}],
+            'tests': [{
+                'nodeid': 'test_io.py::test_run_io_operation[100-32]',
+                'keywords': ['test_run_io_operation[100-32]'],
+                'call': {'log': [{'msg': f'stress_read_iops = {1000 + i}'}
+                                 for i in range(3)]}
+            }]
+        }
+
+    def test_shape_reports_bytes_saved(self, report):
+        document = {'log': 'log', 'report': report}
+        hot, archived, stats = ReportShaper(KEEP).shape(document)
+        assert archived == {'report': report, 'log': 'log'}
+        assert archived['report'] is report
+        assert document['report'] is report
+        assert hot['log'] == {'archived': 'collection', 'bytes': 3}
+        assert stats['saved'] == stats['before'] - stats['after'] > 0
+
+    def test_blob_archive_round_trip(self, report):
+        hot, archived, _ = ReportShaper(KEEP, archive='blob').shape(
+            {'log': 'log', 'report': report})
+        assert archived is None
+        assert ReportShaper.restore(hot) == report
+        assert ReportShaper.restore_log(hot) == 'log'
+
+    def test_shape_keeps_archived_log_reference(self, report):
+        shaper = ReportShaper(KEEP)
+        hot, _, _ = shaper.shape({'log': 'log', 'report': report})
+
+        reshaped, archived, _ = shaper.shape(hot)
+
+        # Verify shaping again neither archives nor replaces the reference
+        assert reshaped['log'] == hot['log']
+        assert 'log' not in archived
+
+    def test_log_stays_hot_without_archive_log(self, report):
+        hot, archived, _ = ReportShaper(KEEP, archive_log=False).shape(
+            {'log': 'log', 'report': report})
+        assert hot['log'] == 'log'
+        assert 'log' not in archived
+
+    def test_unknown_archive_mode(self):
+        with pytest.raises(ValueError):
+            ReportShaper(KEEP, archive='tape')
+
+    def test_from_config(self):
+        shaper = ReportShaper.from_config()
+        assert 'tests.call.log.msg' in shaper.keep
+        assert shaper.archive == 'collection'
+        assert shaper.archive_log
+
+    @patch('unit.mongodb.read_log_and_report')
+    @patch('unit.mongodb.MongoClient')
+    def test_write_archives_full_report(self, mock_client, mock_read, report):
+        mock_read.return_value = {'log': 'log', 'report': report}
+        hot_collection = MagicMock()
+        hot_collection.name = 'results'
+        archive_collection = MagicMock()
+        db = mock_client.return_value['test_db']
+        db.__getitem__.side_effect = {
+            'results': hot_collection,
+            'results_archive': archive_collection}.get
+        mongodb = MongoDB('localhost', 27017, 'test_db', 'results',
+                          report_shaper=ReportShaper(KEEP))
+
+        mongodb.write_log_and_report('test.log', '.report.json')
+
+        archived = archive_collection.insert_one.call_args[0][0]
+        inserted = hot_collection.insert_one.call_args[0][0]
+        assert archived['report'] is report
+        assert archived['log'] == 'log'
+        assert archived['_id'] == inserted['_id']
+        assert inserted['log'] == {'archived': 'collection', 'bytes': 3}
+        assert 'environment' not in inserted['report']
+
+    @patch('unit.mongodb.MongoClient')
+    def test_insert_documents_archives_full_reports(self, mock_client,
+                                                    report):
+        hot_collection = MagicMock()
+        hot_collection.name = 'results'
+        archive_collection = MagicMock()
+        db = mock_client.return_value['test_db']
+        db.__getitem__.side_effect = {
+            'results': hot_collection,
+            'results_archive': archive_collection}.get
+        mongodb = MongoDB('localhost', 27017, 'test_db', 'results',
+                          report_shaper=ReportShaper(KEEP))
+
+        failed = mongodb.insert_documents(
+            [{'log': 'log', 'report': report} for _ in range(2)])
+
+        # Verify bulk ingestion shapes like write_log_and_report
+        archived = archive_collection.insert_many.call_args[0][0]
+        inserted = hot_collection.insert_many.call_args[0][0]
+        assert failed == []
+        assert [document['_id'] for document in archived] == \
+            [document['_id'] for document in inserted]
+        assert archived[0]['report'] is report
+        assert all('environment' not in document['report']
+                   for document in inserted)
+
+    @patch('unit.mongodb.MongoClient')
+    def test_insert_documents_skips_failed_archives(self, mock_client,
+                                                    report):
+        hot_collection = MagicMock()
+        hot_collection.name = 'results'
+        archive_collection = MagicMock()
+        archive_collection.insert_many.side_effect = errors.BulkWriteError(
+            {'writeErrors': [{'index': 0}]})
+        db = mock_client.return_value['test_db']
+        db.__getitem__.side_effect = {
+            'results': hot_collection,
+            'results_archive': archive_collection}.get
+        mongodb = MongoDB('localhost', 27017, 'test_db', 'results',
+                          report_shaper=ReportShaper(KEEP))
+
+        failed = mongodb.insert_documents(
+            [{'log': f'log {n}', 'report': report} for n in range(2)])
+
+        # Verify a document is not inserted without its archived report
+        inserted = hot_collection.insert_many.call_args[0][0]
+        assert failed == [0]
+        assert [document['log']['bytes'] for document in inserted] == [5]
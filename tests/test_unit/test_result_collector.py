@@ -0,0 +1,90 @@
+# Contents of test_result_collector.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+import pytest
+from unit.result_collector import RECORD_PROPERTY, ResultCollector
+
+logger = logging.getLogger(__name__)
+
+MODULE = 'tests/test_system/test_stress.py'
+
+
+def phase_report(nodeid, when, outcome='passed', messages=()):
+    user_properties = []
+    if when == 'call':
+        user_properties.append(
+            (RECORD_PROPERTY, [{'msg': message} for message in messages]))
+    return SimpleNamespace(nodeid=nodeid, when=when, outcome=outcome,
+                           duration=0.1, fspath=nodeid.split('::')[0],
+                           keywords={nodeid.split('::')[-1]: 1},
+                           user_properties=user_properties)
+
+
+def run_test(collector, nodeid, outcome='passed', messages=()):
+    collector.pytest_runtest_logreport(phase_report(nodeid, 'setup'))
+    collector.pytest_runtest_logreport(
+        phase_report(nodeid, 'call', outcome, messages))
+    collector.pytest_runtest_logreport(phase_report(nodeid, 'teardown'))
+
+
+@pytest.fixture
+def databases():
+    databases = {}
+
+    def factory(name):
+        mongodb = databases.setdefault(name, MagicMock())
+        mongodb.insert_documents.return_value = []
+        return mongodb
+
+    return databases, factory
+
+
+class TestResultCollector:
+
+    def test_controller_writes_once_per_collection(self, databases):
+        databases, factory = databases
+        collector = ResultCollector(factory)
+        run_test(collector, f'{MODULE}::test_a[1]', 'failed')
+        run_test(collector, f'{MODULE}::test_a[2]',
+                 messages=['stress_read_iops = 5.0'])
+        # 失败重跑后的结果覆盖之前的结果
+        run_test(collector, f'{MODULE}::test_a[1]',
+                 messages=['stress_read_iops = 4.0'])
+        run_test(collector, 'tests/test_unit/test_x.py::test_b')
+
+        assert collector.write() == 3
+
+        # Verify one document per collection with deduplicated tests
+        assert sorted(databases) == ['system', 'unit']
+        document, = databases['system'].insert_documents.call_args[0][0]
+        report = document['report']
+        assert [test['nodeid'] for test in report['tests']] == \
+            [f'{MODULE}::test_a[2]', f'{MODULE}::test_a[1]']
+        assert report['summary'] == {'total': 2, 'passed': 2}
+        assert report['tests'][1]['call']['log'] == \
+            [{'msg': 'stress_read_iops = 4.0'}]
+        assert report['collectors'] == [{'nodeid': MODULE,
+                                         'outcome': 'passed'}]
+        databases['unit'].insert_documents.assert_called_once()
+
+    def test_worker_ships_metric_messages(self, databases):
+        databases, factory = databases
+        collector = ResultCollector(factory, worker=True)
+        item = SimpleNamespace(user_properties=[])
+
+        hook = collector.pytest_runtest_call(item)
+        next(hook)
+        logging.getLogger('stress').warning('stress_read_iops = 1.0')
+        logging.getLogger('stress').warning('Starting fio')
+        with pytest.raises(StopIteration):
+            next(hook)
+        run_test(collector, f'{MODULE}::test_a[1]')
+        collector.pytest_sessionfinish(MagicMock(), 0)
+
+        # Verify only metric messages travel and workers never write
+        assert item.user_properties == [
+            (RECORD_PROPERTY, [{'msg': 'stress_read_iops = 1.0'}])]
+        assert collector.tests == {}
+        assert databases == {}
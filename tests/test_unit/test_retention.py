@@ -0,0 +1,172 @@
+# Contents of test_retention.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import datetime
+import logging
+from unittest.mock import MagicMock, patch
+from bson import ObjectId
+from pymongo import errors
+import pytest
+from unit.retention import RateLimiter, RetentionEngine, cutoff_id
+
+logger = logging.getLogger(__name__)
+
+NOW = datetime.datetime(2024, 6, 10, 15, 30, tzinfo=datetime.timezone.utc)
+
+
+def object_id(day, hour=0):
+    return ObjectId.from_datetime(
+        datetime.datetime(2024, 6, day, hour, tzinfo=datetime.timezone.utc))
+
+
+@pytest.fixture
+def collections():
+    return {}
+
+
+@pytest.fixture
+def mongodb(collections):
+    mongodb = MagicMock()
+    mongodb.db.__getitem__.side_effect = \
+        lambda name: collections.setdefault(name, MagicMock(name=name))
+    return mongodb
+
+
+def batches(collection, *id_batches):
+    cursor = collection.find.return_value.sort.return_value.limit
+    cursor.side_effect = [[{'_id': _id} for _id in ids]
+                          for ids in id_batches] + [[]]
+
+
+class TestRetentionEngine:
+
+    def test_cutoff_id(self):
+        assert cutoff_id(30, NOW).generation_time == \
+            NOW - datetime.timedelta(days=30)
+        assert cutoff_id(1, NOW, align_day=True) == object_id(9)
+
+    @patch('unit.retention.time.sleep')
+    def test_rate_limiter(self, mock_sleep):
+        limiter = RateLimiter(100)
+        limiter.wait(50)
+        assert mock_sleep.call_args[0][0] == pytest.approx(0.5, abs=0.05)
+
+    def test_unknown_action(self, mongodb):
+        with pytest.raises(ValueError):
+            RetentionEngine(mongodb, [{'name': 'p', 'action': 'shred'}])
+
+    def test_delete_in_batches(self, mongodb, collections):
+        engine = RetentionEngine(mongodb, [
+            {'name': 'old', 'collection': 'system', 'action': 'delete',
+             'older_than_days': 30}], batch_size=2)
+        batches(mongodb.db['system'], [object_id(1), object_id(2)],
+                [object_id(3)])
+
+        assert engine.run(NOW) == {'old': 3}
+
+        deleted = [call[0][0]['_id']['$in'] for call in
+                   collections['system'].delete_many.call_args_list]
+        assert deleted == [[object_id(1), object_id(2)], [object_id(3)]]
+        query = collections['system'].find.call_args_list[1][0][0]
+        assert query['_id'] == {'$lt': cutoff_id(30, NOW),
+                                '$gt': object_id(2)}
+
+    def test_dry_run_changes_nothing(self, mongodb, collections):
+        engine = RetentionEngine(mongodb, [
+            {'name': 'logs', 'collection': 'system', 'action': 'unset',
+             'fields': ['log'], 'older_than_days': 7}], dry_run=True)
+        batches(mongodb.db['system'], [object_id(1)])
+
+        assert engine.run(NOW) == {'logs': 1}
+        collections['system'].update_many.assert_not_called()
+
+    def test_archive_tolerates_duplicates(self, mongodb, collections):
+        engine = RetentionEngine(mongodb, [
+            {'name': 'raw', 'collection': 'system', 'action': 'archive',
+             'older_than_days': 30}])
+        batches(mongodb.db['system'], [object_id(1)])
+        mongodb.db['system_expired'].insert_many.side_effect = \
+            errors.BulkWriteError({'writeErrors': [{'index': 0,
+                                                    'code': 11000}]})
+
+        engine.run(NOW)
+
+        collections['system'].delete_many.assert_called_once_with(
+            {'_id': {'$in': [object_id(1)]}})
+
+    def test_rollup_advances_watermark_by_day(self, mongodb, collections):
+        engine = RetentionEngine(mongodb, [
+            {'name': 'daily', 'collection': 'system', 'action': 'rollup',
+             'prefix': 'stress', 'older_than_days': 1}])
+        system = mongodb.db['system']
+        system.find_one.side_effect = [{'_id': object_id(7, 9)},
+                                       {'_id': object_id(8, 1)}, None]
+        system.count_documents.return_value = 4
+        mongodb.db['retention_state'].find_one.return_value = None
+
+        assert engine.run(NOW) == {'daily': 8}
+
+        windows = [call[0][0][0]['$match']['_id']
+                   for call in system.aggregate.call_args_list]
+        assert windows == [{'$lt': object_id(8)},
+                           {'$gte': object_id(8), '$lt': object_id(9)}]
+        pipeline = system.aggregate.call_args_list[0][0][0]
+        assert pipeline[-1]['$merge']['into'] == 'system_daily'
+        assert pipeline[-2]['$group']['_id']['day'] == '$day'
+        watermarks = [call[0][1]['$set']['until_id'] for call in
+                      collections['retention_state'].update_one.call_args_list]
+        assert watermarks == [object_id(8), object_id(9)]
+
+    def test_summaries_are_retained_apart(self, mongodb, collections):
+        engine = RetentionEngine(mongodb, [
+            {'name': 'runs', 'collection': 'system', 'action': 'summarize',
+             'prefix': 'stress', 'older_than_days': 0}])
+        system = mongodb.db['system']
+        system.find_one.side_effect = [{'_id': object_id(7, 9)}, None]
+        system.count_documents.return_value = 1
+        mongodb.db['retention_state'].find_one.return_value = None
+
+        engine.run(NOW)
+
+        # Not the '_summary' collection of MongoDB.summary_collection
+        pipeline = system.aggregate.call_args_list[0][0][0]
+        assert pipeline[-1]['$merge']['into'] == 'system_retained'
+
+    def test_failure_skips_later_policies(self, mongodb, collections):
+        engine = RetentionEngine(mongodb, [
+            {'name': 'runs', 'collection': 'system', 'action': 'summarize',
+             'prefix': 'stress', 'older_than_days': 0},
+            {'name': 'old', 'collection': 'system', 'action': 'delete',
+             'older_than_days': 30}])
+        mongodb.db['retention_state'].find_one.side_effect = \
+            errors.ServerSelectionTimeoutError('down')
+
+        assert engine.run(NOW) == {}
+        collections['system'].delete_many.assert_not_called()
+
+    def test_unexpected_error_skips_later_policies(self, mongodb,
+                                                   collections):
+        engine = RetentionEngine(mongodb, [
+            {'name': 'runs', 'collection': 'system', 'action': 'summarize',
+             'prefix': 'stress', 'older_than_days': 0},
+            {'name': 'old', 'collection': 'system', 'action': 'delete',
+             'older_than_days': 30}])
+        mongodb.db['retention_state'].find_one.side_effect = KeyError('_id')
+
+        assert engine.run(NOW) == {}
+        collections['system'].delete_many.assert_not_called()
+
+    def test_background_loop_survives_errors(self, mongodb):
+        engine = RetentionEngine(mongodb, [])
+        calls = []
+
+        def run():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise KeyError('report')
+            engine.stop()
+
+        with patch.object(engine, 'run', side_effect=run):
+            engine.run_forever(interval=0)
+
+        # The failed first cycle did not end the loop
+        assert calls == [0, 1]
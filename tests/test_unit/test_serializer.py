@@ -0,0 +1,54 @@
+# Contents of test_serializer.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import datetime
+import json
+import logging
+from unittest.mock import patch
+from bson import ObjectId
+import pytest
+from unit import serializer
+
+logger = logging.getLogger(__name__)
+
+REPORT = {"created": 1718000000.5, "tests": [
+    {"nodeid": "test_io.py::test_run_io_operation[0-8]",
+     "call": {"log": [{"msg": "stress_read_iops = 1234.5"}]}}]}
+
+
+@pytest.fixture(params=['orjson', 'json'])
+def backend(request):
+    """Runs each test with the fast backend and the stdlib fallback."""
+    if request.param == 'orjson' and serializer.orjson is None:
+        pytest.skip('orjson is not installed')
+    orjson = serializer.orjson if request.param == 'orjson' else None
+    with patch.object(serializer, 'orjson', orjson):
+        yield request.param
+
+
+class TestSerializer:
+
+    def test_load_file(self, backend, tmp_path):
+        path = tmp_path / '.report.json'
+        path.write_text(json.dumps(REPORT))
+        assert serializer.load_file(str(path)) == REPORT
+
+    def test_load_empty_file(self, backend, tmp_path):
+        path = tmp_path / 'empty.json'
+        path.write_text('')
+        with pytest.raises(json.JSONDecodeError):
+            serializer.load_file(str(path))
+
+    def test_dumps_bson_types(self, backend):
+        object_id = ObjectId('665f1c2e8f1b2a3c4d5e6f70')
+        document = {"_id": object_id,
+                    "created": datetime.datetime(2024, 6, 4, 12, 30, 15)}
+
+        decoded = json.loads(serializer.dumps([document]))
+
+        assert decoded == [{"_id": "665f1c2e8f1b2a3c4d5e6f70",
+                            "created": "2024-06-04T12:30:15"}]
+
+    def test_dump_file_round_trip(self, backend, tmp_path):
+        path = str(tmp_path / 'result.json')
+        serializer.dump_file(REPORT, path)
+        assert serializer.load_file(path) == REPORT
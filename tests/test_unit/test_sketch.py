@@ -0,0 +1,115 @@
+# Contents of test_sketch.py
+'''Copyright (c) 2024 Jaron Cheng'''
+import datetime
+import logging
+from unittest.mock import patch
+from bson import ObjectId
+import numpy as np
+import pytest
+from unit.mongodb import MongoDB
+from unit.sketch import QuantileSketch, sketch_report
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+@pytest.fixture
+def samples():
+    return np.random.default_rng(7).lognormal(mean=9, sigma=0.5, size=5000)
+
+
+def stress_report(values, outcome='passed'):
+    return {'tests': [{
+        'keywords': ['TestAMD64MultiPathStress',
+                     'test_run_io_operation[100-32]'],
+        'outcome': outcome,
+        'call': {'log': [{'msg': f'stress_read_iops = {value}'}
+                         for value in values]}
+    }]}
+
+
+class TestQuantileSketch:
+
+    def test_relative_accuracy(self, samples):
+        sketch = QuantileSketch(0.01)
+        for value in samples:
+            sketch.add(value)
+
+        for q in QUANTILES:
+            exact = np.quantile(samples, q, method='lower')
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.02)
+        assert len(sketch.bins) < 200
+
+    def test_merge_equals_union(self, samples):
+        whole, left, right = (QuantileSketch() for _ in range(3))
+        for index, value in enumerate(samples):
+            whole.add(value)
+            (left if index % 2 else right).add(value)
+
+        merged = QuantileSketch.from_dict(left.to_dict()).merge(right)
+
+        assert merged.to_dict() == whole.to_dict()
+
+    def test_zero_samples(self):
+        sketch = QuantileSketch()
+        for value in (0, 0, 0, 100):
+            sketch.add(value)
+        assert sketch.quantile(0.5) == 0.0
+        assert sketch.quantile(1.0) == 100
+        assert QuantileSketch().quantile(0.5) is None
+
+    def test_sketch_report_skips_failed_tests(self):
+        report = stress_report([1000.0, 2000.0])
+        report['tests'] += stress_report([9.0], outcome='failed')['tests']
+
+        sketches = sketch_report(report)
+
+        key = ('stress', (('write_pattern', 100), ('io_depth', 32)),
+               'read_iops')
+        assert list(sketches) == [key]
+        assert sketches[key].count == 2
+
+
+class TestMongoDBSketches:
+
+    @pytest.fixture
+    def mongo_db(self):
+        with patch('unit.mongodb.MongoClient') as mock_client:
+            sketches = mock_client.return_value['test_db']['test_collection']
+            yield MongoDB('localhost', 27017, 'test_db', 'test_collection',
+                          query_options={}, maintain_sketches=True), sketches
+
+    def test_insert_updates_sketches(self, mongo_db):
+        mongo_db_instance, mock_collection = mongo_db
+        _id = ObjectId.from_datetime(datetime.datetime(2024, 6, 10))
+
+        mongo_db_instance.insert_documents(
+            [{'_id': _id, 'report': stress_report([1000.0, 1000.0])}])
+
+        # Verify one $inc upsert per configuration, metric and day
+        request, = mock_collection.bulk_write.call_args[0][0]
+        assert request._filter == {
+            '_id': 'stress|100|32|read_iops|2024-06-10'}
+        increments = request._doc['$inc']
+        assert increments['count'] == 2
+        assert sum(count for name, count in increments.items()
+                   if name.startswith('bins.')) == 2
+        assert request._upsert
+
+    def test_get_quantiles_merges_days(self, mongo_db, samples):
+        mongo_db_instance, mock_collection = mongo_db
+        days = [QuantileSketch(), QuantileSketch()]
+        for index, value in enumerate(samples):
+            days[index % 2].add(value)
+        mock_collection.find.return_value = [day.to_dict() for day in days]
+
+        quantiles = mongo_db_instance.get_quantiles(
+            'stress', 100, 32, 'read_iops', since_day='2024-06-01')
+
+        # Verify a prefix range over the days of one configuration
+        mock_collection.find.assert_called_once_with({'_id': {
+            '$gte': 'stress|100|32|read_iops|2024-06-01',
+            '$lte': 'stress|100|32|read_iops|~'}})
+        assert quantiles[0.99] == pytest.approx(
+            np.quantile(samples, 0.99, method='lower'), rel=0.02)
@@ -0,0 +1,323 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from bson import ObjectId
+from unit.mongodb import MongoDB, read_log_and_report
+from unit.report_shaper import ReportShaper
+
+logger = logging.getLogger(__name__)
+
+REPORT_PATTERN = '*.report.json'
+LOG_NAME = 'test.log'
+
+
+def find_report_pairs(root, report_pattern=REPORT_PATTERN, log_name=LOG_NAME):
+    """
+    Walks a directory tree for pytest JSON reports and their logs.
+
+    A report is paired with the log in its own directory or, as laid out by
+    `pytest.ini`, in its `logs` subdirectory. Reports without a log are
+    skipped with a warning.
+
+    Args:
+        root (str): The directory to walk.
+        report_pattern (str): The report file name pattern.
+        log_name (str): The log file name.
+
+    Yields:
+        tuple: The (log_path, report_path) of every pair, in sorted order.
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(fnmatch.filter(filenames, report_pattern)):
+            report_path = os.path.join(dirpath, filename)
+            for log_path in (os.path.join(dirpath, log_name),
+                             os.path.join(dirpath, 'logs', log_name)):
+                if os.path.isfile(log_path):
+                    yield log_path, report_path
+                    break
+            else:
+                logger.warning(f'No {log_name} found for {report_path}')
+
+
+def checkpoint_key(log_path, report_path):
+    """Identifies a pair by path, size and modification time."""
+    stat = os.stat(report_path)
+    return f'{os.path.abspath(report_path)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def ingest_id(key):
+    """
+    Derives the `_id` of a pair from its checkpoint key.
+
+    Re-ingesting a pair after a crash between the insert and the checkpoint
+    then hits the stored document instead of creating a duplicate. The
+    timestamp part is the report's modification time, so the `_id` still
+    orders the documents by when their tests ran.
+
+    Args:
+        key (str): The `checkpoint_key` of the pair.
+
+    Returns:
+        ObjectId: The same id for the same key.
+    """
+    mtime = int(key.rsplit('|', 1)[1]) // 10**9
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return ObjectId(mtime.to_bytes(4, 'big') + digest[:8])
+
+
+def _load_pair(pair):
+    """Parses one pair inside a worker process."""
+    log_path, report_path = pair
+    try:
+        document = read_log_and_report(log_path, report_path)
+        size = os.path.getsize(report_path) if document is not None else 0
+    except (OSError, ValueError) as e:
+        # 单个文件损坏只计为失败, 不中断整个进程池
+        logger.error(f'Cannot load {report_path}: {e!r}')
+        return pair, None, 0
+    return pair, document, size
+
+
+class Checkpoint(object):
+    """
+    Records the ingested pairs so an interrupted ingestion resumes where it
+    stopped.
+
+    Every ingested key is appended to the file as one JSON line, so a save
+    costs the size of the batch rather than of the whole checkpoint. A
+    checkpoint written as a single JSON list is still read and is rewritten
+    as lines.
+
+    Attributes:
+        path (str): The checkpoint file, or None to disable checkpoints.
+        done (set): The keys of the ingested pairs.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.done = self._load(path)
+            logger.info(f'Resuming after {len(self.done)} ingested pairs')
+
+    def _load(self, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            text = file.read()
+        if text.lstrip().startswith('['):
+            done = set(json.loads(text))
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                file.writelines(f'{json.dumps(key)}\n'
+                                for key in sorted(done))
+            os.replace(temp_path, path)
+            return done
+        done = set()
+        for line in text.splitlines():
+            try:
+                done.add(json.loads(line))
+            except json.JSONDecodeError:
+                # 中断时可能留下不完整的最后一行, 该对会重新导入
+                logger.warning(f'Ignored a truncated line of {path}')
+        return done
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def add(self, keys):
+        """Marks pairs as ingested and appends them to the checkpoint."""
+        with self._lock:
+            keys = [key for key in keys if key not in self.done]
+            self.done.update(keys)
+            if not self.path or not keys:
+                return
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.writelines(f'{json.dumps(key)}\n' for key in keys)
+                file.flush()
+                os.fsync(file.fileno())
+
+
+class BulkIngestor(object):
+    """
+    Loads report/log pairs into MongoDB with parallel parsing and batched
+    writes.
+
+    A process pool decodes the JSON reports, which is CPU-bound for large
+    pytest-json-reports. Decoded documents go through a bounded queue to
+    writer threads that insert them with `MongoDB.insert_documents`, which
+    shapes them like `write_log_and_report`. When the writers fall behind,
+    the queue fills and parsing pauses. Each document's `_id` comes from
+    `ingest_id`, so a batch inserted just before a crash is not duplicated
+    when the ingestion resumes.
+
+    Attributes:
+        mongodb (MongoDB): The destination collection.
+        workers (int): The number of parsing processes.
+        writers (int): The number of writer threads.
+        batch_size (int): The number of documents per `insert_many`.
+        queue_size (int): The maximum number of parsed documents waiting to
+        be written.
+        checkpoint (Checkpoint): The record of already ingested pairs.
+        progress_interval (float): Seconds between progress log lines.
+    """
+    def __init__(self, mongodb, workers=None, writers=2, batch_size=50,
+                 queue_size=200, checkpoint_path=None, progress_interval=5.0):
+        self.mongodb = mongodb
+        self.workers = workers
+        self.writers = writers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.progress_interval = progress_interval
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+
+    def ingest(self, root):
+        """
+        Ingests every new pair below a directory.
+
+        Args:
+            root (str): The directory to walk.
+
+        Returns:
+            dict: Counts of found, skipped, inserted and failed pairs, bytes
+            parsed, elapsed seconds and throughput.
+        """
+        pairs = []
+        skipped = 0
+        for pair in find_report_pairs(root):
+            key = checkpoint_key(*pair)
+            if key in self.checkpoint:
+                skipped += 1
+            else:
+                pairs.append((pair, key))
+
+        self.stats = {'found': len(pairs) + skipped, 'skipped': skipped,
+                      'inserted': 0, 'failed': 0, 'bytes': 0}
+        start = time.perf_counter()
+        documents = queue.Queue(maxsize=self.queue_size)
+        writers = [threading.Thread(target=self._write, args=(documents,),
+                                    daemon=True)
+                   for _ in range(self.writers)]
+        for writer in writers:
+            writer.start()
+
+        try:
+            self._parse(pairs, documents, start)
+        finally:
+            for _ in writers:
+                documents.put(None)
+            for writer in writers:
+                writer.join()
+
+        elapsed = time.perf_counter() - start
+        self.stats['elapsed'] = elapsed
+        self.stats['docs_per_sec'] = (self.stats['inserted'] / elapsed
+                                      if elapsed else 0.0)
+        self.stats['mb_per_sec'] = (self.stats['bytes'] / 2**20 / elapsed
+                                    if elapsed else 0.0)
+        logger.info(f'Ingestion finished: {self.stats}')
+        return self.stats
+
+    def _parse(self, pairs, documents, start):
+        keys = dict(pairs)
+        pending = set()
+        remaining = iter(keys)
+        last_report = start
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            while True:
+                # 限制在途任务数量, 队列满时解析随之暂停
+                while len(pending) < self.queue_size:
+                    pair = next(remaining, None)
+                    if pair is None:
+                        break
+                    pending.add(pool.submit(_load_pair, pair))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pair, document, size = future.result()
+                    if document is None:
+                        self._count(failed=1)
+                        continue
+                    self._count(bytes=size)
+                    document['_id'] = ingest_id(keys[pair])
+                    documents.put((keys[pair], document))
+
+                now = time.perf_counter()
+                if now - last_report >= self.progress_interval:
+                    self._log_progress(now - start)
+                    last_report = now
+
+    def _write(self, documents):
+        batch = []
+        while True:
+            item = documents.get()
+            if item is not None:
+                batch.append(item)
+            if batch and (item is None or len(batch) >= self.batch_size):
+                self._flush(batch)
+                batch = []
+            if item is None:
+                return
+
+    def _flush(self, batch):
+        # _id 由检查点键导出, 重复键说明该对已在崩溃前写入
+        failed = set(self.mongodb.insert_documents(
+            [document for _, document in batch], ignore_duplicates=True))
+        self.checkpoint.add([key for index, (key, _) in enumerate(batch)
+                             if index not in failed])
+        self._count(inserted=len(batch) - len(failed), failed=len(failed))
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def _log_progress(self, elapsed):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        pending = stats['found'] - stats['skipped']
+        done = stats['inserted'] + stats['failed']
+        logger.info(f"Ingested {done}/{pending} pairs, "
+                    f"{stats['inserted'] / elapsed:.1f} docs/s, "
+                    f"{stats['bytes'] / 2**20 / elapsed:.1f} MB/s parsed")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Bulk load .report.json/test.log pairs into MongoDB.')
+    parser.add_argument('root', help='Directory tree to ingest')
+    parser.add_argument('--db-ip', default='192.168.0.128')
+    parser.add_argument('--db-port', type=int, default=27017)
+    parser.add_argument('--db-name', default='MLAutoRAID')
+    parser.add_argument('--collection', default='system')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--queue-size', type=int, default=200)
+    parser.add_argument('--checkpoint', default='ingest_checkpoint.json')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    mongodb = MongoDB(args.db_ip, args.db_port, args.db_name, args.collection,
+                      report_shaper=ReportShaper.from_config(),
+                      maintain_summaries=True, maintain_sketches=True)
+    BulkIngestor(mongodb, workers=args.workers, writers=args.writers,
+                 batch_size=args.batch_size, queue_size=args.queue_size,
+                 checkpoint_path=args.checkpoint).ingest(args.root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+import pytest
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('setup', 'call', 'teardown')
+
+
+def collection_for(path):
+    """Names the collection of a test file after its folder, e.g. 'system'."""
+    folder = os.path.basename(os.path.dirname(str(path)))
+    return folder.replace('test_', '')
+
+
+class RecordHandler(logging.Handler):
+    """Collects the log records emitted while a test is called."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append({'msg': record.getMessage(),
+                             'levelname': record.levelname,
+                             'name': record.name,
+                             'created': record.created})
+
+
+def outcome_of(phases):
+    """Derives the outcome of a test from its phase reports."""
+    for phase in ('setup', 'teardown'):
+        if phases.get(phase, {}).get('outcome') == 'failed':
+            return 'error'
+    if 'call' in phases:
+        return phases['call']['outcome']
+    return phases.get('setup', {}).get('outcome', 'error')
+
+
+class LiveUploader(object):
+    """
+    A pytest plugin streaming per-test results to MongoDB as tests finish.
+
+    Each finished test becomes one document shaped like a pytest-json-report
+    with a single test, so the stress and ramp aggregations read it like the
+    reports written by `write_log_and_report`. Documents go through a
+    bounded queue to a writer thread that inserts them with
+    `insert_documents` in batches of `batch_size`, or sooner after
+    `flush_interval` seconds. When the writer falls behind the queue fills
+    and the next test waits, which bounds the memory held. A crashed
+    session loses at most the queued documents and the session teardown
+    only drains the queue.
+
+    Attributes:
+        mongodb_factory (callable): Returns the `MongoDB` of a collection
+        name, see `collection_for`.
+        batch_size (int): The documents per `insert_documents`.
+        queue_size (int): The documents waiting to be written at most.
+        flush_interval (float): Seconds a partial batch may wait.
+        session_id (str): Identifies the documents of this session.
+        stats (dict): Counts of queued, inserted and failed documents.
+    """
+    def __init__(self, mongodb_factory, batch_size=20, queue_size=200,
+                 flush_interval=5.0):
+        self.mongodb_factory = mongodb_factory
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.session_id = uuid.uuid4().hex
+        self.stats = {'queued': 0, 'inserted': 0, 'failed': 0}
+        self._documents = queue.Queue(maxsize=queue_size)
+        self._databases = {}
+        self._phases = {}
+        self._collectors = {}
+        self._logs = {}
+        self._writer = None
+
+    def start(self):
+        """Starts the writer thread."""
+        self._writer = threading.Thread(target=self._write,
+                                        name='live-upload', daemon=True)
+        self._writer.start()
+
+    def drain(self, timeout=None):
+        """
+        Writes the queued documents and stops the writer thread.
+
+        Args:
+            timeout (float): Seconds to wait for the writer (default: None
+            waits until the queue is written).
+
+        Returns:
+            dict: The final `stats`.
+        """
+        if self._writer is not None:
+            self._documents.put(None)
+            self._writer.join(timeout)
+            if self._writer.is_alive():
+                logger.error(f'Live upload did not drain within {timeout}s, '
+                             f'{self._documents.qsize()} documents lost')
+            self._writer = None
+        logger.info(f'Live upload finished: {self.stats}')
+        return self.stats
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_sessionstart(self, session):
+        self.start()
+
+    def pytest_collectreport(self, report):
+        self._collectors[report.nodeid] = {'nodeid': report.nodeid,
+                                           'outcome': report.outcome}
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        handler = RecordHandler()
+        root = logging.getLogger()
+        root.addHandler(handler)
+        try:
+            yield
+        finally:
+            root.removeHandler(handler)
+            self._logs[item.nodeid] = handler.records
+
+    def pytest_runtest_logreport(self, report):
+        phases = self._phases.setdefault(report.nodeid, {})
+        phases[report.when] = {'duration': report.duration,
+                               'outcome': report.outcome}
+        if report.when == 'call':
+            phases['call']['log'] = self._logs.pop(report.nodeid, [])
+        if report.when != 'teardown':
+            return
+        del self._phases[report.nodeid]
+        self.put(report.fspath, self.document(report, phases))
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self, session):
+        self.drain()
+
+    def document(self, report, phases):
+        """
+        Builds the document of a finished test.
+
+        Args:
+            report (TestReport): The teardown report.
+            phases (dict): The duration, outcome and, for 'call', the log
+            records of every phase.
+
+        Returns:
+            dict: A report with the test and its module's collector.
+        """
+        module = report.nodeid.split('::')[0]
+        collector = self._collectors.get(module,
+                                         {'nodeid': module,
+                                          'outcome': 'passed'})
+        test = {'nodeid': report.nodeid,
+                'keywords': list(report.keywords),
+                'outcome': outcome_of(phases)}
+        test.update({phase: phases[phase] for phase in PHASES
+                     if phase in phases})
+        return {'session': self.session_id,
+                'report': {'created': time.time(),
+                           'collectors': [collector],
+                           'tests': [test]},
+                'uploaded': datetime.datetime.now(datetime.timezone.utc)}
+
+    def put(self, path, document):
+        """Queues a document, waiting while the queue is full."""
+        self._documents.put((collection_for(path), document))
+        self.stats['queued'] += 1
+
+    def _write(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else \
+                max(deadline - time.monotonic(), 0)
+            try:
+                item = self._documents.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            if item:
+                batch.append(item)
+                deadline = deadline or time.monotonic() + self.flush_interval
+            if batch and (item is None or item is False or
+                          len(batch) >= self.batch_size):
+                self._flush(batch)
+                batch = []
+                deadline = None
+            if item is None:
+                return
+
+    def _flush(self, batch):
+        by_collection = {}
+        for name, document in batch:
+            by_collection.setdefault(name, []).append(document)
+        for name, documents in by_collection.items():
+            if name not in self._databases:
+                self._databases[name] = self.mongodb_factory(name)
+            failed = self._databases[name].insert_documents(documents)
+            self.stats['inserted'] += len(documents) - len(failed)
+            self.stats['failed'] += len(failed)
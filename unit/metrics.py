@@ -0,0 +1,203 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import re
+
+THROUGHPUT_METRICS = ('read_iops', 'read_bw', 'write_iops', 'write_bw')
+LATENCY_METRICS = ('read_lat_p50', 'read_lat_p99', 'write_lat_p50',
+                   'write_lat_p99')
+
+# 各测试类型在日志中输出的指标, 日志格式为 "<prefix>_<metric> = <value>"
+METRIC_PATTERNS = {
+    'random': THROUGHPUT_METRICS,
+    'sequential': THROUGHPUT_METRICS,
+    'ramp': THROUGHPUT_METRICS + LATENCY_METRICS,
+    'stress': THROUGHPUT_METRICS + LATENCY_METRICS
+}
+
+VALUE_REGEX = r'(\d+(?:\.\d+)?)'
+
+# 聚合管道中由 metric_expression 展开的占位运算符
+PLACEHOLDER = '$extractMetrics'
+
+# 测试参数关键字, 如 test_run_io_operation[100-32] 或 [0-128k]
+IO_OPERATION_REGEX = re.compile(r'test_run_io_operation\[(\d+)-([\dk]+)')
+
+# 测试类 -> (指标前缀, 第二个测试参数的名称与类型), 与各聚合管道一致
+TEST_KINDS = {
+    'TestRandomReadWrite': ('random', 'io_depth', int),
+    'TestSequentialReadWrite': ('sequential', 'block_size', str),
+    'TestRampTimeReadWrite': ('ramp', 'ramp_times', int),
+    'TestAMD64MultiPathStress': ('stress', 'io_depth', int)
+}
+
+
+def _alternation(names):
+    # 长名称优先, 避免前缀相同的名称提前匹配
+    return '|'.join(sorted(names, key=len, reverse=True))
+
+
+def metric_regex(prefix):
+    """
+    Builds the combined pattern matching every metric of one prefix.
+
+    Args:
+        prefix (str): The metric prefix, e.g. 'stress'.
+
+    Returns:
+        str: A regex whose first capture is the metric name without prefix
+        and second capture is the value.
+    """
+    return (rf'\b{prefix}_({_alternation(METRIC_PATTERNS[prefix])})'
+            rf'\s*=\s*{VALUE_REGEX}')
+
+
+def metric_expression(prefix, input_field):
+    """
+    Generates the aggregation expression extracting all metrics of a prefix
+    from a log message with a single `$regexFindAll` scan.
+
+    Args:
+        prefix (str): The metric prefix, e.g. 'stress'.
+        input_field (str): The field path of the message, e.g. '$msg'.
+
+    Returns:
+        dict: An expression evaluating to an object of the metrics found,
+        keyed by name without prefix, e.g. {'read_iops': 1.0}.
+    """
+    return {
+        "$arrayToObject": {
+            "$map": {
+                "input": {
+                    "$regexFindAll": {
+                        "input": input_field,
+                        "regex": metric_regex(prefix)
+                    }
+                },
+                "as": "metric",
+                "in": {
+                    "k": {"$arrayElemAt": ["$$metric.captures", 0]},
+                    "v": {
+                        "$convert": {
+                            "input": {
+                                "$arrayElemAt": ["$$metric.captures", 1]
+                            },
+                            "to": "double",
+                            "onError": None,
+                            "onNull": None
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def expand_placeholders(node):
+    """
+    Replaces every `{"$extractMetrics": {"prefix": ..., "input": ...}}` in
+    a pipeline loaded from configuration with its `metric_expression`.
+
+    Args:
+        node: A pipeline, stage or expression.
+
+    Returns:
+        The same structure with the placeholders expanded.
+    """
+    if isinstance(node, list):
+        return [expand_placeholders(item) for item in node]
+    if isinstance(node, dict):
+        if set(node) == {PLACEHOLDER}:
+            spec = node[PLACEHOLDER]
+            return metric_expression(spec['prefix'], spec['input'])
+        return {key: expand_placeholders(value) for key, value in node.items()}
+    return node
+
+
+def parse_io_operation(keywords):
+    """
+    Identifies the test kind and configuration of a test from its keywords.
+
+    Args:
+        keywords (list): The pytest keywords of a test, including its class
+        and e.g. 'test_run_io_operation[100-32]'.
+
+    Returns:
+        tuple or None: The metric prefix and a dict of the write pattern and
+        the kind's second parameter, e.g. ('random', {'write_pattern': 100,
+        'io_depth': 32}), or None if the test is not an I/O operation of a
+        known kind.
+    """
+    kind = match = None
+    for keyword in keywords:
+        kind = kind or TEST_KINDS.get(keyword)
+        match = match or IO_OPERATION_REGEX.search(keyword)
+    if kind is None or match is None:
+        return None
+    prefix, parameter, convert = kind
+    try:
+        value = convert(match.group(2))
+    except ValueError:
+        return None
+    return prefix, {'write_pattern': int(match.group(1)), parameter: value}
+
+
+class MetricExtractor(object):
+    """
+    Extracts metrics from log messages in one pass per message.
+
+    All metrics of the pattern table are compiled into a single alternation,
+    so a message is scanned once however many metrics are defined.
+
+    Attributes:
+        patterns (dict): The metric names per prefix.
+        regex (Pattern): The compiled combined pattern.
+    """
+    def __init__(self, patterns=METRIC_PATTERNS):
+        self.patterns = patterns
+        names = [f'{prefix}_{name}' for prefix, metric_names in
+                 patterns.items() for name in metric_names]
+        self.regex = re.compile(rf'\b({_alternation(names)})'
+                                rf'\s*=\s*{VALUE_REGEX}')
+
+    def extract(self, message, prefix=None):
+        """
+        Extracts the metrics logged in a message.
+
+        Args:
+            message (str): The log message.
+            prefix (str): Only return metrics of this prefix, keyed without
+            the prefix like the aggregation pipelines (default: None returns
+            every metric keyed by its full name).
+
+        Returns:
+            dict: The metric values as floats.
+        """
+        if not message:
+            return {}
+        metrics = {}
+        for match in self.regex.finditer(message):
+            name, value = match.groups()
+            if prefix is None:
+                metrics[name] = float(value)
+            elif name.startswith(f'{prefix}_'):
+                metrics[name[len(prefix) + 1:]] = float(value)
+        return metrics
+
+    def extract_many(self, messages, prefix=None):
+        """
+        Merges the metrics of several messages, later values winning.
+
+        Returns:
+            dict: The metric values as floats.
+        """
+        metrics = {}
+        for message in messages:
+            metrics.update(self.extract(message, prefix))
+        return metrics
+
+
+_default_extractor = MetricExtractor()
+
+
+def extract_metrics(message, prefix=None):
+    """Extracts metrics from a message with the default pattern table."""
+    return _default_extractor.extract(message, prefix)
@@ -0,0 +1,349 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+from abc import ABC, abstractmethod
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait
+import datetime
+import logging
+import threading
+import time
+from pymongo import ASCENDING, ReplaceOne, errors
+from unit.report_shaper import ReportShaper
+from unit.retention import DUPLICATE_KEY, RateLimiter
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_FIELD = 'schema_version'
+STATE_COLLECTION = 'migration_state'
+
+
+class Migration(ABC):
+    """
+    One step of the document schema.
+
+    Subclasses set `version` and `name` and implement `upgrade`. Documents
+    without a `schema_version` field count as version 0. `MongoDB` tags the
+    documents it writes with `CURRENT_SCHEMA_VERSION`, but documents
+    written by older code are untagged, so `upgrade` must also accept
+    documents that already have the new shape.
+
+    Attributes:
+        version (int): The schema version the step upgrades documents to.
+        name (str): A short name for the logs.
+    """
+    version = None
+    name = None
+
+    @abstractmethod
+    def upgrade(self, document, archive):
+        """
+        Transforms a document of the previous version.
+
+        Args:
+            document (dict): The document.
+            archive (list): Collects documents for the archive collection,
+            which are written before the upgraded ones.
+
+        Returns:
+            dict: The upgraded document with the same `_id`.
+        """
+        pass
+
+
+class TagVersion(Migration):
+    """Tags the documents written before versioning without changing them."""
+    version = 1
+    name = 'tag'
+
+    def upgrade(self, document, archive):
+        return document
+
+
+class ShapeReports(Migration):
+    """
+    Slims the reports and archives the logs like `write_log_and_report`
+    does with a report shaper.
+
+    Attributes:
+        shaper (ReportShaper): The shaper (default: None loads
+        `config/report_shape.json`).
+    """
+    version = 2
+    name = 'shape_reports'
+
+    def __init__(self, shaper=None):
+        self.shaper = shaper or ReportShaper.from_config()
+
+    def upgrade(self, document, archive):
+        document, archived, _ = self.shaper.shape(document)
+        if archived is not None:
+            archive.append(dict(archived, _id=document['_id']))
+        return document
+
+
+MIGRATIONS = (TagVersion, ShapeReports)
+# 写入时直接带上的版本, 新文档无需再迁移
+CURRENT_SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+class Migrator(object):
+    """
+    Upgrades the documents of a live collection to a schema version.
+
+    The collection is split into `_id` shards of about equal size by
+    `MongoDB.partition_bounds`, which are migrated concurrently in
+    `_id`-ordered batches. Every document is replaced with one `ReplaceOne`
+    filtered on its `_id` and old version, so readers always see either
+    the old or the new document. A document changed concurrently by
+    another writer is left for the next run. The shard bounds and the last
+    migrated `_id` of every shard are kept in `migration_state`, so an
+    interrupted migration resumes where it stopped.
+
+    Attributes:
+        mongodb (MongoDB): The collection to migrate.
+        migrations (list): The `Migration` steps, by version.
+        target (int): The version to upgrade to.
+        shards (int): The number of shards migrated concurrently.
+        batch_size (int): The documents per bulk write.
+        rate_limit (float): The documents migrated per second, or None.
+        progress_interval (float): Seconds between progress log lines.
+        dry_run (bool): Whether to count the documents without changing them.
+        stats (dict): The counts of the last run.
+    """
+    def __init__(self, mongodb, migrations=None, target=None, shards=4,
+                 batch_size=200, rate_limit=None, progress_interval=5.0,
+                 dry_run=False):
+        if migrations is None:
+            migrations = [migration() for migration in MIGRATIONS]
+        self.migrations = sorted(migrations,
+                                 key=lambda migration: migration.version)
+        versions = [migration.version for migration in self.migrations]
+        if len(set(versions)) != len(versions):
+            raise ValueError(f'Duplicate migration versions: {versions}')
+        self.target = target or versions[-1]
+        if self.target not in versions:
+            raise ValueError(f'Unknown target version: {self.target}')
+        self.mongodb = mongodb
+        self.shards = shards
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.progress_interval = progress_interval
+        self.dry_run = dry_run
+        self.state = mongodb.db[STATE_COLLECTION]
+        self.state_id = f'{mongodb.collection.name}|{self.target}'
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def pending_query(self, since_id=None, until_id=None):
+        """
+        Selects the documents below the target version in an `_id` range.
+
+        Args:
+            since_id (ObjectId): The exclusive lower bound (default: None).
+            until_id (ObjectId): The inclusive upper bound (default: None).
+
+        Returns:
+            dict: The query; untagged documents match too.
+        """
+        query = {SCHEMA_FIELD: {'$not': {'$gte': self.target}}}
+        id_range = {}
+        if since_id is not None:
+            id_range['$gt'] = since_id
+        if until_id is not None:
+            id_range['$lte'] = until_id
+        if id_range:
+            query['_id'] = id_range
+        return query
+
+    def upgrade(self, document, archive):
+        """
+        Applies the migration steps between a document's version and the
+        target.
+
+        Args:
+            document (dict): The document.
+            archive (list): See `Migration.upgrade`.
+
+        Returns:
+            dict: The upgraded document tagged with the target version.
+        """
+        version = document.get(SCHEMA_FIELD, 0)
+        for migration in self.migrations:
+            if version < migration.version <= self.target:
+                document = migration.upgrade(document, archive)
+        document[SCHEMA_FIELD] = self.target
+        return document
+
+    def run(self):
+        """
+        Migrates every document below the target version.
+
+        Returns:
+            dict: Counts of migrated, skipped (changed concurrently) and
+            failed documents, elapsed seconds and throughput.
+        """
+        state = self.state.find_one({'_id': self.state_id}) or {}
+        if state.get('completed'):
+            # 上次已完成, 重新划分以覆盖之后写入的文档
+            state = {}
+        bounds = state.get('bounds')
+        if bounds is None:
+            bounds = self.mongodb.partition_bounds(
+                self.shards, self.mongodb.collection, allowDiskUse=True)
+            if not self.dry_run:
+                self.state.replace_one({'_id': self.state_id}, {
+                    'bounds': [list(bound) for bound in bounds],
+                    'started': datetime.datetime.now(datetime.timezone.utc)},
+                    upsert=True)
+        else:
+            logger.info(f'Resuming the migration to version {self.target} '
+                        f'of {self.mongodb.collection.name}')
+        last_ids = state.get('last_ids', {})
+
+        self.stats = {'migrated': 0, 'skipped': 0, 'failed': 0}
+        self._stop.clear()
+        limiter = RateLimiter(self.rate_limit)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(bounds),
+                                thread_name_prefix='migration') as executor:
+            futures = [executor.submit(self._migrate_shard, index, since_id,
+                                       until_id, last_ids.get(str(index)),
+                                       limiter)
+                       for index, (since_id, until_id) in enumerate(bounds)]
+            try:
+                pending = futures
+                while pending:
+                    _, pending = wait(pending, timeout=self.progress_interval)
+                    self._log_progress(time.perf_counter() - start)
+            except KeyboardInterrupt:
+                logger.warning('Interrupted, stopping after the current '
+                               'batches')
+                self._stop.set()
+
+        completed = not self._stop.is_set()
+        for future in futures:
+            error = future.exception()
+            if error is not None:
+                completed = False
+                logger.error(f'Migration shard failed: {error}')
+        if completed and not self.dry_run:
+            self.state.update_one({'_id': self.state_id},
+                                  {'$set': {'completed': True}})
+
+        elapsed = time.perf_counter() - start
+        self.stats['elapsed'] = elapsed
+        self.stats['docs_per_sec'] = (self.stats['migrated'] / elapsed
+                                      if elapsed else 0.0)
+        logger.info(f'Migration to version {self.target} '
+                    f"{'finished' if completed else 'stopped'}: {self.stats}")
+        return self.stats
+
+    def stop(self):
+        """Stops the shards after their current batches."""
+        self._stop.set()
+
+    def _migrate_shard(self, index, since_id, until_id, last_id, limiter):
+        collection = self.mongodb.collection
+        while not self._stop.is_set():
+            query = self.pending_query(
+                since_id if last_id is None else last_id, until_id)
+            documents = list(collection.find(query)
+                             .sort('_id', ASCENDING).limit(self.batch_size))
+            if not documents:
+                break
+            if self.dry_run:
+                self._count(migrated=len(documents))
+            else:
+                self._write(documents)
+                self.state.update_one(
+                    {'_id': self.state_id},
+                    {'$set': {f'last_ids.{index}': documents[-1]['_id']}})
+            last_id = documents[-1]['_id']
+            limiter.wait(len(documents))
+
+    def _write(self, documents):
+        requests = []
+        archive = []
+        failed = 0
+        for document in documents:
+            version = document.get(SCHEMA_FIELD)
+            try:
+                upgraded = self.upgrade(dict(document), archive)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error(f"Cannot migrate document {document['_id']}: "
+                             f"{e!r}")
+                failed += 1
+                continue
+            # 以旧版本为条件, 并发修改过的文档留待下次迁移
+            requests.append(ReplaceOne({'_id': document['_id'],
+                                        SCHEMA_FIELD: version}, upgraded))
+
+        if archive:
+            try:
+                self.mongodb.archive_collection().insert_many(archive,
+                                                              ordered=False)
+            except errors.BulkWriteError as e:
+                # 写入时已归档的完整报告会重复
+                if any(error['code'] != DUPLICATE_KEY
+                       for error in e.details.get('writeErrors', [])):
+                    raise
+        migrated = 0
+        if requests:
+            try:
+                migrated = self.mongodb.collection.bulk_write(
+                    requests, ordered=False).modified_count
+            except errors.BulkWriteError as e:
+                migrated = e.details.get('nModified', 0)
+                failed += len(e.details.get('writeErrors', []))
+                logger.error(f"Error migrating {len(e.details['writeErrors'])}"
+                             f" of {len(requests)} documents")
+        self._count(migrated=migrated, failed=failed,
+                    skipped=len(documents) - failed - migrated)
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self.stats[name] += value
+
+    def _log_progress(self, elapsed):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        logger.info(f"Migrated {stats['migrated']} documents "
+                    f"({stats['skipped']} skipped, {stats['failed']} failed), "
+                    f"{stats['migrated'] / elapsed:.1f} docs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Upgrade the documents of a results collection to the '
+                    'latest schema version.')
+    parser.add_argument('--db-ip', default='192.168.0.128')
+    parser.add_argument('--db-port', type=int, default=27017)
+    parser.add_argument('--db-name', default='MLAutoRAID')
+    parser.add_argument('--collection', default='system')
+    parser.add_argument('--target', type=int, default=None)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='Maximum documents per second')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    # unit.mongodb 导入本模块的版本常量, 在此导入以避免循环
+    from unit.mongodb import MongoDB
+
+    shaper = ReportShaper.from_config()
+    mongodb = MongoDB(args.db_ip, args.db_port, args.db_name,
+                      args.collection, report_shaper=shaper)
+    Migrator(mongodb, [TagVersion(), ShapeReports(shaper)],
+             target=args.target, shards=args.shards,
+             batch_size=args.batch_size, rate_limit=args.rate_limit,
+             dry_run=args.dry_run).run()
+
+
+if __name__ == '__main__':
+    main()
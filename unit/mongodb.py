@@ -1,12 +1,210 @@
 '''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+import copy
+import datetime
+import fnmatch
+import glob
 import json
 import logging
-from pymongo import MongoClient, errors
-from pymongo import DESCENDING
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from pymongo import MongoClient, UpdateOne, errors
+from pymongo import ASCENDING, DESCENDING, ReadPreference
+from pymongo.read_preferences import (Nearest, PrimaryPreferred, Secondary,
+                                      SecondaryPreferred)
+from bson import ObjectId
 from typing import Dict
+from unit import serializer
+from unit.partition import (is_partitionable, merge_groups, partial_group,
+                            pipeline_limit)
+from unit.migration import CURRENT_SCHEMA_VERSION, SCHEMA_FIELD, TagVersion
+from unit.records import MetricRecords, columnar_group
+from unit.sketch import QuantileSketch, sketch_report
+from unit.metrics import (THROUGHPUT_METRICS, expand_placeholders,
+                          metric_expression)
 
 logger = logging.getLogger(__name__)
 
+QUERY_OPTIONS_PATH = 'config/query_options.json'
+READ_ROUTING_PATH = 'config/read_routing.json'
+QUERY_OPTIONS = ('maxTimeMS', 'allowDiskUse', 'batchSize', 'read_preference',
+                 'partitions')
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+# 可附带标签与最大延迟的读偏好 (primary 不支持)
+ROUTED_READ_PREFERENCES = {
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest
+}
+
+# 物化汇总中各测试类型的配置键 (写比例之外)
+SUMMARY_KEYS = {'random': 'io_depth', 'sequential': 'block_size'}
+SUMMARY_STATS = ('count', 'sum', 'sumsq', 'min', 'max')
+
+# 超出阶段内存 (未允许落盘) 或 16 MB 结果文档限制的服务器错误码
+MEMORY_LIMIT_CODES = {146, 292, 10334, 16819, 16945, 17419}
+DUPLICATE_KEY_CODE = 11000
+
+
+class AggregationLimitError(errors.PyMongoError):
+    """
+    Raised when an aggregation exceeds its time or memory limit.
+
+    Attributes:
+        pipeline (str): The name of the pipeline that failed.
+        elapsed (float): The seconds the aggregation ran before failing.
+        limit (str): The limit that was hit, 'time' or 'memory'.
+        cause (PyMongoError): The error reported by the server.
+    """
+    def __init__(self, pipeline, elapsed, limit, cause):
+        super().__init__(f"Aggregation '{pipeline}' exceeded its {limit} "
+                         f"limit after {elapsed:.1f}s: {cause}")
+        self.pipeline = pipeline
+        self.elapsed = elapsed
+        self.limit = limit
+        self.cause = cause
+
+
+def load_query_options(path=QUERY_OPTIONS_PATH):
+    """
+    Loads the aggregation execution options.
+
+    Args:
+        path (str): A JSON file mapping pipeline names, and 'default' for
+        all pipelines, to options (default: 'config/query_options.json').
+
+    Returns:
+        dict: The options by pipeline name, or an empty dict if the file
+        does not exist.
+    """
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def load_read_routing(path=READ_ROUTING_PATH):
+    """
+    Loads the routing of the analytics reads.
+
+    Args:
+        path (str): A JSON file with the 'read_preference', optional
+        'max_staleness_seconds' and optional 'tag_sets' of the analytics
+        reads (default: 'config/read_routing.json').
+
+    Returns:
+        dict or None: The routing, or None if the file does not exist.
+    """
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def analytics_read_preference(routing):
+    """
+    Builds the read preference of the analytics reads.
+
+    Args:
+        routing (dict): The 'read_preference' mode name, e.g.
+        'secondaryPreferred', the 'max_staleness_seconds' a node may lag
+        behind the primary (at least 90, default: no bound) and the
+        'tag_sets' selecting e.g. dedicated analytics nodes.
+
+    Returns:
+        ServerMode: The read preference.
+
+    Raises:
+        ValueError: If the mode is missing or cannot route to secondaries.
+    """
+    mode = routing.get('read_preference')
+    if mode not in ROUTED_READ_PREFERENCES:
+        raise ValueError(f"Analytics reads cannot be routed with the "
+                         f"'{mode}' read preference, use one of "
+                         f"{sorted(ROUTED_READ_PREFERENCES)}")
+    return ROUTED_READ_PREFERENCES[mode](
+        tag_sets=routing.get('tag_sets'),
+        max_staleness=routing.get('max_staleness_seconds', -1))
+
+
+def read_log_and_report(log_path, report_path):
+    """
+    Reads a log file and a pytest JSON report into one result document.
+
+    Args:
+        log_path (str): The file path to the log file.
+        report_path (str): The file path to the report JSON file.
+
+    Returns:
+        dict or None: The document with 'log' and 'report' fields, or None if
+        either file cannot be read.
+    """
+    try:
+        # 测试机日志可能混有非 UTF-8 字节, 替换而不是整对丢弃
+        with open(log_path, 'r', encoding='utf-8',
+                  errors='replace') as log_file:
+            log_data = log_file.read()
+    except FileNotFoundError:
+        logger.error(f"Error: The file {log_path} was not found.")
+        return None
+    except IOError as e:
+        logger.critical(f"Error reading {log_path}: {e}")
+        return None
+
+    try:
+        report_data = serializer.load_file(report_path)
+    except FileNotFoundError:
+        logger.error(f"Error: The file {report_path} was not found.")
+        return None
+    except json.JSONDecodeError as e:
+        logger.critical(f"Error decoding JSON from {report_path}: {e}")
+        return None
+
+    return {
+        'log': log_data,
+        'report': report_data
+    }
+
+
+def summary_statistics(document):
+    """
+    Derives the metric statistics of a materialized summary document.
+
+    Args:
+        document (dict): A summary with the `<metric>_count`, `_sum`,
+        `_sumsq`, `_min` and `_max` of every throughput metric.
+
+    Returns:
+        dict: The configuration as '_id' and the avg/max/min/std_dev of every
+        metric, shaped like the result of `aggregate_random_metrics`.
+    """
+    key = {name: value for name, value in document['_id'].items()
+           if name != 'kind'}
+    result = {'_id': key}
+    for name in THROUGHPUT_METRICS:
+        count = document.get(f'{name}_count', 0)
+        avg = std_dev = None
+        if count:
+            avg = document[f'{name}_sum'] / count
+            variance = document[f'{name}_sumsq'] / count - avg ** 2
+            std_dev = math.sqrt(max(variance, 0.0))
+        result[f'avg_{name}'] = avg
+        result[f'max_{name}'] = document.get(f'{name}_max')
+        result[f'min_{name}'] = document.get(f'{name}_min')
+        result[f'std_dev_{name}'] = std_dev
+    return result
+
 
 class MongoDB(object):
     """
@@ -20,8 +218,22 @@ class MongoDB(object):
         client (MongoClient): The MongoDB client instance.
         db (Database): The MongoDB database instance.
         collection (Collection): The MongoDB collection instance.
+        report_shaper (ReportShaper): Slims reports before they are written,
+            or None to store them whole.
+        query_options (dict): The aggregation execution options by pipeline
+            name, see `query_options_for`.
+        analytics_collection (Collection): The collection handle the
+            aggregations read through; the same as `collection` unless the
+            analytics reads are routed to secondaries.
+        maintain_summaries (bool): Whether every written document is folded
+            into the materialized summaries.
+        maintain_sketches (bool): Whether every written document is folded
+            into the quantile sketches.
     """
-    def __init__(self, host, port, db_name, collection_name):
+    def __init__(self, host, port, db_name, collection_name,
+                 report_shaper=None, query_options=None,
+                 read_routing=None, maintain_summaries=False,
+                 maintain_sketches=False):
         """
         Initializes the MongoDB class with a connection to the specified MongoDB
         database and collection.
@@ -31,6 +243,19 @@ class MongoDB(object):
             port (int): The port number on which the MongoDB server is listening.
             db_name (str): The name of the database to connect to.
             collection_name (str): The name of the collection within the database.
+            report_shaper (ReportShaper): Slims reports before they are
+            written (default: None).
+            query_options (dict): The aggregation execution options (default:
+            None loads `config/query_options.json`).
+            read_routing (dict): Routes the aggregations and `latest_id` to
+            secondaries, see `analytics_read_preference` (default: None reads
+            from the primary). Writes always go to the primary.
+            maintain_summaries (bool): Whether `write_log_and_report` and
+            `insert_documents` fold each document into the materialized
+            summaries (default: False).
+            maintain_sketches (bool): Whether `write_log_and_report` and
+            `insert_documents` fold each document into the quantile sketches
+            (default: False).
 
         Raises:
             PyMongoError: If there is an error connecting to the MongoDB server.
@@ -38,13 +263,26 @@ class MongoDB(object):
         self.client = MongoClient(f'mongodb://{host}:{port}')
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.analytics_collection = self.collection
+        self.maintain_summaries = maintain_summaries
+        self.maintain_sketches = maintain_sketches
+        if read_routing is not None:
+            self.analytics_collection = self.collection.with_options(
+                read_preference=analytics_read_preference(read_routing))
+        self.report_shaper = report_shaper
+        self.query_options = load_query_options() if query_options is None \
+            else query_options
+        self._pipelines = {}
 
     def write_log_and_report(self, log_path, report_path):
         """
         Writes log and report data from files to the MongoDB collection.
 
         Reads log data from a text file and report data from a JSON file, and
-        inserts them into the MongoDB collection as a single document.
+        inserts them into the MongoDB collection as a single document. With a
+        report shaper the document keeps only the queried report fields and
+        a reference to the log, and the full report and log go to the
+        archive collection under the same `_id`.
 
         Args:
             log_path (str): The file path to the log file.
@@ -56,36 +294,139 @@ class MongoDB(object):
             JSONDecodeError: If the report file cannot be decoded as JSON.
             PyMongoError: If there is an error inserting the document into MongoDB.
         """
-        try:
-            with open(log_path, 'r') as log_file:
-                log_data = log_file.read()
-        except FileNotFoundError:
-            logger.error(f"Error: The file {log_path} was not found.")
-            return
-        except IOError as e:
-            logger.critical(f"Error reading {log_path}: {e}")
+        document = read_log_and_report(log_path, report_path)
+        if document is None:
             return
 
+        document, archived = self.shape_document(document)
         try:
-            with open(report_path, 'r') as report_file:
-                report_data = json.load(report_file)
-        except FileNotFoundError:
-            logger.error(f"Error: The file {report_path} was not found.")
-            return
-        except json.JSONDecodeError as e:
-            logger.critical(f"Error decoding JSON from {report_path}: {e}")
+            if archived is not None:
+                # 先写冷数据, 避免热文档存在而完整报告丢失
+                self.archive_collection().insert_one(archived)
+            result = self.collection.insert_one(document)
+            logger.debug("Log and report inserted successfully")
+        except errors.PyMongoError as e:
+            logger.debug(f"Error inserting document into MongoDB: {e}")
             return
 
-        document = {
-            'log': log_data,
-            'report': report_data
-        }
+        if self.maintain_summaries:
+            self.refresh_summaries(result.inserted_id)
+        if self.maintain_sketches:
+            document.setdefault('_id', result.inserted_id)
+            self.update_sketches([document])
+
+    def shape_document(self, document):
+        """
+        Prepares a result document for writing.
+
+        With a report shaper the document is slimmed and tagged with
+        `CURRENT_SCHEMA_VERSION`, so `Migrator` skips it. Without one it
+        keeps its full report and is tagged with the `TagVersion` version,
+        so the `ShapeReports` migration can still slim it.
+
+        Args:
+            document (dict): A document with 'log' and 'report' fields.
+
+        Returns:
+            tuple: The hot document and the archive document sharing its
+            `_id`, or None if nothing is archived in the archive collection.
+        """
+        if self.report_shaper is None:
+            document[SCHEMA_FIELD] = TagVersion.version
+            return document, None
+        document, archived, _ = self.report_shaper.shape(document)
+        document[SCHEMA_FIELD] = CURRENT_SCHEMA_VERSION
+        if archived is None:
+            return document, None
+        document.setdefault('_id', ObjectId())
+        return document, dict(archived, _id=document['_id'])
+
+    def archive_collection(self):
+        """
+        Returns the cold collection holding the full reports and logs.
+
+        Returns:
+            Collection: The collection named after this one plus the report
+            shaper's archive suffix.
+        """
+        suffix = self.report_shaper.archive_suffix if self.report_shaper \
+            else '_archive'
+        return self.db[self.collection.name + suffix]
+
+    def insert_documents(self, documents, ignore_duplicates=False):
+        """
+        Inserts a batch of documents into the MongoDB collection.
+
+        The batch is written unordered, so one failing document does not stop
+        the others. With a report shaper the documents are slimmed like in
+        `write_log_and_report`; the archive documents are written first and
+        a document whose archive write fails is not inserted.
+
+        Args:
+            documents (list): The documents to insert.
+            ignore_duplicates (bool): Whether a document whose `_id` is
+            already stored counts as inserted, for writers that derive the
+            `_id` and may retry a batch (default: False). Such documents are
+            not folded into the summaries or sketches again.
+
+        Returns:
+            list: The indexes within `documents` that were not inserted.
+
+        Raises:
+            PyMongoError: If there is an error inserting the documents into
+            MongoDB.
+        """
+        if not documents:
+            return []
+        shaped = [self.shape_document(document) for document in documents]
+        documents = [document for document, _ in shaped]
+        archived = [(index, archive) for index, (_, archive)
+                    in enumerate(shaped) if archive is not None]
+        failed = set()
+        duplicates = set()
+
+        def is_duplicate(error):
+            return ignore_duplicates and \
+                error.get('code') == DUPLICATE_KEY_CODE
 
         try:
-            self.collection.insert_one(document)
-            logger.debug("Log and report inserted successfully")
+            if archived:
+                try:
+                    self.archive_collection().insert_many(
+                        [archive for _, archive in archived], ordered=False)
+                except errors.BulkWriteError as e:
+                    failed = {archived[error['index']][0] for error
+                              in e.details.get('writeErrors', [])
+                              if not is_duplicate(error)}
+            pending = [index for index in range(len(documents))
+                       if index not in failed]
+            if pending:
+                self.collection.insert_many(
+                    [documents[index] for index in pending], ordered=False)
+        except errors.BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                index = pending[error['index']]
+                if is_duplicate(error):
+                    duplicates.add(index)
+                else:
+                    failed.add(index)
         except errors.PyMongoError as e:
-            logger.debug(f"Error inserting document into MongoDB: {e}")
+            logger.error(f"Error inserting documents into MongoDB: {e}")
+            return list(range(len(documents)))
+        failed = sorted(failed)
+        if failed:
+            logger.error(f"Error inserting {len(failed)} of {len(documents)} "
+                         f"documents into MongoDB")
+
+        inserted = [document for index, document in enumerate(documents)
+                    if index not in failed and index not in duplicates]
+        if self.maintain_summaries:
+            # insert_many 会为缺少 _id 的文档就地补上 _id
+            self.refresh_summaries([document['_id'] for document in inserted
+                                    if '_id' in document])
+        if self.maintain_sketches:
+            self.update_sketches(inserted)
+        return failed
 
     def read_result(self, result_path='result.json'):
         """
@@ -108,8 +449,7 @@ class MongoDB(object):
             return
 
         try:
-            with open(result_path, 'w') as result_file:
-                json.dump(documents_list, result_file, default=str)
+            serializer.dump_file(documents_list, result_path)
             logger.debug("Result written to result.json")
         except IOError as e:
             logger.critical(f"Error writing to {result_path}: {e}")
@@ -182,29 +522,296 @@ class MongoDB(object):
         except errors.PyMongoError as e:
             logger.critical(f"Error finding document: {e}")
             return None
-        
-    def aggregate_random_metrics(self, write_pattern, io_depth):
+
+    def consistent_reads(self):
         """
-        Aggregates random I/O metrics from the MongoDB collection.
+        Starts a causally consistent session for a watermark and the
+        aggregations reading up to it.
 
-        The aggregation pipeline processes documents to extract and compute
-        average and standard deviation metrics for random IOPS and bandwidth
-        based on the write pattern and I/O depth.
+        Routed reads may hit different secondaries. Within the session every
+        read waits until its node has replicated at least what the previous
+        read saw, so an aggregation never misses documents below a
+        `latest_id` watermark read just before it.
+
+        Returns:
+            ClientSession: The session, to be used as a context manager and
+            passed as `session` to `latest_id` and the aggregations.
+        """
+        return self.client.start_session(causal_consistency=True)
+
+    def _follower_session(self, session):
+        """
+        Starts a session causally after another one, for reads on another
+        thread (a session must not be shared between threads).
+
+        Returns:
+            ClientSession or nullcontext: The new session, or a context
+            yielding None without a session to follow.
+        """
+        if session is None:
+            return nullcontext()
+        follower = self.consistent_reads()
+        if session.cluster_time is not None:
+            follower.advance_cluster_time(session.cluster_time)
+        if session.operation_time is not None:
+            follower.advance_operation_time(session.operation_time)
+        return follower
+
+    def latest_id(self, session=None):
+        """
+        Finds the `_id` of the most recently inserted document.
+
+        ObjectIds grow monotonically with insertion time, so the newest
+        document is the one with the greatest `_id`. Callers use it as a
+        watermark to fetch only the documents inserted after a previous read,
+        so it is read from the same node as the aggregations and, within a
+        `consistent_reads` session, no aggregation of the session reads an
+        older snapshot than the watermark.
 
         Args:
-            write_pattern (int): The write pattern to filter the metrics (e.g.,
-            50 for 50% writes).
-            io_depth (int): The I/O depth to filter the metrics.
+            session (ClientSession): See `consistent_reads` (default: None).
 
         Returns:
-            dict or None: A dictionary containing the aggregated metrics, or None
-            if no data is found.
+            ObjectId or None: The newest `_id`, or None if the collection is
+            empty or cannot be read.
+        """
+        try:
+            document = self.analytics_collection.find_one(
+                {}, {'_id': 1}, sort=[('_id', DESCENDING)], session=session)
+        except errors.PyMongoError as e:
+            logger.error(f"Error finding latest document: {e}")
+            return None
+        return document['_id'] if document else None
+
+    def document_ids(self, since_id=None, until_id=None, session=None):
+        """
+        Lists the `_id`s of the documents in an `_id` range, read from the
+        same node as `latest_id`.
+
+        Args:
+            since_id (ObjectId): The exclusive lower bound (default: None).
+            until_id (ObjectId): The inclusive upper bound (default: None).
+            session (ClientSession): See `consistent_reads` (default: None).
+
+        Returns:
+            list or None: The `_id`s in ascending order, or None if the
+            collection cannot be read.
+        """
+        stage = self._id_range_stage(since_id, until_id)
+        try:
+            documents = self.analytics_collection.find(
+                stage['$match'] if stage else {}, {'_id': 1},
+                session=session).sort('_id', ASCENDING)
+            return [document['_id'] for document in documents]
+        except errors.PyMongoError as e:
+            logger.error(f"Error listing document ids: {e}")
+            return None
+
+    def query_options_for(self, name, **overrides):
+        """
+        Resolves the execution options of an aggregation pipeline.
+
+        The 'default' options apply to every pipeline, the options configured
+        for `name` override them and per-call overrides take precedence over
+        both. An option set to None is left to the server default.
+
+        Args:
+            name (str): The pipeline name.
+            **overrides: Per-call options: `maxTimeMS` (server-side timeout),
+            `allowDiskUse` (spill stages over the 100 MB memory budget to
+            disk), `batchSize` (cursor batch size), `read_preference`
+            (e.g. 'secondaryPreferred') and `partitions` (the number of `_id`
+            ranges aggregated concurrently, see `_aggregate_partitioned`).
+
+        Returns:
+            dict: The resolved options.
 
         Raises:
-            PyMongoError: If there is an error performing the aggregation in
-            MongoDB.
+            ValueError: If an option is not supported.
+        """
+        options = dict(self.query_options.get('default', {}))
+        options.update(self.query_options.get(name, {}))
+        options.update(overrides)
+        unknown = set(options) - set(QUERY_OPTIONS)
+        if unknown:
+            raise ValueError(f"Unsupported query options for '{name}': "
+                             f"{sorted(unknown)}")
+        return {key: value for key, value in options.items()
+                if value is not None}
+
+    def _aggregate(self, name, pipeline, collection=None, session=None,
+                   **overrides):
+        """
+        Runs an aggregation pipeline with its resolved execution options.
+
+        Args:
+            name (str): The pipeline name, used to look up its options and
+            sent as the query comment.
+            pipeline (list): The pipeline stages.
+            collection (Collection): The collection to aggregate (default:
+            the analytics collection).
+            session (ClientSession): See `consistent_reads` (default: None).
+            **overrides: Per-call options, see `query_options_for`.
+
+        Returns:
+            list: The result documents.
+
+        Raises:
+            AggregationLimitError: If the aggregation, or one of its
+            partitions, exceeds `maxTimeMS` or a server memory limit.
+            PyMongoError: If there is another error performing the
+            aggregation in MongoDB.
+        """
+        options = self.query_options_for(name, **overrides)
+        if collection is None:
+            collection = self.analytics_collection
+        read_preference = options.pop('read_preference', None)
+        if read_preference is not None:
+            collection = collection.with_options(
+                read_preference=READ_PREFERENCES[read_preference])
+        partitions = options.pop('partitions', 1)
+
+        start = time.monotonic()
+        try:
+            if partitions > 1 and is_partitionable(pipeline):
+                return self._aggregate_partitioned(name, pipeline, collection,
+                                                   partitions, options,
+                                                   session)
+            return list(collection.aggregate(pipeline, comment=name,
+                                             session=session, **options))
+        except errors.ExecutionTimeout as e:
+            raise AggregationLimitError(name, time.monotonic() - start,
+                                        'time', e) from e
+        except errors.OperationFailure as e:
+            if e.code in MEMORY_LIMIT_CODES:
+                raise AggregationLimitError(name, time.monotonic() - start,
+                                            'memory', e) from e
+            raise
+
+    @staticmethod
+    def _leading_id_range(pipeline):
+        """Returns the `_id` bounds of a leading `_id` range `$match`."""
+        match = pipeline[0].get('$match') if pipeline else None
+        if not match or list(match) != ['_id'] or \
+                not isinstance(match['_id'], dict) or \
+                not set(match['_id']) <= {'$gt', '$lte'}:
+            return None
+        return match['_id']
+
+    def partition_bounds(self, partitions, collection=None, since_id=None,
+                         until_id=None, session=None, **options):
+        """
+        Splits an `_id` range into partitions of about equal document counts.
+
+        Args:
+            partitions (int): The number of partitions wanted.
+            collection (Collection): The collection to split (default: the
+            analytics collection).
+            since_id (ObjectId): The exclusive lower bound (default: None).
+            until_id (ObjectId): The inclusive upper bound (default: None).
+            session (ClientSession): See `consistent_reads` (default: None).
+            **options: Options passed to the `$bucketAuto` aggregation.
+
+        Returns:
+            list: The (since_id, until_id) pair of every partition, in `_id`
+            order; None leaves a side open. Small collections may yield fewer
+            partitions than requested.
+        """
+        if collection is None:
+            collection = self.analytics_collection
+        pipeline = [{'$project': {'_id': 1}}, {'$bucketAuto': {
+            'groupBy': '$_id', 'buckets': partitions,
+            'output': {'last': {'$max': '$_id'}}}}]
+        id_range_stage = self._id_range_stage(since_id, until_id)
+        if id_range_stage:
+            pipeline.insert(0, id_range_stage)
+        buckets = list(collection.aggregate(pipeline, comment='partitions',
+                                            session=session, **options))
+        # 每个分区的上界是桶内最大 _id, 最后一个分区沿用原上界
+        bounds = [since_id] + [bucket['last'] for bucket in buckets[:-1]] + \
+            [until_id]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _aggregate_partitioned(self, name, pipeline, collection, partitions,
+                               options, session=None):
+        """
+        Runs a pipeline on `_id` partitions concurrently and merges them.
+
+        The collection, or the `_id` range of a leading `$match`, is split
+        by `partition_bounds`. Every partition runs the pipeline with its
+        final `$group` rewritten by `partial_group` on a thread pool, so the
+        wall-clock time scales with the connections, and `merge_groups`
+        combines the partial results on the client. With a session every
+        partition reads in its own session advanced to it.
+
+        Args:
+            name (str): The pipeline name, sent as the query comment.
+            pipeline (list): The stages, see `is_partitionable`.
+            collection (Collection): The collection to aggregate.
+            partitions (int): The number of partitions.
+            options (dict): The resolved execution options.
+            session (ClientSession): See `consistent_reads` (default: None).
+
+        Returns:
+            list: The result documents.
+        """
+        id_range = self._leading_id_range(pipeline)
+        stages = pipeline[1:] if id_range else pipeline
+        id_range = id_range or {}
+        # 划分分区的查询与各分区使用相同的 maxTimeMS 等执行选项
+        bounds = self.partition_bounds(
+            partitions, collection, id_range.get('$gt'), id_range.get('$lte'),
+            session=session, **options)
+        group = stages[-1]['$group']
+        partial = stages[:-1] + [{'$group': partial_group(group)}]
+
+        def run(index):
+            since_id, until_id = bounds[index]
+            stage = self._id_range_stage(since_id, until_id)
+            with self._follower_session(session) as follower:
+                return list(collection.aggregate(
+                    ([stage] if stage else []) + partial,
+                    comment=f'{name}[{index}]', session=follower, **options))
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(bounds)) as executor:
+            partials = list(executor.map(run, range(len(bounds))))
+        logger.info(f"Aggregated '{name}' over {len(bounds)} partitions in "
+                    f"{time.monotonic() - start:.2f} seconds.")
+        return merge_groups(group, partials, pipeline_limit(pipeline))
+
+    @staticmethod
+    def _id_range_stage(since_id=None, until_id=None):
+        """
+        Builds a `$match` stage restricting documents to an `_id` range.
+
+        Args:
+            since_id (ObjectId): Only documents with a greater `_id` match.
+            until_id (ObjectId): Only documents with a lower or equal `_id`
+            match.
+
+        Returns:
+            dict or None: The `$match` stage, or None if neither bound is given.
+        """
+        id_range = {}
+        if since_id is not None:
+            id_range['$gt'] = since_id
+        if until_id is not None:
+            id_range['$lte'] = until_id
+        if not id_range:
+            return None
+        return {'$match': {'_id': id_range}}
+
+    @staticmethod
+    def _random_rows_pipeline():
+        """
+        Generates the stages emitting one row of random I/O metrics per log
+        message of a passed random test, with its write pattern and I/O depth.
+
+        Returns:
+            list: The pipeline stages.
         """
-        pipeline = [
+        return [
             {
                 "$project": {
                 "_id": 0,
@@ -255,30 +862,8 @@ class MongoDB(object):
                     "regex": "test_run_io_operation\\[(\\d+)-(\\d+)"
                     }
                 },
-                "read_iops_string": {
-                    "$regexFind": {
-                    "input": "$report.tests.call.log.msg",
-                    "regex": "random_read_iops\\s*=\\s*(\\d+.\\d+)"
-                    }
-                },
-                "read_bw_string": {
-                    "$regexFind": {
-                    "input": "$report.tests.call.log.msg",
-                    "regex": "random_read_bw\\s*=\\s*(\\d+.\\d+)"
-                    }
-                },
-                "write_iops_string": {
-                    "$regexFind": {
-                    "input": "$report.tests.call.log.msg",
-                    "regex": "random_write_iops\\s*=\\s*(\\d+.\\d+)"
-                    }
-                },
-                "write_bw_string": {
-                    "$regexFind": {
-                    "input": "$report.tests.call.log.msg",
-                    "regex": "random_write_bw\\s*=\\s*(\\d+.\\d+)"
-                    }
-                }
+                "metrics": metric_expression(
+                    'random', "$report.tests.call.log.msg")
                 }
             },
             {
@@ -309,60 +894,40 @@ class MongoDB(object):
                     "onNull": None
                     }
                 },
-                "read_iops": {
-                    "$convert": {
-                    "input": {
-                        "$arrayElemAt": [
-                        "$read_iops_string.captures",
-                        0
-                        ]
-                    },
-                    "to": "double",
-                    "onError": None,
-                    "onNull": None
-                    }
-                },
-                "read_bw": {
-                    "$convert": {
-                    "input": {
-                        "$arrayElemAt": [
-                        "$read_bw_string.captures",
-                        0
-                        ]
-                    },
-                    "to": "double",
-                    "onError": None,
-                    "onNull": None
-                    }
-                },
-                "write_iops": {
-                    "$convert": {
-                    "input": {
-                        "$arrayElemAt": [
-                        "$write_iops_string.captures",
-                        0
-                        ]
-                    },
-                    "to": "double",
-                    "onError": None,
-                    "onNull": None
-                    }
-                },
-                "write_bw": {
-                    "$convert": {
-                    "input": {
-                        "$arrayElemAt": [
-                        "$write_bw_string.captures",
-                        0
-                        ]
-                    },
-                    "to": "double",
-                    "onError": None,
-                    "onNull": None
-                    }
-                }
+                "metrics": 1
                 }
             },
+            {
+                "$replaceWith": {
+                "$mergeObjects": ["$$ROOT", "$metrics"]
+                }
+            }
+        ]
+
+    def aggregate_random_metrics(self, write_pattern, io_depth, **options):
+        """
+        Aggregates random I/O metrics from the MongoDB collection.
+
+        The aggregation pipeline processes documents to extract and compute
+        average and standard deviation metrics for random IOPS and bandwidth
+        based on the write pattern and I/O depth.
+
+        Args:
+            write_pattern (int): The write pattern to filter the metrics (e.g.,
+            50 for 50% writes).
+            io_depth (int): The I/O depth to filter the metrics.
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
+
+        Returns:
+            dict or None: A dictionary containing the aggregated metrics, or None
+            if no data is found.
+
+        Raises:
+            PyMongoError: If there is an error performing the aggregation in
+            MongoDB.
+        """
+        pipeline = self._random_rows_pipeline() + [
             {
                 "$match": {
                 "write_pattern": write_pattern,
@@ -428,38 +993,29 @@ class MongoDB(object):
         ]
 
         try:
-            result = list(self.collection.aggregate(pipeline))
+            result = self._aggregate('random', pipeline, **options)
             if result:
                 return result[0]
             else:
                 logger.error("No data found for aggregation.")
                 return None
+        except AggregationLimitError:
+            raise
         except errors.PyMongoError as e:
             logger.error(f"Error performing aggregation: {e}")
             return None
 
-    def aggregate_sequential_metrics(self, write_pattern, block_size):
+    @staticmethod
+    def _sequential_rows_pipeline():
         """
-        Aggregates sequential I/O metrics from the MongoDB collection.
-
-        The aggregation pipeline processes documents to extract and compute
-        average and standard deviation metrics for sequential IOPS and bandwidth
-        based on the write pattern and block size.
-
-        Args:
-            write_pattern (int): The write pattern to filter the metrics (e.g.,
-            50 for 50% writes).
-            io_depth (int): The I/O depth to filter the metrics.
+        Generates the stages emitting one row of sequential I/O metrics per
+        log message of a passed sequential test, with its write pattern and
+        block size.
 
         Returns:
-            dict or None: A dictionary containing the aggregated metrics, or None
-            if no data is found.
-
-        Raises:
-            PyMongoError: If there is an error performing the aggregation in
-            MongoDB.
+            list: The pipeline stages.
         """
-        pipeline = [
+        return [
                         # Stage 1
                         {
                             "$project": {
@@ -560,91 +1116,43 @@ class MongoDB(object):
                             "$project": {
                                 "write_pattern": 1,
                                 "block_size": 1,
-                                "read_iops_string": {
-                                    "$regexFind": {
-                                        "input": "$msg",
-                                        "regex": "sequential_read_iops\\s*=\\s*([\\d\\.]+)"
-                                    }
-                                },
-                                "read_bw_string": {
-                                    "$regexFind": {
-                                        "input": "$msg",
-                                        "regex": "sequential_read_bw\\s*=\\s*([\\d\\.]+)"
-                                    }
-                                },
-                                "write_iops_string": {
-                                    "$regexFind": {
-                                        "input": "$msg",
-                                        "regex": "sequential_write_iops\\s*=\\s*([\\d\\.]+)"
-                                    }
-                                },
-                                "write_bw_string": {
-                                    "$regexFind": {
-                                        "input": "$msg",
-                                        "regex": "sequential_write_bw\\s*=\\s*([\\d\\.]+)"
-                                    }
-                                }
+                                "metrics": metric_expression('sequential',
+                                                             "$msg")
                             }
                         },
                         # Stage 11
                         {
-                            "$project": {
-                                "write_pattern": 1,
-                                "block_size": 1,
-                                "read_iops": {
-                                    "$convert": {
-                                        "input": {
-                                            "$arrayElemAt": [
-                                                "$read_iops_string.captures",
-                                                0
-                                            ]
-                                        },
-                                        "to": "double",
-                                        "onError": None,
-                                        "onNull": None
-                                    }
-                                },
-                                "read_bw": {
-                                    "$convert": {
-                                        "input": {
-                                            "$arrayElemAt": [
-                                                "$read_bw_string.captures",
-                                                0
-                                            ]
-                                        },
-                                        "to": "double",
-                                        "onError": None,
-                                        "onNull": None
-                                    }
-                                },
-                                "write_iops": {
-                                    "$convert": {
-                                        "input": {
-                                            "$arrayElemAt": [
-                                                "$write_iops_string.captures",
-                                                0
-                                            ]
-                                        },
-                                        "to": "double",
-                                        "onError": None,
-                                        "onNull": None
-                                    }
-                                },
-                                "write_bw": {
-                                    "$convert": {
-                                        "input": {
-                                            "$arrayElemAt": [
-                                                "$write_bw_string.captures",
-                                                0
-                                            ]
-                                        },
-                                        "to": "double",
-                                        "onError": None,
-                                        "onNull": None
-                                    }
-                                }
+                            "$replaceWith": {
+                                "$mergeObjects": ["$$ROOT", "$metrics"]
                             }
-                        },
+                        }
+        ]
+
+    def aggregate_sequential_metrics(self, write_pattern, block_size,
+                                     **options):
+        """
+        Aggregates sequential I/O metrics from the MongoDB collection.
+
+        The aggregation pipeline processes documents to extract and compute
+        average and standard deviation metrics for sequential IOPS and bandwidth
+        based on the write pattern and block size.
+
+        Args:
+            write_pattern (int): The write pattern to filter the metrics (e.g.,
+            50 for 50% writes).
+            io_depth (int): The I/O depth to filter the metrics.
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
+
+        Returns:
+            dict or None: A dictionary containing the aggregated metrics, or None
+            if no data is found.
+
+        Raises:
+            PyMongoError: If there is an error performing the aggregation in
+            MongoDB.
+        """
+        pipeline = self._sequential_rows_pipeline() + [
                         # Stage 12
                         { 
                             "$match": {
@@ -712,64 +1220,651 @@ class MongoDB(object):
                     ]
 
         try:
-            result = list(self.collection.aggregate(pipeline))
+            result = self._aggregate('sequential', pipeline, **options)
             if result:
                 return result[0]
             else:
                 logger.error("No data found for aggregation.")
                 return None
+        except AggregationLimitError:
+            raise
         except errors.PyMongoError as e:
             logger.critical(f"Error performing aggregation: {e}")
             return None
         
-    def aggregate_ramp_metrics(self, limit: int) -> Dict:
+    def summary_collection(self):
         """
-        Aggregates ramp I/O metrics from the MongoDB collection.
+        Returns the collection of the materialized summaries.
 
-        The aggregation pipeline processes documents to extract and compute
-        average and standard deviation metrics for ramp IOPS and bandwidth
-        based on the write pattern and ramp times.
+        Returns:
+            Collection: The collection named after this one plus '_summary'.
+        """
+        return self.db[self.collection.name + '_summary']
+
+    def _summary_pipeline(self, kind):
+        """
+        Generates the pipeline summarizing the metrics of one test kind per
+        configuration into count/sum/sumsq/min/max, which merge additively.
 
         Args:
-            write_pattern (int): The write pattern to filter the metrics (e.g.,
-            50 for 50% writes).
-            ramp_times (int): The ramp times to filter the metrics.
+            kind (str): 'random' or 'sequential'.
 
         Returns:
-            dict or None: A dictionary containing the aggregated metrics, or None
-            if no data is found.
+            list: The pipeline stages.
+        """
+        rows = {'random': self._random_rows_pipeline,
+                'sequential': self._sequential_rows_pipeline}[kind]()
+        key = SUMMARY_KEYS[kind]
+        group = {'_id': {'kind': kind, 'write_pattern': '$write_pattern',
+                         key: f'${key}'}}
+        for name in THROUGHPUT_METRICS:
+            value = f'${name}'
+            group.update({
+                f'{name}_count': {'$sum': {'$cond': [{'$isNumber': value},
+                                                      1, 0]}},
+                f'{name}_sum': {'$sum': value},
+                f'{name}_sumsq': {'$sum': {'$multiply': [value, value]}},
+                f'{name}_min': {'$min': value},
+                f'{name}_max': {'$max': value}
+            })
+        return rows + [
+            {'$match': {'write_pattern': {'$ne': None}, key: {'$ne': None}}},
+            {'$group': group}
+        ]
+
+    @staticmethod
+    def _summary_increment():
+        """Generates the `$merge` update adding new stats to stored ones."""
+        update = {}
+        for name in THROUGHPUT_METRICS:
+            for stat in SUMMARY_STATS:
+                field = f'{name}_{stat}'
+                operator = '$add' if stat in ('count', 'sum', 'sumsq') \
+                    else f'${stat}'
+                update[field] = {operator: [f'${field}', f'$$new.{field}']}
+        return [{'$set': update}]
+
+    def refresh_summaries(self, document_id=None):
+        """
+        Refreshes the materialized per-configuration summaries.
+
+        With document ids the documents are folded into the stored summaries
+        by an incremental `$merge`, which is how `write_log_and_report` and
+        `insert_documents` keep them current. Without them, the summaries are
+        rebuilt from the whole collection and atomically replaced with
+        `$out`; run `python -m unit.mongodb refresh_summaries` on a schedule
+        to pick up updated or deleted documents.
+
+        Args:
+            document_id (ObjectId or list): The newly inserted document or
+            documents (default: None rebuilds the summaries).
+
+        Returns:
+            bool: Whether the summaries were refreshed.
+        """
+        into = self.summary_collection().name
+        try:
+            if isinstance(document_id, list):
+                if not document_id:
+                    return True
+                document_id = {'$in': document_id}
+            if document_id is not None:
+                for kind in SUMMARY_KEYS:
+                    pipeline = [{'$match': {'_id': document_id}}]
+                    pipeline += self._summary_pipeline(kind)
+                    pipeline.append({'$merge': {
+                        'into': into,
+                        'whenMatched': self._summary_increment(),
+                        'whenNotMatched': 'insert'}})
+                    self._aggregate(f'{kind}_summary', pipeline,
+                                    collection=self.collection)
+            else:
+                pipeline = self._summary_pipeline('random')
+                pipeline.append({'$unionWith': {
+                    'coll': self.collection.name,
+                    'pipeline': self._summary_pipeline('sequential')}})
+                pipeline.append({'$out': into})
+                self._aggregate('summary', pipeline,
+                                collection=self.collection)
+        except errors.PyMongoError as e:
+            logger.error(f"Error refreshing summaries: {e}")
+            return False
+        return True
+
+    def _find_summary(self, kind, write_pattern, key_value):
+        key = {'kind': kind, 'write_pattern': write_pattern,
+               SUMMARY_KEYS[kind]: key_value}
+        try:
+            document = self.summary_collection().find_one({'_id': key})
+        except errors.PyMongoError as e:
+            logger.error(f"Error finding summary: {e}")
+            return None
+        if document is None:
+            logger.debug("No summary matches the given configuration.")
+            return None
+        return summary_statistics(document)
+
+    def get_random_summary(self, write_pattern, io_depth):
+        """
+        Looks up the materialized random I/O metrics of a configuration.
+
+        A single `_id` point lookup replacing `aggregate_random_metrics` for
+        frequent readers such as dashboards.
+
+        Args:
+            write_pattern (int): The write pattern (e.g., 50 for 50% writes).
+            io_depth (int): The I/O depth.
+
+        Returns:
+            dict or None: The metrics shaped like the result of
+            `aggregate_random_metrics`, or None if there is no summary.
+        """
+        return self._find_summary('random', write_pattern, io_depth)
+
+    def get_sequential_summary(self, write_pattern, block_size):
+        """
+        Looks up the materialized sequential I/O metrics of a configuration.
+
+        Args:
+            write_pattern (int): The write pattern (e.g., 50 for 50% writes).
+            block_size (str): The block size, e.g. '128k'.
+
+        Returns:
+            dict or None: The metrics shaped like the result of
+            `aggregate_sequential_metrics`, or None if there is no summary.
+        """
+        return self._find_summary('sequential', write_pattern, block_size)
+
+    def sketch_collection(self):
+        """
+        Returns the collection of the quantile sketches.
+
+        Returns:
+            Collection: The collection named after this one plus '_sketch'.
+        """
+        return self.db[self.collection.name + '_sketch']
+
+    @staticmethod
+    def _sketch_id(kind, configuration, metric, day=''):
+        # 日期在末尾, 同一配置与指标的各天按 _id 前缀连续存放
+        return '|'.join([kind, *map(str, configuration), metric, day])
+
+    def update_sketches(self, documents):
+        """
+        Folds the metric samples of result documents into the stored
+        quantile sketches.
+
+        One sketch is kept per test kind, configuration, metric and UTC day of
+        the document `_id`. Bucket counts are added with `$inc` upserts, so
+        concurrent writers merge without reading the sketches back.
+
+        Args:
+            documents (list): Result documents with a 'report' field.
+
+        Returns:
+            int or None: The number of sketches updated, or None if they
+            cannot be written.
+        """
+        merged = {}
+        for document in documents:
+            _id = document.get('_id')
+            created = _id.generation_time if isinstance(_id, ObjectId) \
+                else datetime.datetime.now(datetime.timezone.utc)
+            day = created.strftime('%Y-%m-%d')
+            for (kind, configuration, metric), sketch in \
+                    sketch_report(document.get('report', {})).items():
+                key = (kind, configuration, metric, day)
+                if key in merged:
+                    merged[key].merge(sketch)
+                else:
+                    merged[key] = sketch
+
+        requests = []
+        for (kind, configuration, metric, day), sketch in merged.items():
+            increments = {'count': sketch.count,
+                          'zero_count': sketch.zero_count}
+            increments.update({f'bins.{index}': count
+                               for index, count in sketch.bins.items()})
+            sketch_id = self._sketch_id(
+                kind, [value for _, value in configuration], metric, day)
+            requests.append(UpdateOne({'_id': sketch_id}, {
+                '$inc': increments,
+                '$min': {'min': sketch.min},
+                '$max': {'max': sketch.max},
+                '$setOnInsert': {
+                    'kind': kind, 'configuration': dict(configuration),
+                    'metric': metric, 'day': day,
+                    'relative_accuracy': sketch.relative_accuracy}
+            }, upsert=True))
+        if not requests:
+            return 0
+        try:
+            self.sketch_collection().bulk_write(requests, ordered=False)
+        except errors.PyMongoError as e:
+            logger.error(f"Error updating quantile sketches: {e}")
+            return None
+        return len(requests)
+
+    def get_sketch(self, kind, write_pattern, parameter, metric,
+                   since_day=None, until_day=None):
+        """
+        Merges the stored daily sketches of a configuration and metric.
+
+        Args:
+            kind (str): The test kind, e.g. 'random' or 'stress'.
+            write_pattern (int): The write pattern.
+            parameter: The second test parameter, e.g. the I/O depth.
+            metric (str): The metric name without prefix, e.g. 'read_iops'.
+            since_day (str): The first day, 'YYYY-MM-DD' (default: None).
+            until_day (str): The last day, 'YYYY-MM-DD' (default: None).
+
+        Returns:
+            QuantileSketch or None: The merged sketch, or None if there are
+            no samples. Sketches of other collections, e.g. other hosts, can
+            be merged into it.
+        """
+        prefix = self._sketch_id(kind, [write_pattern, parameter], metric)
+        day_range = {'$gte': prefix + (since_day or ''),
+                     '$lte': prefix + (until_day or '~')}
+        try:
+            documents = list(self.sketch_collection().find({'_id': day_range}))
+        except errors.PyMongoError as e:
+            logger.error(f"Error finding quantile sketches: {e}")
+            return None
+        sketch = None
+        for document in documents:
+            daily = QuantileSketch.from_dict(document)
+            sketch = daily if sketch is None else sketch.merge(daily)
+        return sketch
+
+    def get_quantiles(self, kind, write_pattern, parameter, metric,
+                      quantiles=(0.5, 0.95, 0.99), since_day=None,
+                      until_day=None):
+        """
+        Estimates quantiles of a metric from the stored sketches.
+
+        Args:
+            quantiles (tuple): The quantiles to estimate (default: p50, p95
+            and p99).
+            See `get_sketch` for the other arguments.
+
+        Returns:
+            dict or None: The estimate of every quantile, or None if there
+            are no samples.
+        """
+        sketch = self.get_sketch(kind, write_pattern, parameter, metric,
+                                 since_day, until_day)
+        if sketch is None:
+            return None
+        return {q: sketch.quantile(q) for q in quantiles}
+
+    def load_pipeline(self, name):
+        """
+        Loads a named aggregation pipeline from `config/pipeline_<name>.json`.
+
+        `$extractMetrics` placeholders are expanded from the shared metric
+        pattern table. Parsed pipelines are cached per instance; every call
+        returns a fresh deep copy so callers may modify the stages freely.
+
+        Args:
+            name (str): The pipeline name, e.g. 'stress' or 'ramp_times'.
+
+        Returns:
+            list or None: The pipeline stages, or None if the configuration
+            cannot be loaded.
+        """
+        if name not in self._pipelines:
+            try:
+                with open(f'config/pipeline_{name}.json', 'r') as file:
+                    self._pipelines[name] = expand_placeholders(
+                        json.load(file))
+            except FileNotFoundError:
+                logger.error("Pipeline configuration file not found.")
+                return None
+            except json.JSONDecodeError as e:
+                logger.critical(f"Error decoding JSON from pipeline configuration: {e}")
+                return None
+        return copy.deepcopy(self._pipelines[name])
+
+    def named_pipeline(self, name, limit=None, since_id=None, until_id=None,
+                       ids=None):
+        """
+        Prepares a named aggregation pipeline for one run.
+
+        Args:
+            name (str): The pipeline name, see `load_pipeline`.
+            limit (int): Replaces the value of every `$limit` stage (default:
+            None keeps the configured limit).
+            since_id (ObjectId): Only aggregate documents inserted after this
+            `_id` (default: None).
+            until_id (ObjectId): Only aggregate documents up to and including
+            this `_id` (default: None).
+            ids (list): Also aggregate the documents with these `_id`s; alone
+            they restrict the pipeline to them (default: None).
+
+        Returns:
+            list or None: The pipeline stages, or None if the configuration
+            cannot be loaded.
+        """
+        pipeline = self.load_pipeline(name)
+        if pipeline is None:
+            return None
+
+        if limit is not None:
+            for stage in pipeline:
+                if "$limit" in stage:
+                    stage["$limit"] = limit
+
+        id_range_stage = self._id_range_stage(since_id, until_id)
+        if ids is not None:
+            listed = {'_id': {'$in': list(ids)}}
+            id_range_stage = {'$match': {'$or': [id_range_stage['$match'],
+                                                 listed]}} \
+                if id_range_stage else {'$match': listed}
+        if id_range_stage:
+            pipeline.insert(0, id_range_stage)
+        return pipeline
+
+    def aggregate_pipeline(self, name, limit=None, since_id=None,
+                           until_id=None, session=None, **options) -> Dict:
+        """
+        Runs a named aggregation pipeline on the MongoDB collection.
+
+        Args:
+            name (str): The pipeline name, see `load_pipeline`.
+            limit (int): Replaces the value of every `$limit` stage (default:
+            None keeps the configured limit).
+            since_id (ObjectId): Only aggregate documents inserted after this
+            `_id` (default: None).
+            until_id (ObjectId): Only aggregate documents up to and including
+            this `_id` (default: None).
+            session (ClientSession): See `consistent_reads` (default: None).
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
+
+        Returns:
+            dict or None: The first result document, or None if no data is
+            found.
 
         Raises:
+            AggregationLimitError: If the aggregation exceeds its time or
+            memory limit.
             PyMongoError: If there is an error performing the aggregation in
             MongoDB.
         """
-        try:
-            with open('config/pipeline_ramp_times.json', 'r') as file:
-                pipeline = json.load(file)
-        except FileNotFoundError:
-            logger.error("Pipeline configuration file not found.")
-            return None
-        except json.JSONDecodeError as e:
-            logger.critical(f"Error decoding JSON from pipeline configuration: {e}")
+        pipeline = self.named_pipeline(name, limit, since_id, until_id)
+        if pipeline is None:
             return None
-        
-        for stage in pipeline:
-            if "$limit" in stage:
-                stage["$limit"] = limit
 
         try:
-            result = list(self.collection.aggregate(pipeline))
+            result = self._aggregate(name, pipeline, session=session,
+                                     **options)
             if result:
                 return result[0]
             else:
                 logger.error("No data found for aggregation.")
                 return None
+        except AggregationLimitError:
+            raise
         except errors.PyMongoError as e:
-            logger.critical(f"Error performing aggregation: {e}")
+            logger.error(f"Error performing aggregation: {e}")
             return None
-        
-    # def aggregate_stress_metrics(self, write_pattern, iodepth):
-    def aggregate_stress_metrics(self, limit: int) -> Dict:
+
+    def aggregate_records(self, name, fields, limit=None, since_id=None,
+                          until_id=None, ids=None, session=None, **options):
+        """
+        Runs a named row pipeline and returns its rows as `MetricRecords`.
+
+        The final `$group` pushing every row as a document is replaced by
+        `columnar_group`, so the server returns one array per field and no
+        document per row is decoded.
+
+        Args:
+            name (str): The pipeline name, see `load_pipeline`; it must end
+            in a `$group` by null pushing the rows.
+            fields (list): The row fields to return.
+            limit (int): See `aggregate_pipeline`.
+            since_id (ObjectId): See `aggregate_pipeline`.
+            until_id (ObjectId): See `aggregate_pipeline`.
+            ids (list): See `named_pipeline`.
+            session (ClientSession): See `consistent_reads` (default: None).
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
+
+        Returns:
+            MetricRecords or None: The rows, or None if no data is found.
+
+        Raises:
+            ValueError: If the pipeline does not end in such a `$group`.
+            AggregationLimitError: If the aggregation exceeds its time or
+            memory limit.
+        """
+        pipeline = self.named_pipeline(name, limit, since_id, until_id, ids)
+        if pipeline is None:
+            return None
+        group = pipeline[-1].get('$group', {})
+        if group.get('_id', 0) is not None or len(group) != 2:
+            raise ValueError(f"Pipeline '{name}' does not push its rows "
+                             f"into one document")
+        pipeline[-1] = columnar_group(fields)
+
+        try:
+            result = self._aggregate(name, pipeline, session=session,
+                                     **options)
+        except AggregationLimitError:
+            raise
+        except errors.PyMongoError as e:
+            logger.error(f"Error performing aggregation: {e}")
+            return None
+        if not result:
+            logger.error("No data found for aggregation.")
+            return None
+        return MetricRecords.from_columns(result[0], fields)
+
+    def resolve_collections(self, collections):
+        """
+        Expands collection names and glob patterns.
+
+        Args:
+            collections (str or list): Collection names or patterns such as
+            'amd_*'; names without wildcards are kept as they are.
+
+        Returns:
+            list: The unique collection names, in the given order.
+        """
+        if isinstance(collections, str):
+            collections = [collections]
+        existing = None
+        names = []
+        for pattern in collections:
+            if glob.has_magic(pattern):
+                if existing is None:
+                    existing = sorted(self.db.list_collection_names())
+                matches = fnmatch.filter(existing, pattern)
+            else:
+                matches = [pattern]
+            names += [name for name in matches if name not in names]
+        return names
+
+    def _analytics_handle(self, collection_name):
+        """Returns a collection read like the analytics collection."""
+        return self.db.get_collection(
+            collection_name,
+            read_preference=self.analytics_collection.read_preference)
+
+    def fan_out(self, name, collections, limit=None, since_id=None,
+                until_id=None, union=False, **options):
+        """
+        Runs a named pipeline across several collections.
+
+        By default the pipeline runs on every collection concurrently and
+        the results are yielded as each collection finishes, so the latency
+        is that of the slowest collection rather than the sum. With `union`
+        the collections are combined on the server instead: the stages
+        before a final `$group` run on each collection through `$unionWith`
+        and the `$group` runs once over all of them.
+
+        Args:
+            name (str): The pipeline name, see `load_pipeline`.
+            collections (str or list): See `resolve_collections`.
+            limit (int): Replaces the value of every `$limit` stage, which
+            applies per collection (default: None).
+            since_id (ObjectId): Only aggregate documents inserted after this
+            `_id` (default: None).
+            until_id (ObjectId): Only aggregate documents up to and including
+            this `_id` (default: None).
+            union (bool): Whether to combine the collections with
+            `$unionWith` (default: False).
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
+
+        Yields:
+            tuple: The (collection name, result document) pairs; the name is
+            None for the combined results of `union`.
+
+        Raises:
+            AggregationLimitError: If an aggregation exceeds its time or
+            memory limit.
+        """
+        pipeline = self.named_pipeline(name, limit, since_id, until_id)
+        if pipeline is None:
+            return
+        yield from self._fan_out(name, pipeline,
+                                 self.resolve_collections(collections),
+                                 union, **options)
+
+    def _fan_out(self, name, pipeline, names, union=False, **options):
+        """Runs prepared stages across collections, see `fan_out`."""
+        if not names:
+            return
+        if union:
+            yield from ((None, document) for document in
+                        self._union(name, pipeline, names, **options))
+            return
+
+        def run(collection_name):
+            return self._aggregate(name, copy.deepcopy(pipeline),
+                                   self._analytics_handle(collection_name),
+                                   **options)
+
+        with ThreadPoolExecutor(max_workers=len(names)) as executor:
+            futures = {executor.submit(run, collection_name): collection_name
+                       for collection_name in names}
+            for future in as_completed(futures):
+                try:
+                    documents = future.result()
+                except AggregationLimitError:
+                    raise
+                except errors.PyMongoError as e:
+                    logger.error(f"Error performing aggregation on "
+                                 f"{futures[future]}: {e}")
+                    continue
+                for document in documents:
+                    yield futures[future], document
+
+    def _union(self, name, pipeline, names, **options):
+        """Combines the collections with `$unionWith` in one aggregation."""
+        group = [pipeline[-1]] if '$group' in pipeline[-1] else []
+        stages = pipeline[:len(pipeline) - len(group)]
+        combined = copy.deepcopy(stages)
+        for collection_name in names[1:]:
+            combined.append({'$unionWith': {
+                'coll': collection_name,
+                'pipeline': copy.deepcopy(stages)}})
+        try:
+            return self._aggregate(name, combined + group,
+                                   self._analytics_handle(names[0]),
+                                   **options)
+        except AggregationLimitError:
+            raise
+        except errors.PyMongoError as e:
+            logger.error(f"Error performing aggregation: {e}")
+            return []
+
+    def aggregate_across(self, name, collections, limit=None, since_id=None,
+                         until_id=None, union=False, **options) -> Dict:
+        """
+        Runs a named pipeline across collections and merges the results.
+
+        Without `union`, a pipeline ending in a mergeable `$group` (see
+        `unit.partition`) runs with a partial `$group` on every collection
+        concurrently and the partial results are merged on the client, so
+        averages and standard deviations cover all collections and pushed
+        rows are concatenated in the order of `collections`.
+
+        Args:
+            name (str): The pipeline name, see `load_pipeline`.
+            collections (str or list): See `resolve_collections`.
+            limit (int): Replaces the value of every `$limit` stage (default:
+            None); merged `$push` lists are truncated to it too.
+            since_id (ObjectId): See `fan_out`.
+            until_id (ObjectId): See `fan_out`.
+            union (bool): Whether to merge on the server with `$unionWith`.
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
+
+        Returns:
+            dict or None: The first merged result document, or None if no
+            data is found.
+
+        Raises:
+            AggregationLimitError: If an aggregation exceeds its time or
+            memory limit.
+        """
+        pipeline = self.named_pipeline(name, limit, since_id, until_id)
+        if pipeline is None:
+            return None
+        names = self.resolve_collections(collections)
+        if union or not is_partitionable(pipeline):
+            results = [document for _, document in self._fan_out(
+                name, pipeline, names, union, **options)]
+        else:
+            group = pipeline[-1]['$group']
+            partial = pipeline[:-1] + [{'$group': partial_group(group)}]
+            partials = {}
+            for collection_name, document in self._fan_out(
+                    name, partial, names, **options):
+                partials.setdefault(collection_name, []).append(document)
+            results = merge_groups(group, [partials[collection_name]
+                                           for collection_name in names
+                                           if collection_name in partials],
+                                   pipeline_limit(pipeline))
+        if results:
+            return results[0]
+        logger.error("No data found for aggregation.")
+        return None
+
+    def aggregate_ramp_metrics(self, limit: int, since_id=None,
+                               until_id=None, **options) -> Dict:
+        """
+        Aggregates ramp I/O metrics from the MongoDB collection.
+
+        The aggregation pipeline processes documents to extract and compute
+        average and standard deviation metrics for ramp IOPS and bandwidth
+        based on the write pattern and ramp times.
+
+        Args:
+            limit (int): The maximum number of metric rows to return.
+            since_id (ObjectId): Only aggregate documents inserted after this
+            `_id` (default: None).
+            until_id (ObjectId): Only aggregate documents up to and including
+            this `_id` (default: None).
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
+
+        Returns:
+            dict or None: A dictionary containing the aggregated metrics, or None
+            if no data is found.
+
+        Raises:
+            PyMongoError: If there is an error performing the aggregation in
+            MongoDB.
+        """
+        return self.aggregate_pipeline('ramp_times', limit, since_id, until_id,
+                                       **options)
+
+    def aggregate_stress_metrics(self, limit: int, since_id=None,
+                                 until_id=None, **options) -> Dict:
         """
         Aggregates I/O stress metrics from the MongoDB collection.
 
@@ -778,9 +1873,13 @@ class MongoDB(object):
         based on the write pattern and I/O depth.
 
         Args:
-            write_pattern (int): The write pattern to filter the metrics (e.g.,
-            50 for 50% writes).
-            io_depth (int): The I/O depth to filter the metrics.
+            limit (int): The maximum number of metric rows to return.
+            since_id (ObjectId): Only aggregate documents inserted after this
+            `_id` (default: None).
+            until_id (ObjectId): Only aggregate documents up to and including
+            this `_id` (default: None).
+            **options: Execution options overriding the configured ones, see
+            `query_options_for`.
 
         Returns:
             dict or None: A dictionary containing the aggregated metrics, or None
@@ -790,33 +1889,40 @@ class MongoDB(object):
             PyMongoError: If there is an error performing the aggregation in
             MongoDB.
         """
-        try:
-            with open('config/pipeline_stress.json', 'r') as file:
-                pipeline = json.load(file)
-        except FileNotFoundError:
-            logger.error("Pipeline configuration file not found.")
-            return None
-        except json.JSONDecodeError as e:
-            logger.critical(f"Error decoding JSON from pipeline configuration: {e}")
-            return None
-        
-        # Update the pipeline with the specific filter values
-        # for stage in pipeline:
-        #     if "$match" in stage and "write_pattern" in stage["$match"]:
-        #         stage["$match"]["write_pattern"]["$eq"] = write_pattern
-        #     if "$match" in stage and "io_depth" in stage["$match"]:
-        #         stage["$match"]["io_depth"]["$eq"] = iodepth
-        for stage in pipeline:
-            if "$limit" in stage:
-                stage["$limit"] = limit
+        return self.aggregate_pipeline('stress', limit, since_id, until_id,
+                                       **options)
 
-        try:
-            result = list(self.collection.aggregate(pipeline))
-            if result:
-                return result[0]
-            else:
-                logger.error("No data found for aggregation.")
-                return None
-        except errors.PyMongoError as e:
-            logger.error(f"Error performing aggregation: {e}")
-            return None
\ No newline at end of file
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Maintain the derived collections of a results '
+                    'collection.')
+    parser.add_argument('--db-ip', default='192.168.0.128')
+    parser.add_argument('--db-port', type=int, default=27017)
+    parser.add_argument('--db-name', default='MLAutoRAID')
+    parser.add_argument('--collection', default='system')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    refresh = subparsers.add_parser(
+        'refresh_summaries',
+        help='Rebuild the materialized summaries from the whole collection')
+    refresh.add_argument('--loop', action='store_true',
+                         help='Keep rebuilding every --interval seconds')
+    refresh.add_argument('--interval', type=float, default=3600)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    mongodb = MongoDB(args.db_ip, args.db_port, args.db_name, args.collection)
+    while True:
+        refreshed = mongodb.refresh_summaries()
+        if refreshed:
+            logger.info(f'Rebuilt {mongodb.summary_collection().name}')
+        if not args.loop:
+            raise SystemExit(0 if refreshed else 1)
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
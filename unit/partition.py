@@ -0,0 +1,172 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# 逐文档处理、可在任意 `_id` 分区上独立执行的阶段
+LOCAL_STAGES = ('$match', '$project', '$unwind', '$addFields', '$set',
+                '$unset', '$replaceWith', '$replaceRoot', '$limit')
+# 在 `$limit` 之后出现时, 分区截断的文档与整体截断的不同
+LIMIT_SENSITIVE_STAGES = ('$match', '$unwind', '$addFields')
+# 按 `_id` 排序后, 各分区依次拼接的顺序与整体排序相同
+ID_SORT = {'_id': 1}
+# 可由各分区的部分结果在客户端合并的累加器
+MERGEABLE_ACCUMULATORS = ('$sum', '$avg', '$stdDevPop', '$min', '$max',
+                          '$push', '$addToSet', '$first', '$last')
+
+
+def _accumulators(group):
+    """Yields the (field, operator, expression) of a `$group` spec."""
+    for field, accumulator in group.items():
+        if field == '_id':
+            continue
+        (operator, expression), = accumulator.items()
+        yield field, operator, expression
+
+
+def _is_local(stage):
+    """Checks whether a stage can run on every partition on its own."""
+    operator = next(iter(stage))
+    return operator in LOCAL_STAGES or \
+        (operator == '$sort' and stage['$sort'] == ID_SORT)
+
+
+def is_partitionable(pipeline):
+    """
+    Checks whether a pipeline can run on `_id` partitions and be merged.
+
+    The pipeline must end in a `$group` of mergeable accumulators and every
+    stage before it must work document by document; a `$sort` on `_id`
+    alone also qualifies, as the partitions are merged in `_id` order. A
+    `$limit` stage is applied per partition, so it is only allowed when
+    every accumulator is a `$push` whose merged list can be truncated to
+    the limit again, when a `$sort` on `_id` precedes it, so that both the
+    serial and the partitioned run keep the first rows in `_id` rather than
+    natural order, and when no `$match`, `$unwind` or `$addFields` stage
+    follows it: every partition would then filter its own first documents
+    instead of the first documents of the whole collection.
+
+    Args:
+        pipeline (list): The pipeline stages.
+
+    Returns:
+        bool: Whether `partial_group` and `merge_groups` apply.
+    """
+    if not pipeline or '$group' not in pipeline[-1]:
+        return False
+    if not all(_is_local(stage) for stage in pipeline[:-1]):
+        return False
+    stages = [next(iter(stage)) for stage in pipeline[:-1]]
+    operators = [operator for _, operator, _ in
+                 _accumulators(pipeline[-1]['$group'])]
+    if any(operator not in MERGEABLE_ACCUMULATORS for operator in operators):
+        return False
+    if '$limit' not in stages:
+        return True
+    first_limit = stages.index('$limit')
+    after_limit = stages[first_limit + 1:]
+    return all(operator == '$push' for operator in operators) and \
+        '$sort' in stages[:first_limit] and \
+        not any(stage in LIMIT_SENSITIVE_STAGES for stage in after_limit)
+
+
+def pipeline_limit(pipeline):
+    """Returns the smallest `$limit` of a pipeline, or None."""
+    limits = [stage['$limit'] for stage in pipeline if '$limit' in stage]
+    return min(limits) if limits else None
+
+
+def partial_group(group):
+    """
+    Rewrites a `$group` spec into one emitting mergeable partial results.
+
+    `$avg` becomes a count and a sum and `$stdDevPop` additionally a sum of
+    squares, which add up across partitions; the other accumulators are
+    kept as they are.
+
+    Args:
+        group (dict): The `$group` spec.
+
+    Returns:
+        dict: The partial `$group` spec.
+    """
+    partial = {'_id': group['_id']}
+    for field, operator, expression in _accumulators(group):
+        if operator in ('$avg', '$stdDevPop'):
+            partial[f'{field}__count'] = {'$sum': {'$cond': [
+                {'$isNumber': expression}, 1, 0]}}
+            partial[f'{field}__sum'] = {'$sum': expression}
+            if operator == '$stdDevPop':
+                partial[f'{field}__sumsq'] = {'$sum': {'$multiply': [
+                    expression, expression]}}
+        else:
+            partial[field] = {operator: expression}
+    return partial
+
+
+def _group_key(value):
+    # 分组键可能是文档, 序列化后作为字典键
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def merge_groups(group, partials, limit=None):
+    """
+    Merges the partial results of the partitions into `$group` results.
+
+    Args:
+        group (dict): The original `$group` spec.
+        partials (list): One list of `partial_group` result documents per
+        partition, in `_id` order.
+        limit (int): Truncates every merged `$push` list (default: None).
+
+    Returns:
+        list: One document per group, like the original `$group` emits.
+    """
+    merged = {}
+    for documents in partials:
+        for document in documents:
+            key = _group_key(document['_id'])
+            if key not in merged:
+                merged[key] = []
+            merged[key].append(document)
+
+    results = []
+    for documents in merged.values():
+        result = {'_id': documents[0]['_id']}
+        for field, operator, _ in _accumulators(group):
+            values = [document.get(field) for document in documents]
+            if operator == '$sum':
+                value = sum(value or 0 for value in values)
+            elif operator in ('$avg', '$stdDevPop'):
+                count = sum(document[f'{field}__count']
+                            for document in documents)
+                total = sum(document[f'{field}__sum']
+                            for document in documents)
+                value = None
+                if count:
+                    value = total / count
+                    if operator == '$stdDevPop':
+                        sumsq = sum(document[f'{field}__sumsq']
+                                    for document in documents)
+                        value = math.sqrt(max(sumsq / count - value ** 2,
+                                              0.0))
+            elif operator in ('$min', '$max'):
+                present = [value for value in values if value is not None]
+                function = min if operator == '$min' else max
+                value = function(present) if present else None
+            elif operator == '$push':
+                value = [item for items in values for item in items or []]
+                if limit is not None:
+                    value = value[:limit]
+            elif operator == '$addToSet':
+                value = []
+                for items in values:
+                    value += [item for item in items or []
+                              if item not in value]
+            else:
+                value = values[0] if operator == '$first' else values[-1]
+            result[field] = value
+        results.append(result)
+    return results
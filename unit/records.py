@@ -0,0 +1,147 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def columnar_group(fields):
+    """
+    Generates a `$group` collecting metric rows as one array per field.
+
+    Missing fields are pushed as null, so the arrays stay aligned row by
+    row. The result is one document instead of one sub-document per row.
+
+    Args:
+        fields (list): The row fields to collect.
+
+    Returns:
+        dict: The `$group` stage.
+    """
+    group = {'_id': None}
+    for field in fields:
+        group[field] = {'$push': {'$ifNull': [f'${field}', None]}}
+    return {'$group': group}
+
+
+def _column_dtype(values):
+    """Infers the dtype of a column from its non-null values."""
+    present = [value for value in values if value is not None]
+    if not present:
+        return None
+    if all(isinstance(value, bool) for value in present):
+        return np.bool_ if len(present) == len(values) else object
+    if all(isinstance(value, int) and not isinstance(value, bool)
+           for value in present):
+        # 缺失值只能以 NaN 表示
+        return np.int64 if len(present) == len(values) else np.float64
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool)
+           for value in present):
+        return np.float64
+    if all(isinstance(value, str) for value in present):
+        return f'U{max(len(value) for value in present)}'
+    return object
+
+
+class MetricRecords(object):
+    """
+    Metric rows stored column by column in a NumPy structured array.
+
+    Rows are kept without a dict per row: metrics and integer parameters
+    are stored as native 8-byte values, missing metrics as NaN, and fields
+    missing from every row are dropped, like a DataFrame built from the
+    row dicts would not have them either.
+
+    Attributes:
+        array (ndarray): The structured array, one element per row.
+    """
+    def __init__(self, array):
+        self.array = array
+
+    @classmethod
+    def from_columns(cls, columns, fields=None):
+        """
+        Creates records from one list per field, as `columnar_group` emits.
+
+        Args:
+            columns (dict): The values of every field, null for missing.
+            fields (list): The fields to keep (default: None keeps every
+            list in `columns`).
+
+        Returns:
+            MetricRecords: The records.
+        """
+        if fields is None:
+            fields = [name for name, values in columns.items()
+                      if isinstance(values, list)]
+        dtypes = []
+        for field in fields:
+            dtype = _column_dtype(columns[field])
+            if dtype is not None:
+                dtypes.append((field, dtype))
+        size = len(columns[fields[0]]) if fields else 0
+        array = np.empty(size, dtype=dtypes)
+        for field, dtype in dtypes:
+            values = columns[field]
+            if dtype == np.float64:
+                # numpy 将 None 转换为 NaN
+                array[field] = np.array(values, dtype=np.float64)
+            else:
+                array[field] = values
+        return cls(array)
+
+    @classmethod
+    def from_rows(cls, rows, fields=None):
+        """
+        Creates records from row dicts.
+
+        Args:
+            rows (list): The row dicts.
+            fields (list): The fields to keep (default: None keeps every
+            field, in order of first appearance).
+
+        Returns:
+            MetricRecords: The records.
+        """
+        if fields is None:
+            fields = list(dict.fromkeys(key for row in rows for key in row))
+        return cls.from_columns({field: [row.get(field) for row in rows]
+                                 for field in fields}, fields)
+
+    @classmethod
+    def concat(cls, records):
+        """Concatenates records with the same fields."""
+        return cls(np.concatenate([record.array for record in records]))
+
+    @property
+    def fields(self):
+        """The stored field names."""
+        return list(self.array.dtype.names or ())
+
+    @property
+    def nbytes(self):
+        """The bytes held by the array."""
+        return self.array.nbytes
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, field):
+        return self.array[field]
+
+    def to_rows(self):
+        """Converts the records back into row dicts, e.g. for JSON output."""
+        fields = self.fields
+        return [dict(zip(fields, row)) for row in self.array.tolist()]
+
+    def to_dataframe(self):
+        """
+        Converts the records into a DataFrame, one column per field.
+
+        Returns:
+            DataFrame: The rows.
+        """
+        import pandas as pd
+
+        return pd.DataFrame({field: self.array[field]
+                             for field in self.fields})
@@ -0,0 +1,164 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import json
+import logging
+import zlib
+import bson
+from bson import Binary
+from unit import serializer
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MODES = ('collection', 'blob', 'drop')
+
+
+def _keep_tree(paths):
+    """Turns dotted paths into a nested dict of the fields to keep."""
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _project(value, tree):
+    if tree is True:
+        return value
+    if isinstance(value, list):
+        return [_project(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {key: _project(value[key], subtree)
+            for key, subtree in tree.items() if key in value}
+
+
+class ReportShaper(object):
+    """
+    Slims pytest-json-reports down to the fields the aggregations query.
+
+    Fields are kept by dotted path; a path through a list applies to every
+    element, e.g. 'tests.call.log.msg' keeps only the message of each log
+    record. The full report, and with `archive_log` the raw log text, are
+    archived according to the archive mode:
+
+    - 'collection': stored in a cold `<collection><archive_suffix>`
+      collection under the same `_id` as the slim document.
+    - 'blob': stored zlib-compressed in the `report_archive` and
+      `log_archive` fields.
+    - 'drop': discarded.
+
+    An archived log is replaced in the hot document by a reference
+    `{'archived': <mode>, 'bytes': <length>}`; no aggregation reads it.
+
+    Attributes:
+        keep (list): The dotted paths of the report fields to keep.
+        archive (str): The archive mode.
+        archive_suffix (str): The archive collection name suffix.
+        archive_log (bool): Whether the raw log leaves the hot document too.
+        compress_level (int): The zlib level of 'blob' archives.
+    """
+    def __init__(self, keep, archive='collection', archive_suffix='_archive',
+                 archive_log=True, compress_level=6):
+        if archive not in ARCHIVE_MODES:
+            raise ValueError(f'Unknown archive mode: {archive}')
+        self.keep = list(keep)
+        self.archive = archive
+        self.archive_suffix = archive_suffix
+        self.archive_log = archive_log
+        self.compress_level = compress_level
+        self._tree = _keep_tree(self.keep)
+
+    @classmethod
+    def from_config(cls, path='config/report_shape.json'):
+        """
+        Creates a shaper from a JSON configuration file.
+
+        Args:
+            path (str): The configuration with 'keep', 'archive',
+            'archive_suffix' and 'archive_log' keys.
+
+        Returns:
+            ReportShaper: The configured shaper.
+        """
+        with open(path, 'r') as file:
+            config = json.load(file)
+        return cls(**config)
+
+    def slim(self, report):
+        """
+        Projects a report onto the kept fields.
+
+        Returns:
+            dict: The slim report.
+        """
+        return _project(report, self._tree)
+
+    def shape(self, document):
+        """
+        Slims the report of a result document.
+
+        Args:
+            document (dict): A document with 'log' and 'report' fields.
+
+        Returns:
+            tuple: The hot document to insert, the archived fields to write
+            to the cold collection under the same `_id` ('report' and
+            possibly 'log'; None unless the mode is 'collection') and the
+            byte counts 'before', 'after' and 'saved'.
+        """
+        report = document['report']
+        hot_document = dict(document, report=self.slim(report))
+        archived = {'report': report}
+        log = document.get('log')
+        # 已归档的日志只剩引用, 重复整形时保持不变
+        if self.archive_log and isinstance(log, str):
+            hot_document['log'] = {'archived': self.archive,
+                                   'bytes': len(log.encode())}
+            archived['log'] = log
+
+        if self.archive == 'blob':
+            hot_document['report_archive'] = Binary(
+                zlib.compress(serializer.dumps(report), self.compress_level))
+            if 'log' in archived:
+                hot_document['log_archive'] = Binary(
+                    zlib.compress(log.encode(), self.compress_level))
+        archived = archived if self.archive == 'collection' else None
+
+        before = len(bson.encode(document))
+        after = len(bson.encode(hot_document))
+        stats = {'before': before, 'after': after, 'saved': before - after}
+        logger.info(f"Report slimmed from {before} to {after} bytes "
+                    f"(saved {stats['saved']} bytes, "
+                    f"{100.0 * stats['saved'] / before:.1f}%)")
+        return hot_document, archived, stats
+
+    @staticmethod
+    def restore(document):
+        """
+        Restores the full report of a document archived as a 'blob'.
+
+        Returns:
+            dict or None: The full report, or None if there is no blob.
+        """
+        blob = document.get('report_archive')
+        if blob is None:
+            return None
+        return serializer.loads(zlib.decompress(blob))
+
+    @staticmethod
+    def restore_log(document):
+        """
+        Restores the raw log of a document archived as a 'blob'.
+
+        Returns:
+            str or None: The log, or None if there is no blob.
+        """
+        blob = document.get('log_archive')
+        if blob is None:
+            return None
+        return zlib.decompress(blob).decode()
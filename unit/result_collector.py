@@ -0,0 +1,145 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import datetime
+import logging
+import time
+import uuid
+import pytest
+from unit.live_upload import RecordHandler, collection_for, outcome_of
+from unit.metrics import extract_metrics
+
+logger = logging.getLogger(__name__)
+
+RECORD_PROPERTY = 'metric_record'
+
+
+def is_worker(config):
+    """Whether pytest runs as a pytest-xdist worker."""
+    return hasattr(config, 'workerinput')
+
+
+def uses_xdist(config):
+    """Whether the session distributes tests to pytest-xdist workers."""
+    return is_worker(config) or \
+        config.getoption('dist', default='no') != 'no'
+
+
+class ResultCollector(object):
+    """
+    A pytest plugin collecting the results of a pytest-xdist session in the
+    controller and writing them once.
+
+    Workers keep the log messages carrying metrics of each test call and
+    attach them to the report's `user_properties`, which pytest-xdist
+    ships to the controller together with the report. The controller keeps
+    the last result of every test id, so reruns and duplicated reports
+    count once, and at the end of the session writes one pytest-json-report
+    shaped document per collection, each with a single `insert_documents`
+    call.
+    Workers never write to MongoDB and never read the shared report and
+    log files.
+
+    Attributes:
+        mongodb_factory (callable): Returns the `MongoDB` of a collection
+        name, see `collection_for`.
+        worker (bool): Whether this process is a worker, see `is_worker`.
+        session_id (str): Identifies the documents of this session.
+        tests (dict): The test entries by test id.
+    """
+    def __init__(self, mongodb_factory, worker=False):
+        self.mongodb_factory = mongodb_factory
+        self.worker = worker
+        self.session_id = uuid.uuid4().hex
+        self.tests = {}
+        self._phases = {}
+        self._paths = {}
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        handler = RecordHandler()
+        root = logging.getLogger()
+        root.addHandler(handler)
+        try:
+            yield
+        finally:
+            root.removeHandler(handler)
+            # 仅保留含指标的日志, 减小发往控制进程的数据量
+            item.user_properties.append((RECORD_PROPERTY, [
+                {'msg': record['msg']} for record in handler.records
+                if extract_metrics(record['msg'])]))
+
+    def pytest_runtest_logreport(self, report):
+        if self.worker:
+            return
+        phases = self._phases.setdefault(report.nodeid, {})
+        phases[report.when] = {'duration': report.duration,
+                               'outcome': report.outcome}
+        if report.when == 'call':
+            phases['call']['log'] = dict(report.user_properties).get(
+                RECORD_PROPERTY, [])
+        if report.when != 'teardown':
+            return
+        del self._phases[report.nodeid]
+        test = {'nodeid': report.nodeid,
+                'keywords': list(report.keywords),
+                'outcome': outcome_of(phases)}
+        test.update(phases)
+        # 同一测试的重复报告 (如失败重跑) 以最后一次为准
+        self.tests.pop(report.nodeid, None)
+        self.tests[report.nodeid] = test
+        self._paths[report.nodeid] = report.fspath
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self, session, exitstatus):
+        if self.worker:
+            return
+        self.write(int(exitstatus))
+
+    def documents(self, exitcode=0):
+        """
+        Groups the collected tests into one report document per collection.
+
+        Args:
+            exitcode (int): The session exit status.
+
+        Returns:
+            dict: The document of every collection name.
+        """
+        documents = {}
+        for nodeid, test in self.tests.items():
+            name = collection_for(self._paths[nodeid])
+            document = documents.setdefault(name, {
+                'session': self.session_id,
+                'report': {'created': time.time(), 'exitcode': exitcode,
+                           'collectors': [], 'tests': [],
+                           'summary': {'total': 0}},
+                'uploaded': datetime.datetime.now(datetime.timezone.utc)})
+            report = document['report']
+            # 测试已运行, 说明所在模块收集成功
+            module = nodeid.split('::')[0]
+            if module not in [collector['nodeid']
+                              for collector in report['collectors']]:
+                report['collectors'].append({'nodeid': module,
+                                             'outcome': 'passed'})
+            report['tests'].append(test)
+            summary = report['summary']
+            summary[test['outcome']] = summary.get(test['outcome'], 0) + 1
+            summary['total'] += 1
+        return documents
+
+    def write(self, exitcode=0):
+        """
+        Writes the collected tests with one insert per collection.
+
+        Returns:
+            int: The number of tests written.
+        """
+        written = 0
+        for name, document in self.documents(exitcode).items():
+            tests = len(document['report']['tests'])
+            if self.mongodb_factory(name).insert_documents([document]):
+                logger.error(f'Error writing {tests} test results to {name}')
+                continue
+            written += tests
+        logger.info(f'Wrote {written} of {len(self.tests)} test results '
+                    f'of session {self.session_id}')
+        return written
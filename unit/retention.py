@@ -0,0 +1,367 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import argparse
+import datetime
+import json
+import logging
+import threading
+import time
+from bson import ObjectId
+from pymongo import ASCENDING, errors
+from unit.metrics import METRIC_PATTERNS, metric_expression
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = 'config/retention.json'
+STATE_COLLECTION = 'retention_state'
+ACTIONS = ('summarize', 'rollup', 'unset', 'archive', 'delete')
+DUPLICATE_KEY = 11000
+# 与 MongoDB.summary_collection 的 '_summary' 区分
+RETAINED_SUFFIX = '_retained'
+DAILY_SUFFIX = '_daily'
+
+
+def cutoff_id(older_than_days, now=None, align_day=False):
+    """
+    Converts an age into the ObjectId bound of the documents older than it.
+
+    Args:
+        older_than_days (float): The minimum age in days.
+        now (datetime): The current UTC time (default: now).
+        align_day (bool): Whether to round the bound down to midnight UTC, so
+        that only whole days fall below it.
+
+    Returns:
+        ObjectId: Documents with a smaller `_id` are older than the age.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    cutoff = now - datetime.timedelta(days=older_than_days)
+    if align_day:
+        cutoff = cutoff.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ObjectId.from_datetime(cutoff)
+
+
+def metric_group_pipeline(prefix, group_id):
+    """
+    Generates the stages grouping the metric samples of passed tests.
+
+    Args:
+        prefix (str): The metric prefix, e.g. 'stress'.
+        group_id (dict): The `$group` key, which may use the '$run', '$test'
+        and '$day' fields.
+
+    Returns:
+        list: The stages emitting count/avg/min/max/std per metric.
+    """
+    accumulators = {'samples': {'$sum': 1}}
+    for name in METRIC_PATTERNS[prefix]:
+        field = f'$metrics.{name}'
+        accumulators.update({
+            f'{name}_count': {'$sum': {'$cond': [
+                {'$eq': [{'$type': field}, 'double']}, 1, 0]}},
+            f'{name}_avg': {'$avg': field},
+            f'{name}_min': {'$min': field},
+            f'{name}_max': {'$max': field},
+            f'{name}_std': {'$stdDevPop': field}
+        })
+    return [
+        {'$unwind': '$report.tests'},
+        {'$match': {'report.tests.outcome': 'passed'}},
+        {'$unwind': '$report.tests.call.log'},
+        {'$project': {
+            'run': '$_id',
+            'test': '$report.tests.nodeid',
+            'day': {'$dateToString': {'format': '%Y-%m-%d',
+                                      'date': {'$toDate': '$_id'}}},
+            'metrics': metric_expression(prefix,
+                                         '$report.tests.call.log.msg')
+        }},
+        {'$match': {'metrics': {'$ne': {}}}},
+        {'$group': dict({'_id': group_id}, **accumulators)}
+    ]
+
+
+class RateLimiter(object):
+    """
+    Spreads work so that no more than `rate` documents are processed per
+    second on average. One limiter may be shared by several threads.
+
+    Attributes:
+        rate (float): The documents per second, or None for no limit.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._start = time.monotonic()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def wait(self, count):
+        """Records `count` processed documents and sleeps off any excess."""
+        if not self.rate:
+            return
+        with self._lock:
+            self._count += count
+            delay = self._count / self.rate - \
+                (time.monotonic() - self._start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RetentionEngine(object):
+    """
+    Applies declarative retention policies to the results collections.
+
+    Policies run in the order they are listed, so summaries and rollups
+    should come before the policies that remove the raw data. Each policy
+    selects the documents of a collection older than `older_than_days` by
+    `_id` and applies one action:
+
+    - 'summarize': per-run, per-test metric stats into
+      `<collection>_retained`.
+    - 'rollup': daily per-test metric stats into `<collection>_daily`.
+    - 'unset': removes `fields` from the documents, e.g. the raw log.
+    - 'archive': moves the documents into `into` (default
+      `<collection>_expired`).
+    - 'delete': deletes the documents.
+
+    Summaries and rollups advance a watermark kept in `retention_state`, so
+    each document is aggregated once and an interrupted run resumes where
+    it stopped. The other actions work in `_id`-ordered batches.
+
+    Attributes:
+        db (Database): The database holding the collections.
+        policies (list): The policy dicts.
+        batch_size (int): The documents per batch or summary window.
+        rate_limit (float): The documents processed per second, or None.
+        dry_run (bool): Whether to count the documents without changing them.
+    """
+    def __init__(self, mongodb, policies, batch_size=500, rate_limit=None,
+                 dry_run=False):
+        for policy in policies:
+            if policy['action'] not in ACTIONS:
+                raise ValueError(f"Unknown retention action in policy "
+                                 f"{policy['name']}: {policy['action']}")
+        self.db = mongodb.db
+        self.policies = policies
+        self.batch_size = batch_size
+        self.rate_limit = rate_limit
+        self.dry_run = dry_run
+        self.state = self.db[STATE_COLLECTION]
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, mongodb, path=CONFIG_PATH, **kwargs):
+        """
+        Creates an engine from a JSON configuration file.
+
+        Args:
+            mongodb (MongoDB): The database connection.
+            path (str): The configuration with 'policies' and optional
+            'batch_size' and 'rate_limit' keys.
+            **kwargs: Overrides of the configured arguments.
+
+        Returns:
+            RetentionEngine: The configured engine.
+        """
+        with open(path, 'r') as file:
+            config = json.load(file)
+        config.pop('interval', None)
+        config.update(kwargs)
+        return cls(mongodb, **config)
+
+    def run(self, now=None):
+        """
+        Applies every policy once.
+
+        Args:
+            now (datetime): The current UTC time (default: now).
+
+        Returns:
+            dict: The number of documents each policy processed, by name.
+        """
+        limiter = RateLimiter(self.rate_limit)
+        processed = {}
+        for policy in self.policies:
+            if self._stop.is_set():
+                break
+            start = time.monotonic()
+            try:
+                count = getattr(self, f"_{policy['action']}")(
+                    policy, now, limiter)
+            except Exception as e:
+                # 后续策略可能依赖本策略的汇总结果, 不能继续删除原始数据
+                logger.error(f"Retention policy {policy['name']} failed, "
+                             f"skipping the remaining policies: {e!r}")
+                break
+            processed[policy['name']] = count
+            logger.info(f"Retention policy {policy['name']}: {count} "
+                        f"documents in {time.monotonic() - start:.1f}s"
+                        f"{' (dry run)' if self.dry_run else ''}")
+        return processed
+
+    def run_forever(self, interval=86400):
+        """
+        Runs the policies every `interval` seconds until stopped. A failed
+        cycle is logged and the next one runs as scheduled.
+        """
+        while not self._stop.is_set():
+            try:
+                self.run()
+            except Exception:
+                logger.exception('Retention cycle failed')
+            self._stop.wait(interval)
+
+    def start(self, interval=86400):
+        """
+        Runs the policies every `interval` seconds on a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run_forever,
+                                        args=(interval,), name='retention',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops the background thread after its current batch."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _summarize(self, policy, now, limiter):
+        return self._aggregate_windows(
+            policy, now, limiter, policy['collection'] + RETAINED_SUFFIX,
+            {'prefix': policy['prefix'], 'run': '$run', 'test': '$test'},
+            align_day=False)
+
+    def _rollup(self, policy, now, limiter):
+        return self._aggregate_windows(
+            policy, now, limiter, policy['collection'] + DAILY_SUFFIX,
+            {'prefix': policy['prefix'], 'day': '$day', 'test': '$test'},
+            align_day=True)
+
+    def _aggregate_windows(self, policy, now, limiter, into, group_id,
+                           align_day):
+        collection = self.db[policy['collection']]
+        until_id = cutoff_id(policy['older_than_days'], now, align_day)
+        watermark = self.state.find_one({'_id': policy['name']}) or {}
+        since_id = watermark.get('until_id')
+        total = 0
+        while not self._stop.is_set():
+            id_range = {'$lt': until_id}
+            if since_id is not None:
+                id_range['$gte'] = since_id
+            first = collection.find_one({'_id': id_range}, {'_id': 1},
+                                        sort=[('_id', ASCENDING)])
+            if first is None:
+                break
+            if align_day:
+                # 按整天划分窗口, 每天只汇总一次
+                window_end = cutoff_id(-1, first['_id'].generation_time,
+                                       align_day=True)
+            else:
+                following = list(collection.find({'_id': id_range}, {'_id': 1})
+                                 .sort('_id', ASCENDING)
+                                 .skip(self.batch_size).limit(1))
+                window_end = following[0]['_id'] if following else until_id
+            id_range['$lt'] = min(window_end, until_id)
+            count = collection.count_documents({'_id': id_range})
+            if not self.dry_run:
+                pipeline = [{'$match': {'_id': id_range}}]
+                pipeline += metric_group_pipeline(policy['prefix'], group_id)
+                pipeline.append({'$merge': {'into': into,
+                                            'whenMatched': 'replace',
+                                            'whenNotMatched': 'insert'}})
+                collection.aggregate(pipeline, allowDiskUse=True)
+                self.state.update_one({'_id': policy['name']},
+                                      {'$set': {'until_id': id_range['$lt']}},
+                                      upsert=True)
+            total += count
+            since_id = id_range['$lt']
+            limiter.wait(count)
+        return total
+
+    def _unset(self, policy, now, limiter):
+        fields = policy['fields']
+        query = {'$or': [{field: {'$exists': True}} for field in fields]}
+        return self._batched(policy, now, limiter, query, lambda ids: (
+            self.db[policy['collection']].update_many(
+                {'_id': {'$in': ids}},
+                {'$unset': {field: '' for field in fields}})))
+
+    def _archive(self, policy, now, limiter):
+        collection = self.db[policy['collection']]
+        into = self.db[policy.get('into',
+                                  f"{policy['collection']}_expired")]
+
+        def move(ids):
+            documents = list(collection.find({'_id': {'$in': ids}}))
+            try:
+                into.insert_many(documents, ordered=False)
+            except errors.BulkWriteError as e:
+                # 重跑时已归档的文档会重复, 其余错误则保留原文档
+                if any(error['code'] != DUPLICATE_KEY
+                       for error in e.details.get('writeErrors', [])):
+                    raise
+            collection.delete_many({'_id': {'$in': ids}})
+
+        return self._batched(policy, now, limiter, {}, move)
+
+    def _delete(self, policy, now, limiter):
+        return self._batched(policy, now, limiter, {}, lambda ids: (
+            self.db[policy['collection']].delete_many({'_id': {'$in': ids}})))
+
+    def _batched(self, policy, now, limiter, query, apply):
+        collection = self.db[policy['collection']]
+        until_id = cutoff_id(policy['older_than_days'], now)
+        last_id = None
+        total = 0
+        while not self._stop.is_set():
+            id_range = {'$lt': until_id}
+            if last_id is not None:
+                id_range['$gt'] = last_id
+            ids = [document['_id'] for document in
+                   collection.find(dict(query, _id=id_range), {'_id': 1})
+                   .sort('_id', ASCENDING).limit(self.batch_size)]
+            if not ids:
+                break
+            if not self.dry_run:
+                apply(ids)
+            total += len(ids)
+            last_id = ids[-1]
+            limiter.wait(len(ids))
+        return total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Apply the retention policies to the results collections.')
+    parser.add_argument('--db-ip', default='192.168.0.128')
+    parser.add_argument('--db-port', type=int, default=27017)
+    parser.add_argument('--db-name', default='MLAutoRAID')
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--loop', action='store_true',
+                        help='Keep running at the configured interval')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    with open(args.config, 'r') as file:
+        interval = json.load(file).get('interval', 86400)
+    # unit.mongodb 经 unit.migration 导入本模块, 在此导入以避免循环
+    from unit.mongodb import MongoDB
+
+    mongodb = MongoDB(args.db_ip, args.db_port, args.db_name, STATE_COLLECTION)
+    engine = RetentionEngine.from_config(mongodb, args.config,
+                                         dry_run=args.dry_run)
+    if args.loop:
+        engine.run_forever(interval)
+    else:
+        engine.run()
+
+
+if __name__ == '__main__':
+    main()
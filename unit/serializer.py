@@ -0,0 +1,114 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import base64
+import datetime
+import json
+import logging
+import mmap
+import uuid
+from bson import Binary, Decimal128, ObjectId, Timestamp
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# 可选的高速 JSON 库; 未安装 orjson 时退回标准库
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def _default(obj):
+    """Encodes the BSON types pymongo returns that JSON has no type for."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    if isinstance(obj, Decimal128):
+        return str(obj.to_decimal())
+    if isinstance(obj, Timestamp):
+        return {'t': obj.time, 'i': obj.inc}
+    if isinstance(obj, (Binary, bytes)):
+        return base64.b64encode(obj).decode('ascii')
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON '
+                    f'serializable')
+
+
+def loads(data):
+    """
+    Decodes a JSON document.
+
+    Args:
+        data (bytes or str): The JSON text.
+
+    Returns:
+        The decoded object.
+
+    Raises:
+        JSONDecodeError: If the data is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_file(path):
+    """
+    Decodes a JSON file.
+
+    With orjson the file is memory-mapped and decoded straight from the
+    mapping, without first copying it into a Python string.
+
+    Args:
+        path (str): The JSON file.
+
+    Returns:
+        The decoded object.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        JSONDecodeError: If the file is not valid JSON.
+    """
+    with open(path, 'rb') as file:
+        if orjson is None:
+            return json.load(file)
+        try:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            return orjson.loads(file.read())
+        with mapping, memoryview(mapping) as view:
+            return orjson.loads(view)
+
+
+def dumps(obj):
+    """
+    Encodes an object as JSON.
+
+    ObjectId, datetime and the other BSON types are encoded natively: ids
+    and decimals as strings, datetimes as ISO 8601 and binary as base64.
+
+    Returns:
+        bytes: The UTF-8 JSON text.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default,
+                            option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default).encode()
+
+
+def dump_file(obj, path):
+    """
+    Encodes an object as JSON into a file.
+
+    Args:
+        obj: The object to encode.
+        path (str): The file to write.
+
+    Raises:
+        IOError: If the file cannot be written.
+    """
+    with open(path, 'wb') as file:
+        file.write(dumps(obj))
@@ -0,0 +1,164 @@
+'''Copyright (c) 2024 Jaron Cheng'''
+import logging
+import math
+from collections import defaultdict
+from unit.metrics import extract_metrics, parse_io_operation
+
+logger = logging.getLogger(__name__)
+
+RELATIVE_ACCURACY = 0.01
+# 小于该值的样本 (如 0 IOPS) 计入零桶, 对数桶无法表示
+MIN_POSITIVE = 1e-9
+
+
+class QuantileSketch(object):
+    """
+    A mergeable quantile sketch with a relative error guarantee (DDSketch).
+
+    Samples are counted in logarithmic buckets whose bounds grow by a factor
+    gamma = (1 + alpha) / (1 - alpha), so every quantile is estimated within
+    a relative error alpha of a true sample, whatever the number of samples.
+    Memory grows only with the logarithm of the value range, and sketches of
+    the same accuracy merge exactly by adding bucket counts.
+
+    Attributes:
+        relative_accuracy (float): The relative error bound alpha.
+        bins (dict): The sample count of every bucket index.
+        zero_count (int): The samples too small for a bucket, e.g. 0 IOPS.
+        count (int): The total number of samples.
+        min (float): The smallest sample, or None.
+        max (float): The largest sample, or None.
+    """
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('The relative accuracy must be in (0, 1)')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = defaultdict(int)
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def index(self, value):
+        """Returns the bucket (gamma^(i-1), gamma^i] holding a value."""
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def add(self, value, count=1):
+        """
+        Adds a sample.
+
+        Args:
+            value (float): The non-negative sample.
+            count (int): The number of times to add it (default: 1).
+
+        Raises:
+            ValueError: If the value is negative.
+        """
+        if value < 0:
+            raise ValueError(f'Cannot add negative value {value}')
+        if value < MIN_POSITIVE:
+            self.zero_count += count
+        else:
+            self.bins[self.index(value)] += count
+        self.count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """
+        Adds the samples of another sketch to this one.
+
+        Raises:
+            ValueError: If the sketches have different accuracies.
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Cannot merge sketches of different accuracy')
+        for index, count in other.bins.items():
+            self.bins[index] += count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for bound, pick in (('min', min), ('max', max)):
+            values = [value for value in (getattr(self, bound),
+                                          getattr(other, bound))
+                      if value is not None]
+            setattr(self, bound, pick(values) if values else None)
+        return self
+
+    def quantile(self, q):
+        """
+        Estimates a quantile.
+
+        Args:
+            q (float): The quantile in [0, 1], e.g. 0.99.
+
+        Returns:
+            float or None: The estimate, or None if the sketch is empty.
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        cumulative = self.zero_count
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Returns the sketch as a document; bucket indexes become string keys.
+        """
+        return {'relative_accuracy': self.relative_accuracy,
+                'count': self.count, 'zero_count': self.zero_count,
+                'min': self.min, 'max': self.max,
+                'bins': {str(index): count
+                         for index, count in self.bins.items()}}
+
+    @classmethod
+    def from_dict(cls, document):
+        """Restores a sketch from `to_dict` or a stored sketch document."""
+        sketch = cls(document.get('relative_accuracy', RELATIVE_ACCURACY))
+        for index, count in document.get('bins', {}).items():
+            sketch.bins[int(index)] += count
+        sketch.zero_count = document.get('zero_count', 0)
+        sketch.count = document.get('count', 0)
+        sketch.min = document.get('min')
+        sketch.max = document.get('max')
+        return sketch
+
+
+def sketch_report(report, relative_accuracy=RELATIVE_ACCURACY):
+    """
+    Sketches the metric samples of the passed I/O tests of a report.
+
+    Args:
+        report (dict): A pytest-json-report.
+        relative_accuracy (float): The accuracy of the sketches.
+
+    Returns:
+        dict: A sketch keyed by (prefix, configuration items, metric), where
+        the configuration items are the (name, value) pairs returned by
+        `parse_io_operation`, write pattern first.
+    """
+    sketches = {}
+    for test in report.get('tests', []):
+        if test.get('outcome') != 'passed':
+            continue
+        parsed = parse_io_operation(test.get('keywords', []))
+        if parsed is None:
+            continue
+        prefix, configuration = parsed
+        configuration = tuple(configuration.items())
+        for record in test.get('call', {}).get('log', []):
+            for metric, value in extract_metrics(record.get('msg'),
+                                                 prefix).items():
+                key = (prefix, configuration, metric)
+                if key not in sketches:
+                    sketches[key] = QuantileSketch(relative_accuracy)
+                sketches[key].add(value)
+    return sketches